@@ -0,0 +1,162 @@
+import asyncio
+import itertools
+import math
+import threading
+import time
+
+# 服务时间的指数滑动平均系数，用来估计Retry-After
+SERVICE_TIME_SMOOTHING = 0.2
+
+def wake_future(future):
+    if not future.done():
+        future.set_result(None)
+
+class Overloaded(Exception):
+    def __init__(self, lane, retry_after):
+        super().__init__(lane)
+        self.lane = lane
+        self.retry_after = retry_after
+
+class Lane:
+    def __init__(self, name, priority, limit, queue, wait, per_client):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.per_client = per_client
+        self.active = 0
+        self.waiting = 0
+        self.clients = {}
+        self.queued_clients = {}
+        self.service_time = 0.1
+
+class Ticket:
+    def __init__(self, lane, client):
+        self.lane = lane
+        self.client = client
+        self.started = None
+        self.wake = None
+        self.granted = False
+        self.released = False
+
+class AdmissionController:
+    # 所有通道共享total个并发名额：每个通道另有自己的并发上限、排队长度和每个客户端的上限，
+    # 有名额空出时先分给优先级高（priority小）的通道中排队最久的请求
+    def __init__(self, total, lanes):
+        self.total = total
+        self.lanes = {name: Lane(name, **config) for name, config in lanes.items()}
+        self.active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+    
+    def _eligible(self, lane, client):
+        return (self.active < self.total and lane.active < lane.limit
+                and lane.clients.get(client, 0) < lane.per_client)
+    
+    def _grant(self, ticket):
+        lane = self.lanes[ticket.lane]
+        self.active += 1
+        lane.active += 1
+        lane.clients[ticket.client] = lane.clients.get(ticket.client, 0) + 1
+        ticket.granted = True
+        ticket.started = time.monotonic()
+    
+    def _dequeue(self, ticket):
+        lane = self.lanes[ticket.lane]
+        self._waiters = [entry for entry in self._waiters if entry[2] is not ticket]
+        lane.waiting -= 1
+        remaining = lane.queued_clients[ticket.client] - 1
+        if remaining:
+            lane.queued_clients[ticket.client] = remaining
+        else:
+            del lane.queued_clients[ticket.client]
+    
+    def _dispatch(self):
+        woken = []
+        for entry in sorted(self._waiters):
+            ticket = entry[2]
+            if self.active >= self.total:
+                break
+            if self._eligible(self.lanes[ticket.lane], ticket.client):
+                self._dequeue(ticket)
+                self._grant(ticket)
+                woken.append(ticket)
+        return woken
+    
+    def retry_after(self, lane):
+        # 按当前排队长度和平均服务时间估计多久之后能排上，至少1秒
+        return max(1, math.ceil(lane.service_time * (lane.waiting + 1) / max(lane.limit, 1)))
+    
+    def _enter(self, lane_name, client, wake):
+        lane = self.lanes[lane_name]
+        ticket = Ticket(lane_name, client)
+        with self._lock:
+            if self._eligible(lane, client):
+                self._grant(ticket)
+                return ticket
+            if lane.waiting >= lane.queue or lane.queued_clients.get(client, 0) >= lane.per_client:
+                raise Overloaded(lane_name, self.retry_after(lane))
+            ticket.wake = wake
+            lane.waiting += 1
+            lane.queued_clients[client] = lane.queued_clients.get(client, 0) + 1
+            self._waiters.append((lane.priority, next(self._sequence), ticket))
+        return ticket
+    
+    def _withdraw(self, ticket):
+        # 放弃排队；如果恰好在放弃的同时拿到了名额返回True
+        with self._lock:
+            if ticket.granted:
+                return True
+            self._dequeue(ticket)
+            return False
+    
+    def _abandon(self, ticket):
+        # 等待超时：拿到了名额就照常处理，否则拒绝
+        if self._withdraw(ticket):
+            return ticket
+        raise Overloaded(ticket.lane, self.retry_after(self.lanes[ticket.lane]))
+    
+    def acquire(self, lane_name, client):
+        event = threading.Event()
+        ticket = self._enter(lane_name, client, event.set)
+        if ticket.granted or event.wait(self.lanes[lane_name].wait):
+            return ticket
+        return self._abandon(ticket)
+    
+    async def acquire_async(self, lane_name, client):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        ticket = self._enter(lane_name, client, lambda: loop.call_soon_threadsafe(wake_future, future))
+        if ticket.granted:
+            return ticket
+        try:
+            await asyncio.wait_for(future, self.lanes[lane_name].wait)
+        except asyncio.TimeoutError:
+            return self._abandon(ticket)
+        except asyncio.CancelledError:
+            # 客户端在排队时断开：已经拿到的名额要还回去
+            if self._withdraw(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+    
+    def release(self, ticket):
+        with self._lock:
+            if ticket.released or not ticket.granted:
+                return
+            ticket.released = True
+            lane = self.lanes[ticket.lane]
+            self.active -= 1
+            lane.active -= 1
+            remaining = lane.clients[ticket.client] - 1
+            if remaining:
+                lane.clients[ticket.client] = remaining
+            else:
+                del lane.clients[ticket.client]
+            elapsed = time.monotonic() - ticket.started
+            lane.service_time += SERVICE_TIME_SMOOTHING * (elapsed - lane.service_time)
+            woken = self._dispatch()
+        for waiter in woken:
+            waiter.wake()
@@ -0,0 +1,249 @@
+import csv
+import functools
+import gzip
+import json
+import multiprocessing
+import os
+import tempfile
+from collections import Counter, defaultdict
+
+from surveys import iter_stages
+
+STATE_FILE = 'state.json.gz'
+# 2: 按注册表中阶段的answer_type整理答案
+STATE_VERSION = 2
+POOL_THRESHOLD = 20000
+POOL_CHUNK_SIZE = 256
+
+def survey_answer_types(surveys):
+    # 每个问卷用到的答案类型，按阶段的注册顺序
+    answer_types = {}
+    for stage in iter_stages(surveys):
+        types = answer_types.setdefault(stage['survey'], [])
+        if stage['answer_type'] not in types:
+            types.append(stage['answer_type'])
+    return answer_types
+
+def paired_options(surveys, survey_id):
+    # 成对比较问卷所有阶段声明过的选项，以及计算占比的preferred_option
+    options = []
+    preferred = None
+    for stage in iter_stages(surveys, survey_id):
+        if stage['answer_type'] != 'paired':
+            continue
+        for option in stage['options']:
+            if option['id'] not in options:
+                options.append(option['id'])
+        preferred = preferred or stage['preferred_option']
+    return options, preferred
+
+def aggregate_tables(surveys):
+    # 表格由注册表决定：boolean阶段输出各答案人数，label阶段输出各标签得票和每题汇总，paired阶段输出每对音频各选项的人数
+    tables = {}
+    for survey_id, answer_types in survey_answer_types(surveys).items():
+        for answer_type in answer_types:
+            if answer_type == 'boolean':
+                tables[f'survey{survey_id}_answers.csv'] = ['stage', 'dataset_version', 'item_index', 'answer', 'count']
+            elif answer_type == 'label':
+                tables[f'survey{survey_id}_tags.csv'] = ['stage', 'dataset_version', 'item_index', 'tag', 'votes', 'sample_selected']
+                tables[f'survey{survey_id}_items.csv'] = [
+                    'stage', 'dataset_version', 'item_index', 'sample_selected', 'responses', 'selected_votes', 'selected_rate'
+                ]
+            else:
+                options, preferred = paired_options(surveys, survey_id)
+                tables[f'survey{survey_id}_pairs.csv'] = (
+                    ['dataset_version', 'pair_key'] + options + ['first_position', 'responses', f'{preferred}_rate']
+                )
+    return tables
+
+def stage_answer_types(surveys):
+    return {(stage['survey'], stage['name']): stage['answer_type'] for stage in iter_stages(surveys)}
+
+def answer_label(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value if value is not None else '').strip()
+
+def extract_contribution(answer_types, entry):
+    position, student_id, filename, payload = entry
+    try:
+        record = json.loads(payload)
+    except ValueError:
+        return position, student_id, filename, None
+    if not isinstance(record, dict):
+        return position, student_id, filename, None
+    
+    survey_type = record.get('survey_type')
+    # 注册表中已经没有的阶段不参与统计
+    answer_type = answer_types.get((survey_type, record.get('stage')))
+    answers = [answer for answer in record.get('answers') or [] if isinstance(answer, dict)]
+    if answer_type == 'paired':
+        rows = [[
+            str(answer.get('pair_key') or ''),
+            answer_label(answer.get('selected_option')),
+            answer.get('selected_position')
+        ] for answer in answers]
+    elif answer_type is not None:
+        rows = [[answer.get('item_index'), answer_label(answer.get('answer'))] for answer in answers]
+    else:
+        return position, student_id, filename, None
+    contribution = {
+        'survey': survey_type,
+        'type': answer_type,
+        'stage': record.get('stage') or '',
+        'version': record.get('dataset_version') or '',
+        'answers': rows
+    }
+    return position, str(record.get('student_id') or student_id), filename, contribution
+
+def read_state(path, store_kind):
+    state = None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            state = json.load(f)
+    except (TypeError, OSError, ValueError):
+        pass
+    if not state or state.get('version') != STATE_VERSION or state.get('store') != store_kind:
+        return {'version': STATE_VERSION, 'store': store_kind, 'cursor': None, 'contributions': {}}
+    return state
+
+def write_atomic(path, write, mode='wb', **options):
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, mode, **options) as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def write_state(path, state):
+    def write(f):
+        with gzip.GzipFile(fileobj=f, mode='wb') as compressed:
+            compressed.write(json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    write_atomic(path, write)
+
+def write_table(path, header, rows):
+    def write(f):
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    # 带BOM便于直接用Excel打开
+    write_atomic(path, write, 'w', encoding='utf-8-sig', newline='')
+
+def iter_contributions(entries, workers, answer_types):
+    extract = functools.partial(extract_contribution, answer_types)
+    if workers <= 1:
+        for entry in entries:
+            yield extract(entry)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(extract, entries, chunksize=POOL_CHUNK_SIZE)
+
+def rate(part, total):
+    return round(part / total, 4) if total else ''
+
+def sort_key(key):
+    return tuple(
+        (0, int(value), '') if isinstance(value, int) or (isinstance(value, str) and value.isdigit()) else (1, 0, str(value))
+        for value in key
+    )
+
+def label_tables(votes, references):
+    items = defaultdict(Counter)
+    tag_rows = []
+    for key in sorted(votes, key=sort_key):
+        stage, version, item_index, tag = key
+        selected = references.get((stage, version), {}).get(item_index, '')
+        tag_rows.append([stage, version, item_index, tag, votes[key], int(bool(selected) and tag == selected)])
+        items[(stage, version, item_index)][tag] += votes[key]
+    item_rows = []
+    for key in sorted(items, key=sort_key):
+        stage, version, item_index = key
+        selected = references.get((stage, version), {}).get(item_index, '')
+        item_votes = items[key]
+        responses = sum(item_votes.values())
+        selected_votes = item_votes.get(selected, 0) if selected else ''
+        item_rows.append([
+            stage, version, item_index, selected, responses, selected_votes,
+            rate(selected_votes, responses) if selected else ''
+        ])
+    return tag_rows, item_rows
+
+def pair_rows(pairs, options, preferred):
+    rows = []
+    for (version, pair_key), (votes, first) in sorted(pairs.items(), key=lambda entry: sort_key(entry[0])):
+        counts = [votes.get(option, 0) for option in options]
+        responses = sum(counts)
+        rows.append([version, pair_key] + counts + [first, responses, rate(votes.get(preferred, 0), responses)])
+    return rows
+
+def build_tables(contributions, references, surveys):
+    # references: (问卷, 阶段名, 数据版本) -> {题号: 参考答案}
+    answers = defaultdict(Counter)
+    labels = defaultdict(Counter)
+    pairs = defaultdict(lambda: defaultdict(lambda: [Counter(), 0]))
+    for contribution in contributions.values():
+        survey, stage, version = contribution['survey'], contribution['stage'], contribution['version']
+        if contribution['type'] == 'paired':
+            for pair_key, option, position in contribution['answers']:
+                counts = pairs[survey][(version, pair_key)]
+                counts[0][option] += 1
+                if position == 0:
+                    counts[1] += 1
+        elif contribution['type'] == 'boolean':
+            for item_index, answer in contribution['answers']:
+                answers[survey][(stage, version, item_index, answer)] += 1
+        else:
+            for item_index, tag in contribution['answers']:
+                labels[survey][(stage, version, item_index, tag)] += 1
+    
+    tables = {}
+    for survey_id, answer_types in survey_answer_types(surveys).items():
+        if 'boolean' in answer_types:
+            votes = answers[survey_id]
+            tables[f'survey{survey_id}_answers.csv'] = [list(key) + [votes[key]] for key in sorted(votes, key=sort_key)]
+        if 'label' in answer_types:
+            survey_references = {
+                (stage, version): answer_map for (survey, stage, version), answer_map in references.items() if survey == survey_id
+            }
+            tables[f'survey{survey_id}_tags.csv'], tables[f'survey{survey_id}_items.csv'] = label_tables(
+                labels[survey_id], survey_references
+            )
+        if 'paired' in answer_types:
+            tables[f'survey{survey_id}_pairs.csv'] = pair_rows(pairs[survey_id], *paired_options(surveys, survey_id))
+    return tables
+
+def aggregate_submissions(store, output_dir, surveys, references=None, workers=1, full=False):
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, STATE_FILE)
+    store_kind = type(store).__name__
+    state = read_state(None if full else state_path, store_kind)
+    contributions = state['contributions']
+    
+    pending = store.count_since(state['cursor'])
+    processed = 0
+    cursor = state['cursor']
+    entries = store.records_since(state['cursor'])
+    answer_types = stage_answer_types(surveys)
+    pool_workers = workers if pending >= POOL_THRESHOLD else 1
+    for position, student_id, filename, contribution in iter_contributions(entries, pool_workers, answer_types):
+        cursor = position if cursor is None else max(cursor, position)
+        processed += 1
+        if contribution is not None:
+            contributions[f'{student_id}\t{filename}'] = contribution
+    state['cursor'] = cursor
+    
+    tables = build_tables(contributions, references or {}, surveys)
+    for name, header in aggregate_tables(surveys).items():
+        write_table(os.path.join(output_dir, name), header, tables[name])
+    write_state(state_path, state)
+    return {
+        'processed': processed,
+        'submissions': len(contributions),
+        'tables': {name: len(rows) for name, rows in tables.items()},
+        'output_dir': output_dir
+    }
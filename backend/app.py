@@ -1,53 +1,356 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, g
 from flask_cors import CORS
+from werkzeug.wsgi import wrap_file
 import os
 import json
 import tarfile
-import random
 import shutil
+import tempfile
+import threading
+import argparse
+import atexit
+import hashlib
+import hmac
+import secrets
+import time
+import subprocess
+import sys
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from functools import lru_cache
 from datetime import datetime
 
+from admission import AdmissionController, Overloaded
+from aggregate import aggregate_submissions, aggregate_tables
+from audio_store import (
+    INDEX_VERSION, ArchiveHandle, AudioSource, BlobStore, FileIndexStore, LazyTarIndex, RedisIndexStore, archive_signature,
+    blob_filename, clip_fields, file_signature, index_tar_file, is_plain_tar, load_index, plan_audio_response
+)
+from checkpoints import CheckpointStore
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from payloads import PreparedPayload, plan_payload_response
+from stage_index import read_stage_index, stage_fingerprint, write_stage_index
+from telemetry import (
+    GROUPS as TELEMETRY_GROUPS, MAX_BEACON_BYTES, BeaconError, TelemetryStore, client_network, decode_beacon, event_rows
+)
+from transcode import RenditionCache
+from submission_store import CompletionIndex, FileSubmissionStore, RedisSubmissionStore, SQLiteSubmissionStore, export_submissions
+from surveys import (
+    build_stage_items, completion_files, grade_answers, item_clips, iter_stages, load_registry, map_item_clips, option_order,
+    record_answers, resolve_stage, valid_answers, valid_checkpoint_answers
+)
+
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_FOLDER = os.path.join(BASE_DIR, 'data')
-OUTPUT_FOLDER = os.path.join(BASE_DIR, 'output_data')
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-
-os.makedirs(DATA_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'survey1'), exist_ok=True)
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'survey2'), exist_ok=True)
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'survey3'), exist_ok=True)
+DATA_FOLDER = os.environ.get('SURVEY_DATA_FOLDER') or os.path.join(BASE_DIR, 'data')
+OUTPUT_FOLDER = os.environ.get('SURVEY_OUTPUT_FOLDER') or os.path.join(BASE_DIR, 'output_data')
+UPLOAD_FOLDER = os.environ.get('SURVEY_UPLOAD_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 
-survey_data_cache = {}
-SURVEY1_STAGE_FILES = {
-    'guide': 'guide5.tar',
-    'test': 'test20.tar'
+INDEX_FOLDER = os.path.join(UPLOAD_FOLDER, 'index')
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'blobs')
+WAVEFORM_FILE = 'waveforms.npz'
+SERVE_AUDIO_FROM_TAR = os.environ.get('SERVE_AUDIO_FROM_TAR', '1') != '0'
+SUBMISSION_STORE = os.environ.get('SUBMISSION_STORE', 'sqlite')
+INDEX_STORE = os.environ.get('INDEX_STORE', 'redis' if SUBMISSION_STORE == 'redis' else 'files')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_PREFIX = os.environ.get('REDIS_PREFIX', 'survey')
+SUBMISSION_DB_FILE = 'submissions.db'
+CHECKPOINT_DB_FILE = 'checkpoints.db'
+CHECKPOINT_FLUSH_INTERVAL = float(os.environ.get('CHECKPOINT_FLUSH_INTERVAL', '1'))
+ASSIGNMENT_DB_FILE = 'assignments.db'
+TELEMETRY_DB_FILE = 'telemetry.db'
+TELEMETRY_FLUSH_INTERVAL = float(os.environ.get('TELEMETRY_FLUSH_INTERVAL', '2'))
+# 分配后超过这个时间仍未提交的题目不再按预计票数计入
+ASSIGNMENT_TTL = float(os.environ.get('ASSIGNMENT_TTL', '3600'))
+SURVEYS = load_registry()
+AGGREGATE_TABLES = aggregate_tables(SURVEYS)
+COMPLETION_FILES = completion_files(SURVEYS)
+COMPLETION_BATCH_LIMIT = 1000
+COMPLETION_MISS_TTL = float(os.environ.get('COMPLETION_MISS_TTL', '5'))
+STUDENT_PAYLOAD_CACHE_SIZE = 4096
+ITEM_WINDOW_SIZE = int(os.environ.get('ITEM_WINDOW_SIZE', '20'))
+ITEM_WINDOW_MAX = 200
+# 离线音频包最多包含的音频段数，超过时（如未按学生分配的按需解析大题库）不提供离线包
+BUNDLE_MAX_CLIPS = int(os.environ.get('BUNDLE_MAX_CLIPS', '500'))
+RENDITION_FOLDER = os.path.join(UPLOAD_FOLDER, 'renditions')
+TRANSCODE_FORMATS = [name.strip() for name in os.environ.get('TRANSCODE_FORMATS', 'aac,opus').split(',') if name.strip()]
+TRANSCODE_BITRATE = os.environ.get('TRANSCODE_BITRATE', '64k')
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', '2'))
+TRANSCODE_SURVEYS = {int(value) for value in os.environ.get('TRANSCODE_SURVEYS', '1,2').split(',') if value.strip()}
+DATA_RELOAD_INTERVAL = float(os.environ.get('DATA_RELOAD_INTERVAL', '5'))
+DATASET_HISTORY = 4
+AGGREGATE_FOLDER = os.environ.get('SURVEY_AGGREGATE_FOLDER') or os.path.join(OUTPUT_FOLDER, 'aggregates')
+AGGREGATE_WORKERS = int(os.environ.get('AGGREGATE_WORKERS', str(os.cpu_count() or 1)))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# 准入控制：所有通道共享ADMISSION_TOTAL个并发名额（0表示不限制），应不超过worker的线程数；
+# 提交和完成状态优先，音频传输最多占用ADMISSION_AUDIO_LIMIT个名额，排满后快速返回503
+ADMISSION_TOTAL = int(os.environ.get('ADMISSION_TOTAL', '16'))
+ADMISSION_LANES = {
+    'submit': {'priority': 0, 'limit': int(os.environ.get('ADMISSION_SUBMIT_LIMIT', '16')), 'queue': 256, 'wait': 30, 'per_client': 2},
+    'items': {'priority': 1, 'limit': int(os.environ.get('ADMISSION_ITEMS_LIMIT', '8')), 'queue': 64, 'wait': 5, 'per_client': 2},
+    'audio': {'priority': 2, 'limit': int(os.environ.get('ADMISSION_AUDIO_LIMIT', '10')), 'queue': 64, 'wait': 2, 'per_client': 4}
 }
-SURVEY2_STAGE_FILES = {
-    'guide': 'guide5.tar',
-    'test': 'test20.tar'
+ADMISSION_ROUTES = {
+    'submit_survey': 'submit',
+    'get_survey_completions': 'submit',
+    'get_survey_completions_batch': 'submit',
+    'get_survey_items': 'items',
+    'get_stage_bundle': 'items',
+    'save_checkpoint': 'items',
+    'get_checkpoint': 'items',
+    'serve_audio': 'audio'
 }
-SURVEY3_FILE = 'test25.tar'
+CLIENT_COOKIE = 'survey_client'
+CLIENT_COOKIE_MAX_AGE = 7 * 24 * 3600
+
+survey_data_cache = {}
+survey_load_locks = {}
+survey_load_locks_guard = threading.Lock()
+audio_sources = {}
+stage_signatures = {}
+stage_versions = {}
+stage_problems = {}
+stage_load_modes = {}
+data_watcher = None
+aggregate_lock = threading.Lock()
+submission_store = None
+checkpoint_store = None
+telemetry_store = None
+assignment_store = None
+assignment_lock = threading.Lock()
+index_store = None
+redis_client = None
+services_lock = threading.Lock()
+completion_index = None
+scoring_engine = None
+scoring_cursor = None
+scoring_lock = threading.Lock()
+rendition_cache = None
+blob_store = None
+waveform_index = None
+metrics = MetricsRegistry()
+http_requests = metrics.counter('survey_http_requests_total', 'HTTP requests by route and status', ('route', 'method', 'status'))
+http_request_seconds = metrics.histogram('survey_http_request_duration_seconds', 'Request handling time by route', ('route',))
+audio_bytes_sent = metrics.counter('survey_audio_bytes_sent_total', 'Audio bytes sent by survey', ('survey',))
+archive_load_seconds = metrics.histogram(
+    'survey_archive_load_seconds', 'Time to index or extract a stage archive', ('archive', 'mode'),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+cache_lookups = metrics.counter('survey_data_cache_requests_total', 'survey_data_cache lookups by key and result', ('cache', 'result'))
+submission_write_seconds = metrics.histogram('survey_submission_write_seconds', 'Time to persist a submission', ('store',))
+stage_reloads = metrics.counter('survey_stage_reloads_total', 'Stages reloaded after their archive changed', ('stage',))
+admission_wait_seconds = metrics.histogram('survey_admission_wait_seconds', 'Time spent queued for an admission slot', ('lane',))
+admission_rejected = metrics.counter('survey_admission_rejected_total', 'Requests rejected with 503 by admission control', ('lane',))
+client_audio_ready_seconds = metrics.histogram(
+    'survey_client_audio_ready_seconds', 'Time from showing a question to its audio being playable, reported by browsers',
+    ('survey', 'stage')
+)
+client_audio_problems = metrics.counter(
+    'survey_client_audio_problems_total', 'Playback stalls and load errors reported by browsers', ('survey', 'stage', 'kind')
+)
+admission = AdmissionController(ADMISSION_TOTAL, ADMISSION_LANES) if ADMISSION_TOTAL > 0 else None
+# ASGI入口在事件循环中做准入控制，Flask中不再重复
+admission_in_flask = True
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def admit_request():
+    lane = ADMISSION_ROUTES.get(request.endpoint)
+    if admission is None or not admission_in_flask or lane is None:
+        return None
+    client = admission_client(request.args.get('student_id'), request.cookies.get(CLIENT_COOKIE), request.remote_addr)
+    started = time.perf_counter()
+    try:
+        g.admission_ticket = admission.acquire(lane, client)
+    except Overloaded as e:
+        admission_rejected.inc(lane)
+        return overloaded_response(e)
+    admission_wait_seconds.observe(time.perf_counter() - started, lane)
+    return None
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        record_request(request.endpoint or 'not_found', request.method, response.status_code, time.perf_counter() - started)
+    ticket = g.pop('admission_ticket', None)
+    audio_file = g.pop('audio_file', None)
+    if ticket is not None:
+        # 音频交给服务器的file_wrapper发送（可走sendfile），不经过response.close：发送完关闭文件时才释放名额
+        if audio_file is not None:
+            audio_file.call_on_close(lambda: admission.release(ticket))
+        elif response.direct_passthrough:
+            admission.release(ticket)
+        else:
+            response.call_on_close(lambda: admission.release(ticket))
+    if CLIENT_COOKIE not in request.cookies:
+        response.set_cookie(CLIENT_COOKIE, secrets.token_urlsafe(12), max_age=CLIENT_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+    return response
+
+@app.teardown_request
+def release_admission(error):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        admission.release(ticket)
+
+def admission_client(student_id, cookie, address):
+    # 同一教室的学生可能共用一个出口IP，优先按学号、其次按浏览器cookie区分客户端
+    student_id = normalize_student_id(student_id or '')
+    if student_id:
+        return f'student:{student_id}'
+    if cookie:
+        return f'cookie:{cookie}'
+    return f'addr:{address}'
+
+def overloaded_response(error):
+    response = jsonify({'error': '服务器繁忙，请稍后重试'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def record_request(route, method, status, seconds):
+    http_requests.inc(route, method, status)
+    http_request_seconds.observe(seconds, route)
+
+def record_audio_bytes(survey_type, method, status, length):
+    if method != 'HEAD' and status in (200, 206) and length:
+        audio_bytes_sent.inc(survey_type, amount=length)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 def normalize_student_id(value):
     return str(value or '').strip()
 
-def student_dir_base(student_id):
+def student_dir_name(student_id):
     safe_name = ''.join(ch if ch.isalnum() or ch in ('-', '_') else '_' for ch in student_id)
-    safe_name = safe_name or 'student'
-    return os.path.join(OUTPUT_FOLDER, safe_name)
+    return safe_name or 'student'
 
-def student_dir_path(student_id):
-    path = student_dir_base(student_id)
-    os.makedirs(path, exist_ok=True)
-    return path
+def get_redis():
+    global redis_client
+    if redis_client is not None:
+        return redis_client
+    with services_lock:
+        if redis_client is None:
+            # redis包只有使用Redis后端时才需要安装
+            import redis
+            redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return redis_client
 
-def normalize_option(value):
-    return str(value or '').strip()
+def get_submission_store():
+    global submission_store
+    if submission_store is not None:
+        return submission_store
+    client = get_redis() if SUBMISSION_STORE == 'redis' else None
+    with services_lock:
+        if submission_store is None:
+            if SUBMISSION_STORE == 'redis':
+                submission_store = RedisSubmissionStore(client, REDIS_PREFIX)
+            elif SUBMISSION_STORE == 'files':
+                submission_store = FileSubmissionStore(OUTPUT_FOLDER, student_dir_name)
+            else:
+                submission_store = SQLiteSubmissionStore(
+                    os.path.join(OUTPUT_FOLDER, SUBMISSION_DB_FILE),
+                    legacy_folder=OUTPUT_FOLDER
+                )
+                atexit.register(submission_store.close)
+    return submission_store
+
+def get_checkpoint_store():
+    global checkpoint_store
+    if checkpoint_store is not None:
+        return checkpoint_store
+    with services_lock:
+        if checkpoint_store is None:
+            checkpoint_store = CheckpointStore(
+                os.path.join(OUTPUT_FOLDER, CHECKPOINT_DB_FILE),
+                flush_interval=CHECKPOINT_FLUSH_INTERVAL
+            )
+            atexit.register(checkpoint_store.close)
+    return checkpoint_store
+
+def get_telemetry_store():
+    global telemetry_store
+    if telemetry_store is not None:
+        return telemetry_store
+    with services_lock:
+        if telemetry_store is None:
+            telemetry_store = TelemetryStore(
+                os.path.join(OUTPUT_FOLDER, TELEMETRY_DB_FILE),
+                flush_interval=TELEMETRY_FLUSH_INTERVAL
+            )
+            atexit.register(telemetry_store.close)
+    return telemetry_store
+
+def close_stores():
+    for store in (submission_store, checkpoint_store, telemetry_store):
+        if store is not None:
+            store.close()
+
+def get_assignment_store():
+    global assignment_store
+    if assignment_store is not None:
+        return assignment_store
+    # assignment依赖numpy，只有配置了按学生分配题目的阶段才会用到
+    from assignment import RedisAssignmentStore, SQLiteAssignmentStore
+    client = get_redis() if SUBMISSION_STORE == 'redis' else None
+    with services_lock:
+        if assignment_store is None:
+            if SUBMISSION_STORE == 'redis':
+                assignment_store = RedisAssignmentStore(client, REDIS_PREFIX)
+            else:
+                assignment_store = SQLiteAssignmentStore(os.path.join(OUTPUT_FOLDER, ASSIGNMENT_DB_FILE))
+    return assignment_store
+
+def get_completion_index():
+    global completion_index
+    if completion_index is not None:
+        return completion_index
+    store = get_submission_store()
+    with services_lock:
+        if completion_index is None:
+            index = CompletionIndex(COMPLETION_FILES, student_dir_name, store, COMPLETION_MISS_TTL)
+            index.load(store.submitted_keys())
+            completion_index = index
+    return completion_index
+
+def stage_answer_key(cache_key, version):
+    stage_data = stage_versions.get(cache_key, {}).get(version)
+    return stage_data.get('answer_map') if stage_data else None
+
+def stage_item_count(cache_key, version):
+    stage_data = stage_versions.get(cache_key, {}).get(version)
+    return len(stage_data['items']) if stage_data else None
+
+def get_scoring_engine():
+    global scoring_engine, scoring_cursor
+    with scoring_lock:
+        if scoring_engine is None:
+            # scoring依赖numpy，只在第一次查询评分时导入
+            from scoring import ScoringEngine
+            scoring_engine = ScoringEngine(SURVEYS, stage_answer_key, stage_item_count)
+        # 每次查询都从上次的游标继续读取共享存储，其他worker收到的提交也会计入；同一学生以最新提交为准
+        for position, _, filename, payload in get_submission_store().records_since(scoring_cursor):
+            try:
+                scoring_engine.add(json.loads(payload))
+            except Exception as e:
+                # 无法计入的记录跳过，游标照样前进，不会在每次查询时重放
+                app.logger.warning('评分时跳过提交记录%s: %s', filename, e)
+            finally:
+                scoring_cursor = position
+    return scoring_engine
+
+def save_submission(student_id, filename, output_data):
+    started = time.perf_counter()
+    get_submission_store().save(student_id, filename, output_data)
+    submission_write_seconds.observe(time.perf_counter() - started, SUBMISSION_STORE)
+    get_completion_index().mark(student_id, filename)
 
 def extract_tar_file(tar_path, extract_to):
     audio_files = []
@@ -55,7 +358,7 @@ def extract_tar_file(tar_path, extract_to):
     
     try:
         with tarfile.open(tar_path, 'r:*') as tar:
-            tar.extractall(extract_to)
+            tar.extractall(extract_to, filter='data')
             
             for member in tar.getmembers():
                 if member.isfile():
@@ -84,333 +387,442 @@ def extract_tar_file(tar_path, extract_to):
     
     return audio_files, tag_data
 
-def load_survey_data(survey_type):
-    if survey_type in survey_data_cache:
-        return survey_data_cache[survey_type]
-    
-    tar_file = os.path.join(DATA_FOLDER, f'data_{survey_type}.tar')
-    if not os.path.exists(tar_file):
-        return None
-    
-    extract_dir = os.path.join(UPLOAD_FOLDER, f'survey{survey_type}')
-    os.makedirs(extract_dir, exist_ok=True)
-    
-    temp_extract_dir = os.path.join(extract_dir, 'temp_extract')
-    os.makedirs(temp_extract_dir, exist_ok=True)
-    
-    audio_files, tag_data = extract_tar_file(tar_file, temp_extract_dir)
-    
-    if not audio_files:
-        return None
-    
-    audio_files.sort(key=lambda x: x['name'])
-    
-    items = []
-    for idx, audio_info in enumerate(audio_files):
-        audio_name = audio_info['name']
-        base_name = os.path.splitext(audio_name)[0]
-        
-        final_path = os.path.join(extract_dir, audio_name)
-        if os.path.exists(audio_info['path']) and not os.path.exists(final_path):
-            shutil.move(audio_info['path'], final_path)
-        elif not os.path.exists(final_path):
-            continue
-        
-        item = {
-            'index': idx,
-            'audio': f"/api/audio/{survey_type}/{audio_name}"
-        }
-        
-        if survey_type == 2:
-            if base_name in tag_data:
-                tags_data = tag_data[base_name]
-                if isinstance(tags_data, dict):
-                    sample_pool = tags_data.get('sample_pool', [])
-                    if isinstance(sample_pool, list):
-                        item['tags'] = sample_pool[:4]
-                    else:
-                        item['tags'] = []
-                elif isinstance(tags_data, list):
-                    item['tags'] = tags_data[:4]
-                else:
-                    item['tags'] = []
-            else:
-                item['tags'] = []
-        else:
-            item['tags'] = []
-        
-        items.append(item)
-    
-    if os.path.exists(temp_extract_dir):
-        try:
-            shutil.rmtree(temp_extract_dir)
-        except:
-            pass
+def get_index_store():
+    global index_store
+    if index_store is not None:
+        return index_store
+    client = get_redis() if INDEX_STORE == 'redis' else None
+    with services_lock:
+        if index_store is None:
+            index_store = RedisIndexStore(client, REDIS_PREFIX) if INDEX_STORE == 'redis' else FileIndexStore(INDEX_FOLDER)
+    return index_store
+
+def tar_index_name(tar_path):
+    parent = os.path.basename(os.path.dirname(tar_path))
+    return f'{parent}_{os.path.basename(tar_path)}'
+
+def extract_stage_archive(tar_path, survey_type, temp_name, signature):
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    temp_extract_dir = tempfile.mkdtemp(prefix=f'survey{survey_type}_{temp_name}_', dir=UPLOAD_FOLDER)
     
-    survey_data_cache[survey_type] = items
-    return items
+    store = get_blob_store()
+    members = []
+    try:
+        audio_files, tag_data = extract_tar_file(tar_path, temp_extract_dir)
+        for audio_info in audio_files:
+            if not os.path.exists(audio_info['path']):
+                continue
+            source = store.add_file(audio_info['path'], audio_info['name'])
+            members.append({'name': audio_info['name'], 'size': source.size, 'sha256': source.digest, 'meta': source.meta})
+    finally:
+        shutil.rmtree(temp_extract_dir, ignore_errors=True)
+    return {'version': INDEX_VERSION, 'archive': signature, 'members': members, 'documents': tag_data}
+
+def load_stage_archive(tar_path, survey_type, temp_name):
+    archive = os.path.relpath(tar_path, DATA_FOLDER)
+    started = time.perf_counter()
+    store = get_index_store()
+    name = tar_index_name(tar_path)
+    if SERVE_AUDIO_FROM_TAR and is_plain_tar(tar_path):
+        result = index_tar_file(tar_path, store, name)
+        archive_load_seconds.observe(time.perf_counter() - started, archive, 'index')
+        return result
+    
+    # 压缩包只解压一次：解压结果记入共享索引，其他worker直接使用已存入BlobStore的音频
+    signature = file_signature(tar_path)
+    
+    def build(previous):
+        return extract_stage_archive(tar_path, survey_type, temp_name, signature)
+    
+    index = load_index(store, f'{name}.extract', signature, build)
+    sources = get_blob_store().restore(index['members'])
+    if sources is None:
+        # 索引由另一台机器写入，本机的BlobStore里还没有这些音频
+        index = build(None)
+        sources = get_blob_store().restore(index['members'])
+    resolved = [{'name': member['name'], 'source': source} for member, source in zip(index['members'], sources)]
+    archive_load_seconds.observe(time.perf_counter() - started, archive, 'extract')
+    return resolved, dict(index['documents'])
+
+def get_blob_store():
+    global blob_store
+    if blob_store is not None:
+        return blob_store
+    with services_lock:
+        if blob_store is None:
+            blob_store = BlobStore(BLOB_FOLDER)
+    return blob_store
 
-def load_survey1_stage(stage):
-    stage = stage if stage in SURVEY1_STAGE_FILES else 'test'
-    cache_key = f'survey1_{stage}'
+def get_waveform_index():
+    global waveform_index
+    if waveform_index is not None:
+        return waveform_index
+    with services_lock:
+        if waveform_index is None:
+            from waveform import WaveformIndex
+            waveform_index = WaveformIndex(os.path.join(INDEX_FOLDER, WAVEFORM_FILE))
+    return waveform_index
+
+def get_rendition_cache():
+    global rendition_cache
+    if rendition_cache is not None:
+        return rendition_cache
+    with services_lock:
+        if rendition_cache is None:
+            rendition_cache = RenditionCache(
+                RENDITION_FOLDER, TRANSCODE_FORMATS, TRANSCODE_BITRATE, max_workers=TRANSCODE_WORKERS
+            )
+            atexit.register(rendition_cache.shutdown)
+    return rendition_cache
+
+def register_audio(survey_type, audio_info):
+    source = get_blob_store().add(audio_info['source'])
+    audio_info['source'] = source
+    audio_sources[(survey_type, audio_info['name'])] = source
+    if survey_type in TRANSCODE_SURVEYS:
+        get_rendition_cache().schedule(source)
+    return f"/api/audio/{survey_type}/{blob_filename(source)}"
+
+def stage_load_lock(cache_key):
+    with survey_load_locks_guard:
+        return survey_load_locks.setdefault(cache_key, threading.Lock())
+
+def cached_load(cache_key, loader):
     if cache_key in survey_data_cache:
+        cache_lookups.inc(cache_key, 'hit')
         return survey_data_cache[cache_key]
-    
-    stage_file = SURVEY1_STAGE_FILES.get(stage)
-    stage_dir = os.path.join(DATA_FOLDER, 'data1')
-    if not stage_file or not os.path.exists(os.path.join(stage_dir, stage_file)):
-        return None
-    
-    tar_path = os.path.join(stage_dir, stage_file)
-    extract_dir = os.path.join(UPLOAD_FOLDER, 'survey1')
-    os.makedirs(extract_dir, exist_ok=True)
-    
-    temp_extract_dir = os.path.join(extract_dir, f'temp_{stage}')
-    os.makedirs(temp_extract_dir, exist_ok=True)
-    
-    audio_files, tag_data = extract_tar_file(tar_path, temp_extract_dir)
-    if not audio_files:
-        try:
-            shutil.rmtree(temp_extract_dir)
-        except:
-            pass
+    cache_lookups.inc(cache_key, 'miss')
+    
+    with stage_load_lock(cache_key):
+        if cache_key in survey_data_cache:
+            return survey_data_cache[cache_key]
+        result = loader()
+        if result is not None:
+            survey_data_cache[cache_key] = result
+        return result
+
+def stage_definitions():
+    return {stage['key']: stage for stage in iter_stages(SURVEYS)}
+
+def stage_archive_path(stage):
+    return os.path.join(DATA_FOLDER, stage['data_dir'], stage['archive'])
+
+def dataset_version(stage_data):
+    content = json.dumps(stage_data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+
+def load_stage(cache_key):
+    start_data_watcher()
+    stage = stage_definitions()[cache_key]
+    return cached_load(cache_key, lambda: build_stage(cache_key, stage))
+
+def build_stage(cache_key, stage):
+    signature = archive_signature(stage_archive_path(stage))
+    stage_data = build_stage_data(stage)
+    if stage_data is None:
         return None
-    
-    audio_files.sort(key=lambda x: x['name'])
-    items = []
-    answer_lookup = {}
-    if stage == 'guide':
-        raw_answer = tag_data.get('answer')
-        answer_list = []
-        if isinstance(raw_answer, dict) and 'sample_pool' in raw_answer:
-            answer_list = raw_answer.get('sample_pool', [])
-        elif isinstance(raw_answer, list):
-            answer_list = raw_answer
-        for entry in answer_list:
-            audio_name = entry.get('audio')
-            if not audio_name:
+    stage_signatures[cache_key] = signature
+    history = stage_versions.setdefault(cache_key, OrderedDict())
+    history[stage_data['version']] = stage_data
+    history.move_to_end(stage_data['version'])
+    while len(history) > DATASET_HISTORY:
+        history.popitem(last=False)
+    return stage_data
+
+def load_stage_version(cache_key, version):
+    stage_data = load_stage(cache_key)
+    if stage_data is None or not version or stage_data['version'] == version:
+        return stage_data
+    return stage_versions.get(cache_key, {}).get(version, stage_data)
+
+def reload_changed_stages():
+    for cache_key, stage in stage_definitions().items():
+        if cache_key not in survey_data_cache or archive_signature(stage_archive_path(stage)) == stage_signatures.get(cache_key):
+            continue
+        with stage_load_lock(cache_key):
+            previous = survey_data_cache.get(cache_key)
+            stage_data = build_stage(cache_key, stage)
+            if stage_data is None:
                 continue
-            answer_lookup[audio_name] = bool(entry.get('answer', False))
-    
-    answers_by_index = {}
-    for idx, audio_info in enumerate(audio_files):
-        audio_name = audio_info['name']
-        final_path = os.path.join(extract_dir, audio_name)
-        if os.path.exists(audio_info['path']) and not os.path.exists(final_path):
-            import shutil
-            shutil.move(audio_info['path'], final_path)
-        elif not os.path.exists(final_path):
+            survey_data_cache[cache_key] = stage_data
+        if previous is None or previous['version'] == stage_data['version']:
             continue
-        
-        item = {
-            'index': idx,
-            'audio': f"/api/audio/1/{audio_name}"
-        }
-        
-        if stage == 'guide':
-            answers_by_index[idx] = answer_lookup.get(audio_name, False)
-        
-        items.append(item)
-    
-    import shutil
-    if os.path.exists(temp_extract_dir):
+        for key in [key for key in survey_data_cache if str(key).startswith('payload_') and str(key).endswith(f"_{previous['version']}")]:
+            survey_data_cache.pop(key, None)
+        stage_reloads.inc(cache_key)
+        app.logger.info('%s 数据已更新：%s -> %s', cache_key, previous['version'], stage_data['version'])
+
+def watch_data_files():
+    while True:
+        time.sleep(DATA_RELOAD_INTERVAL)
         try:
-            shutil.rmtree(temp_extract_dir)
-        except:
-            pass
-    
-    stage_data = {'items': items}
-    if stage == 'guide':
-        stage_data['answer_map'] = answers_by_index
-    survey_data_cache[cache_key] = stage_data
-    return stage_data
+            reload_changed_stages()
+        except Exception as e:
+            app.logger.warning('重新加载数据文件失败: %s', e)
 
-def load_survey2_stage(stage):
-    stage = stage if stage in SURVEY2_STAGE_FILES else 'test'
-    cache_key = f'survey2_{stage}'
-    if cache_key in survey_data_cache:
-        return survey_data_cache[cache_key]
-    
-    stage_file = SURVEY2_STAGE_FILES.get(stage)
-    stage_dir = os.path.join(DATA_FOLDER, 'data2')
-    if not stage_file or not os.path.exists(os.path.join(stage_dir, stage_file)):
+def start_data_watcher():
+    global data_watcher
+    if DATA_RELOAD_INTERVAL <= 0 or (data_watcher is not None and data_watcher.is_alive()):
+        return
+    with services_lock:
+        if data_watcher is None or not data_watcher.is_alive():
+            data_watcher = threading.Thread(target=watch_data_files, name='data-watcher', daemon=True)
+            data_watcher.start()
+
+def stage_index_path(stage):
+    return os.path.join(INDEX_FOLDER, f"{stage['key']}.stage.json.gz")
+
+def restore_stage_data(stage, tar_path, snapshot):
+    archive = None
+    audio_files = []
+    for entry in snapshot['sources']:
+        if entry['tar']:
+            if entry['path'] != tar_path:
+                return None
+            if archive is None:
+                archive = ArchiveHandle(tar_path)
+                # 读取阶段索引之后数据文件可能刚被替换
+                if archive.signature != snapshot['archive']:
+                    return None
+        elif not os.path.exists(entry['path']):
+            return None
+        source = AudioSource(
+            entry['path'], entry['offset'], entry['size'], entry['source_name'], entry['digest'], entry['meta'],
+            archive if entry['tar'] else None
+        )
+        audio_files.append({'name': entry['name'], 'source': source})
+    for audio_info in audio_files:
+        register_audio(stage['survey'], audio_info)
+    stage_problems[stage['key']] = snapshot['problems']
+    return snapshot['stage_data']
+
+def build_stage_data(stage):
+    tar_path = stage_archive_path(stage)
+    try:
+        signature = file_signature(tar_path)
+    except OSError:
         return None
     
-    tar_path = os.path.join(stage_dir, stage_file)
-    extract_dir = os.path.join(UPLOAD_FOLDER, 'survey2')
-    os.makedirs(extract_dir, exist_ok=True)
-    
-    temp_extract_dir = os.path.join(extract_dir, f'temp_{stage}')
-    os.makedirs(temp_extract_dir, exist_ok=True)
-    
-    audio_files, tag_data = extract_tar_file(tar_path, temp_extract_dir)
+    if stage.get('lazy') and SERVE_AUDIO_FROM_TAR and is_plain_tar(tar_path):
+        return build_lazy_stage_data(stage, tar_path)
+    
+    # 数据文件和阶段配置都没变时直接使用上次构建的题目，不再读取tar
+    index_path = stage_index_path(stage)
+    fingerprint = stage_fingerprint(stage)
+    snapshot = read_stage_index(index_path, signature, fingerprint)
+    if snapshot is not None:
+        started = time.perf_counter()
+        stage_data = restore_stage_data(stage, tar_path, snapshot)
+        if stage_data is not None:
+            archive_load_seconds.observe(time.perf_counter() - started, os.path.relpath(tar_path, DATA_FOLDER), 'snapshot')
+            stage_load_modes[stage['key']] = 'snapshot'
+            return stage_data
+    
+    audio_files, tag_data = load_stage_archive(tar_path, stage['survey'], f"temp_{stage['stage']}")
     if not audio_files:
-        try:
-            shutil.rmtree(temp_extract_dir)
-        except:
-            pass
         return None
+    stage_load_modes[stage['key']] = 'index' if audio_files[0]['source'].archive is not None else 'extract'
+    sources = [(audio_info['name'], audio_info['source']) for audio_info in audio_files]
     
-    audio_files.sort(key=lambda x: x['name'])
-    items = []
-    answer_lookup = {}
-    
-    for audio_info in audio_files:
-        audio_name = audio_info['name']
-        base_name = os.path.splitext(audio_name)[0]
-        final_path = os.path.join(extract_dir, audio_name)
-        if os.path.exists(audio_info['path']) and not os.path.exists(final_path):
-            shutil.move(audio_info['path'], final_path)
-        elif not os.path.exists(final_path):
-            continue
-        
-        tags = []
-        correct_tag = ''
-        base_data = tag_data.get(base_name)
-        if isinstance(base_data, dict):
-            pool = base_data.get('sample_pool', [])
-            if isinstance(pool, list):
-                tags = pool[:4]
-            selected = base_data.get('sample_selected', '')
-            correct_tag = selected if isinstance(selected, str) else ''
-        elif isinstance(base_data, list):
-            tags = base_data[:4]
-        elif isinstance(base_data, str):
-            tags = [base_data]
-        
-        index_value = len(items)
-        items.append({
-            'index': index_value,
-            'audio': f"/api/audio/2/{audio_name}",
-            'tags': tags
-        })
-        
-        if stage == 'guide':
-            answer_lookup[index_value] = correct_tag
+    problems = get_waveform_index().annotate([audio_info['source'] for audio_info in audio_files])
+    stage_problems[stage['key']] = problems
+    if problems:
+        app.logger.warning('%s 中有%d段异常音频: %s', stage['key'], len(problems), ', '.join(f'{name}（{reason}）' for name, reason in problems))
     
+    stage_data = build_stage_items(stage, audio_files, tag_data, lambda audio_info: register_audio(stage['survey'], audio_info))
+    stage_data['version'] = dataset_version(stage_data)
     try:
-        shutil.rmtree(temp_extract_dir)
-    except:
-        pass
-    
-    stage_data = {'items': items}
-    if stage == 'guide':
-        stage_data['answer_map'] = answer_lookup
-    survey_data_cache[cache_key] = stage_data
+        write_stage_index(index_path, signature, fingerprint, stage_data, sources, problems)
+    except OSError as e:
+        app.logger.warning('写入阶段索引失败: %s', e)
     return stage_data
 
-def load_survey3_items():
-    cache_key = 'survey3_items'
-    if cache_key in survey_data_cache:
-        return survey_data_cache[cache_key]
-    
-    data_dir = os.path.join(DATA_FOLDER, 'data3')
-    tar_path = os.path.join(data_dir, SURVEY3_FILE)
-    if not os.path.exists(tar_path):
-        return None
-    
-    extract_dir = os.path.join(UPLOAD_FOLDER, 'survey3')
-    os.makedirs(extract_dir, exist_ok=True)
-    
-    temp_extract_dir = os.path.join(extract_dir, 'temp_extract')
-    os.makedirs(temp_extract_dir, exist_ok=True)
-    
-    audio_files, _ = extract_tar_file(tar_path, temp_extract_dir)
+def build_lazy_stage_data(stage, tar_path):
+    started = time.perf_counter()
+    index = LazyTarIndex(tar_path, get_index_store(), f'{tar_index_name(tar_path)}.lazy')
+    # 题目骨架中的音频只记位置，不含地址和元数据，数据版本号只取决于tar的成员和标签
+    audio_files = [
+        {'name': source.name, 'position': position, 'source': AudioSource(source.path, source.offset, source.size, source.name, None)}
+        for position, source in enumerate(index.sources)
+    ]
     if not audio_files:
-        try:
-            shutil.rmtree(temp_extract_dir)
-        except:
-            pass
         return None
-    
-    pairs = {}
-    for audio_info in audio_files:
-        audio_name = audio_info['name']
-        lower_name = audio_name.lower()
-        pair_key = None
-        audio_type = None
-        
-        if lower_name.startswith('raw_sample_'):
-            audio_type = 'raw'
-            pair_key = lower_name.replace('raw_sample_', '').split('.')[0]
-        elif lower_name.startswith('superres_sample_'):
-            audio_type = 'super'
-            pair_key = lower_name.replace('superres_sample_', '').split('.')[0]
-        else:
-            continue
-        
-        if not pair_key:
-            continue
-        
-        final_path = os.path.join(extract_dir, audio_name)
-        if os.path.exists(audio_info['path']) and not os.path.exists(final_path):
-            shutil.move(audio_info['path'], final_path)
-        elif not os.path.exists(final_path):
-            continue
-        
-        pair_entry = pairs.setdefault(pair_key, {'raw': None, 'super': None})
-        pair_entry[audio_type] = {
-            'audio': f"/api/audio/3/{audio_name}",
-            'filename': audio_name
-        }
-    
-    try:
-        shutil.rmtree(temp_extract_dir)
-    except:
-        pass
-    
-    items = []
-    for pair_key in sorted(pairs.keys(), key=lambda x: int(x) if str(x).isdigit() else x):
-        data = pairs[pair_key]
-        if not data.get('raw') or not data.get('super'):
-            continue
-        options = [
-            {'id': 'raw', 'audio': data['raw']['audio'], 'filename': data['raw']['filename']},
-            {'id': 'super', 'audio': data['super']['audio'], 'filename': data['super']['filename']}
-        ]
-        items.append({
-            'index': len(items),
-            'pair_key': pair_key,
-            'options': options
+    stage_data = build_stage_items(stage, audio_files, dict(index.documents), lambda audio_info: audio_info['position'])
+    stage_data['version'] = dataset_version(stage_data)
+    stage_data['clips'] = {'index': index, 'resolved': {}, 'lock': threading.Lock()}
+    stage_problems[stage['key']] = []
+    stage_load_modes[stage['key']] = 'lazy'
+    archive_load_seconds.observe(time.perf_counter() - started, os.path.relpath(tar_path, DATA_FOLDER), 'lazy')
+    return stage_data
+
+def resolve_clips(stage, clips, positions):
+    with clips['lock']:
+        missing = [position for position in positions if position not in clips['resolved']]
+        if missing:
+            sources = clips['index'].resolve(missing)
+            problems = get_waveform_index().annotate(sources)
+            if problems:
+                stage_problems.setdefault(stage['key'], []).extend(problems)
+                app.logger.warning('%s 中有%d段异常音频: %s', stage['key'], len(problems), ', '.join(f'{name}（{reason}）' for name, reason in problems))
+            for position, source in zip(missing, sources):
+                audio_info = {'name': source.name, 'source': source}
+                audio_url = register_audio(stage['survey'], audio_info)
+                # 地址中带上阶段和位置，其他worker收到请求时可以按位置解析这段音频
+                clips['resolved'][position] = {
+                    'audio': f"{audio_url}?stage={stage['stage']}&clip={position}",
+                    **clip_fields(audio_info['source'])
+                }
+        return {position: clips['resolved'][position] for position in positions}
+
+def stage_assignment(stage, stage_data, student_id):
+    store = get_assignment_store()
+    assigned = store.get(stage['key'], stage_data['version'], student_id)
+    if assigned is not None:
+        return assigned
+    from assignment import assignment_seed, plan_assignment
+    config = stage['assignment']
+    total = len(stage_data['items'])
+    with assignment_lock:
+        votes, agreement = get_scoring_engine().item_votes(stage['key'], stage_data['version'], total)
+        pending = store.pending(stage['key'], stage_data['version'], time.time() - ASSIGNMENT_TTL)
+        items = plan_assignment(
+            votes, agreement, pending, min(config['per_rater'], total), config,
+            assignment_seed(stage['key'], stage_data['version'], student_id)
+        )
+        return store.create(stage['key'], stage_data['version'], student_id, items)
+
+def student_stage_items(stage, stage_data, student_id):
+    # 按学生分配的阶段只返回分给该学生的题目，index改为题目在分配列表中的位置
+    if not stage.get('assignment'):
+        return stage_data['items']
+    return [
+        {**stage_data['items'][index], 'index': position}
+        for position, index in enumerate(stage_assignment(stage, stage_data, student_id))
+    ]
+
+def resolve_items(stage, stage_data, items):
+    clips = stage_data.get('clips')
+    if clips is None:
+        return items
+    positions = sorted({clip['audio'] for item in items for clip in item_clips(item)})
+    resolved = resolve_clips(stage, clips, positions)
+    return [map_item_clips(item, lambda clip: resolved[clip['audio']]) for item in items]
+
+def stage_items(stage, stage_data, start=0, end=None):
+    return resolve_items(stage, stage_data, stage_data['items'][start:end])
+
+def ordered_options(stage, student_id, items):
+    ordered = []
+    for item in items:
+        options = {option['id']: option for option in item.get('options', [])}
+        ordered.append({
+            **item,
+            'options': [options[option_id] for option_id in option_order(stage, student_id, item)]
         })
-    
-    survey_data_cache[cache_key] = items
-    return items
+    return ordered
+
+def item_window(stage, stage_data, start, limit, student_id=''):
+    student_items = student_stage_items(stage, stage_data, student_id)
+    items = resolve_items(stage, stage_data, student_items[start:start + limit])
+    if stage.get('option_order') == 'per_student':
+        items = ordered_options(stage, student_id, items)
+    total = len(student_items)
+    end = start + len(items)
+    return {
+        'items': items,
+        'dataset_version': stage_data['version'],
+        'total': total,
+        'cursor': start,
+        'next_cursor': end if end < total else None
+    }
+
+@lru_cache(maxsize=STUDENT_PAYLOAD_CACHE_SIZE)
+def item_window_payload(cache_key, version, student_id, start, limit):
+    stage = stage_definitions()[cache_key]
+    return PreparedPayload(item_window(stage, load_stage_version(cache_key, version), start, limit, student_id))
 
 @app.route('/api/surveys/<int:survey_type>/items', methods=['GET'])
 def get_survey_items(survey_type):
-    stage = request.args.get('stage')
-    if survey_type == 1:
-        stage_key = 'guide' if stage == 'guide' else 'test'
-        stage_data = load_survey1_stage(stage_key)
-        if not stage_data:
-            return jsonify({'error': '问卷数据不存在'}), 404
-        return jsonify({'items': stage_data.get('items', [])})
-    if survey_type == 2 and stage in ('guide', 'test'):
-        stage_key = 'guide' if stage == 'guide' else 'test'
-        stage_data = load_survey2_stage(stage_key)
-        if not stage_data:
-            return jsonify({'error': '问卷数据不存在'}), 404
-        return jsonify({'items': stage_data.get('items', [])})
-    if survey_type == 3:
-        items = load_survey3_items()
-        if items is None:
-            return jsonify({'error': '问卷数据不存在'}), 404
-        randomized_items = []
-        for item in items:
-            option_list = list(item.get('options', []))
-            random.shuffle(option_list)
-            randomized_items.append({
-                'index': item.get('index'),
-                'pair_key': item.get('pair_key'),
-                'options': option_list
-            })
-        return jsonify({'items': randomized_items})
-    
-    items = load_survey_data(survey_type)
-    if items is None:
+    stage = resolve_stage(SURVEYS, survey_type, request.args.get('stage'))
+    stage_data = load_stage(stage['key']) if stage else None
+    if stage_data is None:
         return jsonify({'error': '问卷数据不存在'}), 404
-    return jsonify({'items': items})
+    
+    per_student = stage.get('option_order') == 'per_student' or bool(stage.get('assignment'))
+    student_id = normalize_student_id(request.args.get('student_id', '')) if per_student else ''
+    # 选项顺序按学号确定，没有学号时无法给出该学生看到的顺序
+    if per_student and not student_id:
+        return jsonify({'error': '学号不能为空'}), 400
+    # 带cursor或limit时按窗口返回；按需解析的大题库总是按窗口返回
+    if 'cursor' in request.args or 'limit' in request.args or 'clips' in stage_data:
+        start = max(request.args.get('cursor', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', ITEM_WINDOW_SIZE, type=int), 1), ITEM_WINDOW_MAX)
+        # 缓存按实际使用的数据版本，不按客户端传来的版本字符串：不认识的版本回退到当前数据
+        stage_data = load_stage_version(stage['key'], request.args.get('dataset_version'))
+        return payload_response(item_window_payload(stage['key'], stage_data['version'], student_id, start, limit))
+    
+    if per_student:
+        return payload_response(student_items_payload(stage['key'], student_id, stage_data['version']))
+    
+    return payload_response(cached_load(
+        f"payload_{stage['key']}_{stage_data['version']}",
+        lambda: PreparedPayload({'items': stage_data['items'], 'dataset_version': stage_data['version']})
+    ))
+
+@lru_cache(maxsize=STUDENT_PAYLOAD_CACHE_SIZE)
+def student_items_payload(cache_key, student_id, version):
+    stage = stage_definitions()[cache_key]
+    stage_data = load_stage_version(cache_key, version)
+    items = student_stage_items(stage, stage_data, student_id)
+    if stage.get('option_order') == 'per_student':
+        items = ordered_options(stage, student_id, items)
+    return PreparedPayload({'items': items, 'dataset_version': stage_data['version']})
+
+@app.route('/api/surveys/<int:survey_type>/bundle', methods=['GET'])
+def get_stage_bundle(survey_type):
+    stage = resolve_stage(SURVEYS, survey_type, request.args.get('stage'))
+    stage_data = load_stage(stage['key']) if stage else None
+    if stage_data is None:
+        return jsonify({'error': '问卷数据不存在'}), 404
+    
+    student_id = normalize_student_id(request.args.get('student_id', '')) if stage.get('assignment') else ''
+    if stage.get('assignment') and not student_id:
+        return jsonify({'error': '学号不能为空'}), 400
+    stage_data = load_stage_version(stage['key'], request.args.get('dataset_version'))
+    items = student_stage_items(stage, stage_data, student_id)
+    if sum(len(item_clips(item)) for item in items) > BUNDLE_MAX_CLIPS:
+        return jsonify({'error': '该阶段音频过多，不提供离线音频包'}), 400
+    return payload_response(stage_bundle_payload(stage['key'], stage_data['version'], student_id))
+
+@lru_cache(maxsize=STUDENT_PAYLOAD_CACHE_SIZE)
+def stage_bundle_payload(cache_key, version, student_id):
+    # 离线音频包清单：阶段内（按学生分配时为分给该学生的）全部音频的地址、大小和内容摘要，
+    # 地址与题目接口返回的一致，前端的service worker按地址缓存
+    stage = stage_definitions()[cache_key]
+    stage_data = load_stage_version(cache_key, version)
+    items = resolve_items(stage, stage_data, student_stage_items(stage, stage_data, student_id))
+    clips = []
+    seen = set()
+    for item in items:
+        for clip in item_clips(item):
+            if clip['audio'] in seen:
+                continue
+            seen.add(clip['audio'])
+            source = find_audio_source(stage['survey'], urlsplit(clip['audio']).path.rsplit('/', 1)[-1])
+            clips.append({'url': clip['audio'], 'size': clip.get('size'), 'sha256': source.digest if source else None})
+    bundle_version = hashlib.sha256(json.dumps(clips, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return PreparedPayload({
+        'survey_type': stage['survey'],
+        'stage': stage['stage'],
+        'dataset_version': stage_data['version'],
+        'bundle_version': bundle_version,
+        'total_bytes': sum(clip['size'] or 0 for clip in clips),
+        'clips': clips
+    })
+
+def payload_response(payload):
+    status, headers, body = plan_payload_response(payload, request.headers, request.accept_encodings)
+    return Response(body, status=status, headers=headers)
 
 @app.route('/api/surveys/completions', methods=['GET'])
 def get_survey_completions():
@@ -418,18 +830,24 @@ def get_survey_completions():
     if not student_id:
         return jsonify({'error': '学号不能为空'}), 400
     
-    dir_path = student_dir_base(student_id)
-    def file_exists(filename):
-        if not dir_path:
-            return False
-        return os.path.exists(os.path.join(dir_path, filename))
-    
-    status = {
-        'survey1': file_exists('survey1_test20.json'),
-        'survey2': file_exists('survey2_test20.json'),
-        'survey3': file_exists('survey3.json')
-    }
-    return jsonify(status)
+    return jsonify(get_completion_index().status(student_id))
+
+@app.route('/api/surveys/completions/batch', methods=['POST'])
+def get_survey_completions_batch():
+    data = request.get_json(silent=True) or {}
+    student_ids = data.get('student_ids')
+    if not isinstance(student_ids, list) or not student_ids:
+        return jsonify({'error': '学号列表不能为空'}), 400
+    if len(student_ids) > COMPLETION_BATCH_LIMIT:
+        return jsonify({'error': f'单次最多查询{COMPLETION_BATCH_LIMIT}个学号'}), 400
+    
+    index = get_completion_index()
+    completions = {}
+    for value in student_ids:
+        student_id = normalize_student_id(value)
+        if student_id:
+            completions[student_id] = index.status(student_id)
+    return jsonify({'completions': completions})
 
 @app.route('/api/surveys/<int:survey_type>/submit', methods=['POST'])
 def submit_survey(survey_type):
@@ -439,6 +857,7 @@ def submit_survey(survey_type):
     name = data.get('name', '')
     stage = data.get('stage', '')
     student_id = normalize_student_id(data.get('student_id', ''))
+    version = data.get('dataset_version')
     
     if not email:
         return jsonify({'error': '邮箱不能为空'}), 400
@@ -446,252 +865,355 @@ def submit_survey(survey_type):
     if not student_id:
         return jsonify({'error': '学号不能为空'}), 400
     
-    if survey_type == 1 and stage == 'guide':
-        return submit_survey1_guide(name, email, student_id, answers)
-    if survey_type == 1:
-        return submit_survey1_test(name, email, student_id, answers)
-    if survey_type == 2 and stage == 'guide':
-        return submit_survey2_guide(name, email, student_id, answers)
-    if survey_type == 2:
-        return submit_survey2_test(name, email, student_id, answers)
-    if survey_type == 3:
-        return submit_survey3(name, email, student_id, answers)
-    
-    items = load_survey_data(survey_type)
-    if items is None:
+    stage_config = resolve_stage(SURVEYS, survey_type, stage)
+    if stage_config is None:
         return jsonify({'error': '问卷数据不存在'}), 404
     
-    output_data = {
-        'survey_type': survey_type,
-        'name': name,
-        'email': email,
-        'student_id': student_id,
-        'submitted_at': datetime.now().isoformat(),
-        'answers': []
-    }
-    
-    for answer in answers:
-        output_data['answers'].append({
-            'item_index': answer['index'],
-            'answer': answer['answer']
-        })
-    
-    student_dir = student_dir_path(student_id)
-    output_file = os.path.join(student_dir, f'survey_{survey_type}.json')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
-    
-    return jsonify({'success': True})
-
-def normalize_boolean(value):
-    if isinstance(value, bool):
-        return value
-    if isinstance(value, str):
-        value = value.strip().lower()
-        return value in ['true', '1', 'yes', '是']
-    if isinstance(value, (int, float)):
-        return value != 0
-    return False
-
-def submit_survey1_guide(name, email, student_id, answers):
-    stage_data = load_survey1_stage('guide')
-    if not stage_data or 'answer_map' not in stage_data:
-        return jsonify({'error': '引导题目不存在'}), 404
-    
-    answer_map = stage_data['answer_map']
-    total = len(answer_map)
-    correct_count = 0
-    
-    for answer in answers:
-        idx = answer.get('index')
-        if idx is None or idx not in answer_map:
-            continue
-        user_answer = normalize_boolean(answer.get('answer'))
-        if user_answer == bool(answer_map[idx]):
-            correct_count += 1
-    
-    accuracy = correct_count / total if total else 0
-    passed = accuracy >= 0.6
-    
-    output_data = {
-        'survey_type': 1,
-        'stage': 'guide5',
-        'name': name,
-        'email': email,
-        'student_id': student_id,
-        'submitted_at': datetime.now().isoformat(),
-        'answers': [{
-            'item_index': answer.get('index'),
-            'answer': answer.get('answer')
-        } for answer in answers],
-        'total_items': total,
-        'correct_count': correct_count,
-        'accuracy': accuracy,
-        'passed': passed
-    }
-    
-    student_dir = student_dir_path(student_id)
-    output_file = os.path.join(student_dir, 'survey1_guide5.json')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
-    
-    return jsonify({
-        'success': True,
-        'passed': passed,
-        'accuracy': accuracy,
-        'correct_count': correct_count,
-        'total': total
-    })
+    response = submit_stage(stage_config, name, email, student_id, answers, version)
+    if not isinstance(response, tuple):
+        # 提交成功后该阶段的进度不再需要
+        get_checkpoint_store().clear(student_id, survey_type, stage_config['stage'])
+    return response
 
-def submit_survey1_test(name, email, student_id, answers):
-    stage_data = load_survey1_stage('test')
-    if not stage_data:
-        return jsonify({'error': '正式题目不存在'}), 404
+def submit_stage(stage, name, email, student_id, answers, version=None):
+    stage_data = load_stage_version(stage['key'], version)
+    if not stage_data or (stage.get('grading') and 'answer_map' not in stage_data):
+        return jsonify({'error': f"{stage['label']}不存在"}), 404
+    
+    assigned = None
+    if stage.get('assignment'):
+        from assignment import map_assigned_answers
+        assigned = get_assignment_store().get(stage['key'], stage_data['version'], student_id)
+        if assigned is None:
+            return jsonify({'error': '该学号没有分配到题目，请重新进入问卷'}), 400
+    
+    if not valid_answers(answers, len(assigned if assigned is not None else stage_data['items'])):
+        return jsonify({'error': '答案格式错误'}), 400
+    if assigned is not None:
+        answers = map_assigned_answers(answers, assigned)
     
     output_data = {
-        'survey_type': 1,
-        'stage': 'test20',
+        'survey_type': stage['survey'],
+        'stage': stage['name'],
         'name': name,
         'email': email,
         'student_id': student_id,
         'submitted_at': datetime.now().isoformat(),
-        'answers': [{
-            'item_index': answer.get('index'),
-            'answer': answer.get('answer')
-        } for answer in answers],
-        'total_items': len(stage_data.get('items', []))
+        'dataset_version': stage_data['version'],
+        'answers': record_answers(stage, stage_data, student_id, answers)
     }
+    result = {'success': True}
+    if stage.get('grading'):
+        grade = grade_answers(stage, stage_data, answers)
+        output_data.update(grade)
+        result.update({
+            'passed': grade['passed'],
+            'accuracy': grade['accuracy'],
+            'correct_count': grade['correct_count'],
+            'total': grade['total_items']
+        })
+    elif assigned is not None:
+        output_data['total_items'] = len(assigned)
+        output_data['assigned_items'] = assigned
+    else:
+        output_data['total_items'] = len(stage_data['items'])
     
-    student_dir = student_dir_path(student_id)
-    output_file = os.path.join(student_dir, 'survey1_test20.json')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    save_submission(student_id, stage['output_file'], output_data)
+    if assigned is not None:
+        get_assignment_store().complete(stage['key'], stage_data['version'], student_id)
     
-    return jsonify({'success': True})
+    return jsonify(result)
 
-def submit_survey2_guide(name, email, student_id, answers):
-    stage_data = load_survey2_stage('guide')
-    if not stage_data or 'answer_map' not in stage_data:
-        return jsonify({'error': '引导题目不存在'}), 404
-    
-    answer_map = stage_data['answer_map']
-    total = len(answer_map)
-    correct_count = 0
-    
-    for answer in answers:
-        idx = answer.get('index')
-        if idx is None or idx not in answer_map:
+def checkpoint_item_count(stage, student_id, version):
+    # 与提交时一样，题号以学生看到的题目列表为准：按学生分配的阶段是分给该学生的题目
+    stage_data = load_stage_version(stage['key'], version)
+    if stage_data is None:
+        return None
+    if stage.get('assignment'):
+        assigned = get_assignment_store().get(stage['key'], stage_data['version'], student_id)
+        return len(assigned) if assigned is not None else None
+    return len(stage_data['items'])
+
+@app.route('/api/surveys/<int:survey_type>/checkpoint', methods=['PATCH'])
+def save_checkpoint(survey_type):
+    if survey_type not in SURVEYS:
+        return jsonify({'error': '问卷类型不存在'}), 404
+    data = request.get_json(silent=True) or {}
+    student_id = normalize_student_id(data.get('student_id', ''))
+    if not student_id:
+        return jsonify({'error': '学号不能为空'}), 400
+    stage = resolve_stage(SURVEYS, survey_type, data.get('stage', ''))
+    items = checkpoint_item_count(stage, student_id, data.get('dataset_version'))
+    if items is None:
+        return jsonify({'error': f"{stage['label']}不存在"}), 404
+    answers = data.get('answers') or {}
+    if not valid_checkpoint_answers(answers, items):
+        return jsonify({'error': '答案格式错误'}), 400
+    position = data.get('position')
+    if position is not None and (not isinstance(position, int) or isinstance(position, bool) or position < 0):
+        return jsonify({'error': '题目位置错误'}), 400
+    
+    get_checkpoint_store().update(
+        student_id, survey_type, stage['stage'], data.get('dataset_version'), position=position, answers=answers
+    )
+    return jsonify({'success': True}), 202
+
+@app.route('/api/surveys/<int:survey_type>/checkpoint', methods=['GET'])
+def get_checkpoint(survey_type):
+    if survey_type not in SURVEYS:
+        return jsonify({'error': '问卷类型不存在'}), 404
+    student_id = normalize_student_id(request.args.get('student_id', ''))
+    if not student_id:
+        return jsonify({'error': '学号不能为空'}), 400
+    return jsonify({'checkpoints': get_checkpoint_store().get(student_id, survey_type)})
+
+@app.route('/api/telemetry/playback', methods=['POST'])
+def receive_playback_telemetry():
+    if (request.content_length or 0) > MAX_BEACON_BYTES:
+        return jsonify({'error': '数据过大'}), 413
+    try:
+        payload = decode_beacon(request.get_data(cache=False))
+    except BeaconError:
+        return jsonify({'error': '数据格式错误'}), 400
+    stages = {(survey_type, name) for survey_type, survey in SURVEYS.items() for name in survey['stages']}
+    rows = event_rows(payload, stages, client_network(request.remote_addr), time.time())
+    for row in rows:
+        survey_type, stage, kind, ms = row[1], row[2], row[7], row[8]
+        if kind == 'ready':
+            client_audio_ready_seconds.observe(ms / 1000, survey_type, stage)
+        else:
+            client_audio_problems.inc(survey_type, stage, kind)
+    get_telemetry_store().append(rows)
+    return '', 204
+
+def label_references():
+    # label阶段的参考答案（如问卷2的sample_selected），用于汇总表中的得票占比
+    references = {}
+    for stage in iter_stages(SURVEYS):
+        if stage['answer_type'] != 'label' or not stage.get('answer_key'):
             continue
-        user_answer = normalize_option(answer.get('answer'))
-        correct_answer = normalize_option(answer_map[idx])
-        if user_answer and user_answer == correct_answer:
-            correct_count += 1
-    
-    accuracy = correct_count / total if total else 0
-    passed = accuracy >= 0.6
-    
-    output_data = {
-        'survey_type': 2,
-        'stage': 'guide5',
-        'name': name,
-        'email': email,
-        'student_id': student_id,
-        'submitted_at': datetime.now().isoformat(),
-        'answers': [{
-            'item_index': answer.get('index'),
-            'answer': answer.get('answer')
-        } for answer in answers],
-        'total_items': total,
-        'correct_count': correct_count,
-        'accuracy': accuracy,
-        'passed': passed
-    }
-    
-    student_dir = student_dir_path(student_id)
-    output_file = os.path.join(student_dir, 'survey2_guide5.json')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
-    
-    return jsonify({
-        'success': True,
-        'passed': passed,
-        'accuracy': accuracy,
-        'correct_count': correct_count,
-        'total': total
-    })
+        load_stage(stage['key'])
+        for version, stage_data in stage_versions.get(stage['key'], {}).items():
+            if 'answer_map' in stage_data:
+                references[(stage['survey'], stage['name'], version)] = stage_data['answer_map']
+    return references
 
-def submit_survey2_test(name, email, student_id, answers):
-    stage_data = load_survey2_stage('test')
-    if not stage_data:
-        return jsonify({'error': '正式题目不存在'}), 404
-    
-    output_data = {
-        'survey_type': 2,
-        'stage': 'test20',
-        'name': name,
-        'email': email,
-        'student_id': student_id,
-        'submitted_at': datetime.now().isoformat(),
-        'answers': [{
-            'item_index': answer.get('index'),
-            'answer': answer.get('answer')
-        } for answer in answers],
-        'total_items': len(stage_data.get('items', []))
-    }
-    
-    student_dir = student_dir_path(student_id)
-    output_file = os.path.join(student_dir, 'survey2_test20.json')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
-    
-    return jsonify({'success': True})
-
-def submit_survey3(name, email, student_id, answers):
-    items = load_survey3_items()
-    if not items:
-        return jsonify({'error': '题目数据不存在'}), 404
-    
-    item_map = {item['index']: item for item in items}
-    output_answers = []
-    for answer in answers:
-        idx = answer.get('index')
-        selection = normalize_option(answer.get('answer'))
-        item_data = item_map.get(idx)
-        pair_key = item_data.get('pair_key') if item_data else ''
-        selected_audio = ''
-        if item_data:
-            for option in item_data.get('options', []):
-                if normalize_option(option.get('id')) == selection:
-                    selected_audio = option.get('filename') or option.get('audio', '')
-                    break
-        output_answers.append({
-            'item_index': idx,
-            'pair_key': pair_key,
-            'selected_option': selection,
-            'selected_audio': selected_audio
-        })
-    
-    output_data = {
-        'survey_type': 3,
-        'stage': 'test25',
-        'name': name,
-        'email': email,
-        'student_id': student_id,
-        'submitted_at': datetime.now().isoformat(),
-        'answers': output_answers,
-        'total_items': len(items)
-    }
-    
-    student_dir = student_dir_path(student_id)
-    output_file = os.path.join(student_dir, 'survey3.json')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
-    
-    return jsonify({'success': True})
+def run_aggregation(output_dir=AGGREGATE_FOLDER, workers=1, full=False):
+    with aggregate_lock:
+        return aggregate_submissions(
+            get_submission_store(), output_dir, SURVEYS, references=label_references(), workers=workers, full=full
+        )
+
+def admin_error():
+    if not ADMIN_TOKEN:
+        return jsonify({'error': '管理接口未启用'}), 404
+    token = request.headers.get('X-Admin-Token', '')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        return jsonify({'error': '无权访问'}), 403
+    return None
+
+@app.route('/api/admin/aggregate', methods=['POST'])
+def run_aggregate():
+    error = admin_error()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    summary = run_aggregation(full=bool(data.get('full')))
+    summary.pop('output_dir', None)
+    return jsonify(summary)
+
+@app.route('/api/admin/aggregate/<table>', methods=['GET'])
+def get_aggregate_table(table):
+    error = admin_error()
+    if error:
+        return error
+    if table not in AGGREGATE_TABLES:
+        return jsonify({'error': '表不存在'}), 404
+    return send_from_directory(AGGREGATE_FOLDER, table, mimetype='text/csv', max_age=0)
+
+@app.route('/api/admin/scores', methods=['GET'])
+def get_scores():
+    error = admin_error()
+    if error:
+        return error
+    survey_type = request.args.get('survey_type', type=int)
+    flagged_only = request.args.get('flagged') in ('1', 'true')
+    for stage in iter_stages(SURVEYS, survey_type):
+        if stage.get('answer_key'):
+            load_stage(stage['key'])
+    return jsonify({'stages': get_scoring_engine().report(survey_type, flagged_only)})
+
+@app.route('/api/admin/playback', methods=['GET'])
+def get_playback_summary():
+    error = admin_error()
+    if error:
+        return error
+    group = request.args.get('group', 'clip')
+    if group not in TELEMETRY_GROUPS:
+        return jsonify({'error': '分组方式不存在'}), 400
+    hours = request.args.get('hours', 24, type=float)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 1000)
+    rows = get_telemetry_store().summary(
+        group, request.args.get('survey_type', type=int), since=time.time() - hours * 3600, limit=limit
+    )
+    return jsonify({'group': group, 'hours': hours, 'rows': rows})
+
+def ensure_survey_audio(survey_type):
+    for stage in iter_stages(SURVEYS, survey_type):
+        load_stage(stage['key'])
+
+def warm_up_surveys():
+    get_completion_index()
+    for survey_type in SURVEYS:
+        try:
+            ensure_survey_audio(survey_type)
+        except Exception as e:
+            app.logger.warning('预加载问卷%s失败: %s', survey_type, e)
+
+def find_audio_source(survey_type, filename):
+    # 题目中的地址都是按内容寻址的<sha256>.<扩展名>；按原始文件名查找只为兼容升级前打开的页面里的旧地址，
+    # 多个阶段有同名音频时对应最后加载的那个阶段
+    return get_blob_store().find(filename) or audio_sources.get((survey_type, filename))
+
+def resolve_audio_source(survey_type, filename, stage_name=None, position=None):
+    source = find_audio_source(survey_type, filename)
+    if source is None:
+        ensure_survey_audio(survey_type)
+        source = find_audio_source(survey_type, filename)
+    if source is None and position is not None:
+        # 按需解析的音频可能是由其他worker解析后返回给学生的，按地址中的阶段和位置在本进程解析
+        stage = SURVEYS.get(survey_type, {}).get('stages', {}).get(stage_name)
+        stage_data = load_stage(stage['key']) if stage else None
+        clips = stage_data.get('clips') if stage_data else None
+        if clips is not None and 0 <= position < len(clips['index'].sources):
+            resolve_clips(stage, clips, [position])
+            source = find_audio_source(survey_type, filename)
+    return source
+
+def select_audio_rendition(survey_type, source, accept):
+    if survey_type not in TRANSCODE_SURVEYS or not get_rendition_cache().enabled:
+        return source, {}
+    return get_rendition_cache().negotiate(source, accept), {'Vary': 'Accept'}
+
+def audio_response(source, extra_headers=None):
+    status, headers, start, length = plan_audio_response(source, request.headers)
+    headers.update(extra_headers or {})
+    if length is None:
+        return Response(status=status, headers=headers)
+    g.audio_file = source.open_range(start, length)
+    body = wrap_file(request.environ, g.audio_file)
+    response = Response(body, status=status, headers=headers, direct_passthrough=True)
+    response.content_length = length
+    return response
 
 @app.route('/api/audio/<int:survey_type>/<filename>')
 def serve_audio(survey_type, filename):
-    return send_from_directory(os.path.join(UPLOAD_FOLDER, f'survey{survey_type}'), filename)
+    source = resolve_audio_source(survey_type, filename, request.args.get('stage'), request.args.get('clip', type=int))
+    if source is None:
+        return jsonify({'error': '音频不存在'}), 404
+    source, extra_headers = select_audio_rendition(survey_type, source, request.accept_mimetypes)
+    response = audio_response(source, extra_headers)
+    record_audio_bytes(survey_type, request.method, response.status_code, response.content_length)
+    return response
+
+if os.environ.get('SURVEY_WARMUP') == '1':
+    warm_up_surveys()
+
+STAGE_LOAD_MODES = {'snapshot': '阶段索引', 'index': 'tar索引', 'extract': '解压', 'lazy': '按需解析'}
+
+def import_profile(limit=8):
+    # 当前进程已经导入过app，在新进程中用 -X importtime 重新测量
+    env = {name: value for name, value in os.environ.items() if name != 'SURVEY_WARMUP'}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True
+    )
+    total = None
+    modules = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        cumulative = int(parts[1]) / 1000
+        if name.strip() == 'app' and depth == 0:
+            total = cumulative
+        elif depth == 1:
+            modules.append((cumulative, name.strip()))
+    return total, sorted(modules, reverse=True)[:limit]
+
+def profile_startup():
+    total, modules = import_profile()
+    if total is not None:
+        print(f'导入app: {total:.1f} ms')
+        for cumulative, name in modules:
+            print(f'  {name}: {cumulative:.1f} ms')
+    
+    client = app.test_client()
+    started = time.perf_counter()
+    for cache_key, stage in stage_definitions().items():
+        stage_started = time.perf_counter()
+        stage_data = load_stage(cache_key)
+        loaded = time.perf_counter()
+        if stage_data is None:
+            print(f'{cache_key}: 数据文件不存在或没有音频')
+            continue
+        client.get(f"/api/surveys/{stage['survey']}/items", query_string={'stage': stage['stage'], 'student_id': 'profile'})
+        print(
+            f"{cache_key}: 加载 {(loaded - stage_started) * 1000:.1f} ms（{STAGE_LOAD_MODES.get(stage_load_modes.get(cache_key), '')}），"
+            f"首次返回题目 {(time.perf_counter() - loaded) * 1000:.1f} ms"
+        )
+    print(f'全部阶段: {(time.perf_counter() - started) * 1000:.1f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='问卷系统后端')
+    parser.add_argument('--export-submissions', metavar='DIR', nargs='?', const=OUTPUT_FOLDER,
+                        help='将每个学生每份问卷的最新提交导出为JSON文件后退出（默认导出到output_data）')
+    parser.add_argument('--aggregate', metavar='DIR', nargs='?', const=AGGREGATE_FOLDER,
+                        help='统计全部提交并输出CSV汇总表后退出（默认输出到output_data/aggregates），只处理上次统计之后的新提交')
+    parser.add_argument('--full', action='store_true', help='与--aggregate一起使用：忽略上次的统计进度，重新统计全部提交')
+    parser.add_argument('--workers', type=int, default=AGGREGATE_WORKERS, help='统计时解析提交的进程数')
+    parser.add_argument('--check-data', action='store_true', help='加载全部阶段，列出无法解析、无法解码或静音的音频后退出')
+    parser.add_argument('--profile-startup', action='store_true', help='测量导入和各阶段首次加载、首次返回题目的耗时后退出')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--debug', action='store_true', help='使用Flask调试模式运行（仅限开发环境）')
+    args = parser.parse_args()
+    
+    if args.export_submissions:
+        count = export_submissions(get_submission_store(), args.export_submissions, student_dir_name)
+        print(f'已导出 {count} 份提交到 {args.export_submissions}')
+        return
+    
+    if args.check_data:
+        for cache_key, stage in stage_definitions().items():
+            stage_data = load_stage(cache_key)
+            if stage_data is None:
+                print(f'{cache_key}: 数据文件不存在或没有音频（{stage_archive_path(stage)}）')
+                continue
+            stage_items(stage, stage_data)
+            problems = stage_problems.get(cache_key, [])
+            print(f"{cache_key}: {len(stage_data['items'])} 题，{len(problems)} 段异常音频")
+            for name, reason in problems:
+                print(f'  {name}: {reason}')
+        return
+    
+    if args.profile_startup:
+        profile_startup()
+        return
+    
+    if args.aggregate:
+        summary = run_aggregation(args.aggregate, workers=args.workers, full=args.full)
+        print(f"本次处理 {summary['processed']} 条提交，共统计 {summary['submissions']} 份，结果已写入 {args.aggregate}")
+        for table, rows in summary['tables'].items():
+            print(f'  {table}: {rows} 行')
+        return
+    
+    app.run(debug=args.debug, host=args.host, port=args.port, threaded=True)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    main()
@@ -0,0 +1,197 @@
+import asyncio
+import contextvars
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers, MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_cookie
+
+import app as survey_app
+from admission import Overloaded
+from audio_store import READ_CHUNK_SIZE, plan_audio_response
+
+AUDIO_PATH = re.compile(r'^/api/audio/(\d+)/([^/]+)$')
+ZEROCOPY_EXTENSION = 'http.response.zerocopysend'
+
+wsgi_application = WsgiToAsgi(survey_app.app)
+# 准入控制在事件循环中等待名额，排队的请求不占用线程池中的线程
+survey_app.admission_in_flask = False
+
+async def flask_application(scope, receive, send):
+    # keep-alive连接上的下一个请求会继承上一个请求的上下文，asgiref会误用已退出的线程执行器
+    await asyncio.create_task(wsgi_application(scope, receive, send), context=contextvars.Context())
+
+def request_headers(scope):
+    return Headers([
+        (name.decode('latin-1'), value.decode('latin-1'))
+        for name, value in scope.get('headers', [])
+    ])
+
+def encode_headers(headers):
+    return [
+        (name.lower().encode('latin-1'), str(value).encode('latin-1'))
+        for name, value in headers.items()
+    ]
+
+def cors_headers(headers):
+    origin = headers.get('Origin')
+    if not origin:
+        return {}
+    return {
+        'Access-Control-Allow-Origin': origin,
+        'Access-Control-Allow-Credentials': 'true',
+        'Vary': 'Origin'
+    }
+
+async def watch_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+async def send_file_range(scope, receive, send, source, start, length):
+    handle, _ = await asyncio.to_thread(source.open_file)
+    try:
+        offset = source.offset + start
+        if ZEROCOPY_EXTENSION in scope.get('extensions', {}):
+            await send({
+                'type': ZEROCOPY_EXTENSION,
+                'file': handle,
+                'offset': offset,
+                'count': length,
+                'more_body': False
+            })
+            return
+        
+        disconnected = asyncio.ensure_future(watch_disconnect(receive))
+        try:
+            remaining = length
+            while remaining > 0 and not disconnected.done():
+                chunk = await asyncio.to_thread(
+                    os.pread, handle.fileno(), min(READ_CHUNK_SIZE, remaining), offset
+                )
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0 and not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            disconnected.cancel()
+    finally:
+        await asyncio.to_thread(handle.close)
+
+def query_int(query, name):
+    try:
+        return int(query.get(name, [''])[0])
+    except ValueError:
+        return None
+
+async def serve_audio(scope, receive, send, survey_type, filename):
+    started = time.perf_counter()
+    source = survey_app.find_audio_source(survey_type, filename)
+    if source is None:
+        # 与Flask路由一样带上stage和clip，按需解析的音频可以在本进程直接解析
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        source = await asyncio.to_thread(
+            survey_app.resolve_audio_source, survey_type, filename, query.get('stage', [None])[0], query_int(query, 'clip')
+        )
+    if source is None:
+        await flask_application(scope, receive, send)
+        return
+    
+    headers = request_headers(scope)
+    accept = parse_accept_header(headers.get('Accept'), MIMEAccept)
+    source, extra_headers = survey_app.select_audio_rendition(survey_type, source, accept)
+    status, response_headers, start, length = plan_audio_response(source, headers)
+    response_headers.update(extra_headers)
+    response_headers.update(cors_headers(headers))
+    if length is not None:
+        response_headers['Content-Length'] = length
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': encode_headers(response_headers)
+    })
+    try:
+        if length is None or scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            return
+        await send_file_range(scope, receive, send, source, start, length)
+        survey_app.record_audio_bytes(survey_type, scope['method'], status, length)
+    finally:
+        survey_app.record_request('serve_audio', scope['method'], status, time.perf_counter() - started)
+
+def request_endpoint(scope):
+    try:
+        endpoint, _ = survey_app.app.url_map.bind('').match(scope['path'], method=scope['method'])
+    except HTTPException:
+        return None
+    return endpoint
+
+def request_client(scope, headers):
+    student_id = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('student_id', [''])[0]
+    cookie = parse_cookie(headers.get('Cookie', '')).get(survey_app.CLIENT_COOKIE)
+    address = (scope.get('client') or ('',))[0]
+    return survey_app.admission_client(student_id, cookie, address)
+
+async def send_overloaded(send, headers, error):
+    body = json.dumps({'error': '服务器繁忙，请稍后重试'}, ensure_ascii=False).encode('utf-8')
+    response_headers = {
+        'Content-Type': 'application/json',
+        'Content-Length': len(body),
+        'Retry-After': error.retry_after,
+        **cors_headers(headers)
+    }
+    await send({'type': 'http.response.start', 'status': 503, 'headers': encode_headers(response_headers)})
+    await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+async def dispatch(scope, receive, send):
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        match = AUDIO_PATH.match(scope['path'])
+        if match:
+            await serve_audio(scope, receive, send, int(match.group(1)), match.group(2))
+            return
+    await flask_application(scope, receive, send)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # uvicorn的worker收到SIGTERM时不一定执行atexit，在这里写入尚未落盘的提交、进度和播放统计
+            await asyncio.to_thread(survey_app.close_stores)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    endpoint = request_endpoint(scope) if scope['type'] == 'http' else None
+    lane = survey_app.ADMISSION_ROUTES.get(endpoint)
+    if survey_app.admission is None or lane is None:
+        await dispatch(scope, receive, send)
+        return
+    
+    started = time.perf_counter()
+    headers = request_headers(scope)
+    try:
+        ticket = await survey_app.admission.acquire_async(lane, request_client(scope, headers))
+    except Overloaded as e:
+        survey_app.admission_rejected.inc(lane)
+        await send_overloaded(send, headers, e)
+        survey_app.record_request(endpoint, scope['method'], 503, time.perf_counter() - started)
+        return
+    survey_app.admission_wait_seconds.observe(time.perf_counter() - started, lane)
+    try:
+        await dispatch(scope, receive, send)
+    finally:
+        survey_app.admission.release(ticket)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from group_commit import ThreadConnections
+
+def assignment_seed(stage_key, version, student_id):
+    digest = hashlib.sha256(f'{stage_key}:{version}:{student_id}'.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+def plan_assignment(votes, agreement, pending, size, config, seed):
+    # votes: 每题已提交的作答人数；agreement: 已提交作答中最多人选择的类别占比；
+    # pending: 已分配但尚未提交的题目列表，按预计会得到的票数计入
+    votes = np.array(votes, dtype=np.int64)
+    agreement = np.nan_to_num(np.asarray(agreement, dtype=np.float64), nan=1.0)
+    for items in pending:
+        np.add.at(votes, [index for index in items if 0 <= index < len(votes)], 1)
+    # 第0层：票数不足target_votes的题目，票数少的优先；
+    # 第1层：票数已够但意见分歧（一致程度低于consensus）且未到max_votes的题目，分歧大的优先；
+    # 第2层：其余题目，只在前两层不够分配时使用
+    below = votes < config['target_votes']
+    disputed = ~below & (votes < config['max_votes']) & (agreement < config['consensus'])
+    tier = np.where(below, 0, np.where(disputed, 1, 2))
+    within = np.where(tier == 1, agreement, votes)
+    # 同一层内打乱，同时分配的学生不会都拿到同一批题目
+    tie = np.random.default_rng(seed).random(len(votes))
+    order = np.lexsort((tie, within, tier))
+    return sorted(int(index) for index in order[:size])
+
+def map_assigned_answers(answers, assigned):
+    # 前端提交的index是题目在分配列表中的位置，换成题库中的题号；超出分配范围的答案丢弃
+    mapped = []
+    for answer in answers:
+        position = answer.get('index') if isinstance(answer, dict) else None
+        if not isinstance(position, int) or isinstance(position, bool) or not 0 <= position < len(assigned):
+            continue
+        mapped.append({**answer, 'index': assigned[position]})
+    return mapped
+
+class SQLiteAssignmentStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect = ThreadConnections(db_path)
+        connection = self._connect()
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS assignments (
+                stage TEXT NOT NULL,
+                dataset_version TEXT NOT NULL,
+                student_id TEXT NOT NULL,
+                items TEXT NOT NULL,
+                assigned_at REAL NOT NULL,
+                submitted INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (stage, dataset_version, student_id)
+            );
+        ''')
+        connection.commit()
+    
+    def get(self, stage, version, student_id):
+        row = self._connect().execute(
+            'SELECT items FROM assignments WHERE stage = ? AND dataset_version = ? AND student_id = ?',
+            (stage, version, student_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def create(self, stage, version, student_id, items):
+        # 同一学生同时在两个worker上领取题目时只保留先写入的一份
+        connection = self._connect()
+        connection.execute(
+            'INSERT OR IGNORE INTO assignments (stage, dataset_version, student_id, items, assigned_at) VALUES (?, ?, ?, ?, ?)',
+            (stage, version, student_id, json.dumps(items), time.time())
+        )
+        connection.commit()
+        return self.get(stage, version, student_id)
+    
+    def complete(self, stage, version, student_id):
+        connection = self._connect()
+        connection.execute(
+            'UPDATE assignments SET submitted = 1 WHERE stage = ? AND dataset_version = ? AND student_id = ?',
+            (stage, version, student_id)
+        )
+        connection.commit()
+    
+    def pending(self, stage, version, since):
+        rows = self._connect().execute(
+            'SELECT items FROM assignments WHERE stage = ? AND dataset_version = ? AND submitted = 0 AND assigned_at >= ?',
+            (stage, version, since)
+        )
+        return [json.loads(items) for items, in rows]
+    
+    def close(self):
+        pass
+
+class RedisAssignmentStore:
+    # 每个阶段每个数据版本一个哈希表：学号 -> {items, assigned_at, submitted}
+    def __init__(self, client, prefix='survey'):
+        self.client = client
+        self.prefix = f'{prefix}:assignments:'
+    
+    def _key(self, stage, version):
+        return f'{self.prefix}{stage}:{version}'
+    
+    def _read(self, stage, version, student_id):
+        value = self.client.hget(self._key(stage, version), student_id)
+        return json.loads(value) if value else None
+    
+    def get(self, stage, version, student_id):
+        entry = self._read(stage, version, student_id)
+        return entry['items'] if entry else None
+    
+    def create(self, stage, version, student_id, items):
+        entry = {'items': items, 'assigned_at': time.time(), 'submitted': False}
+        self.client.hsetnx(self._key(stage, version), student_id, json.dumps(entry))
+        return self.get(stage, version, student_id)
+    
+    def complete(self, stage, version, student_id):
+        entry = self._read(stage, version, student_id)
+        if entry and not entry['submitted']:
+            entry['submitted'] = True
+            self.client.hset(self._key(stage, version), student_id, json.dumps(entry))
+    
+    def pending(self, stage, version, since):
+        items = []
+        for _, value in self.client.hscan_iter(self._key(stage, version), count=1000):
+            entry = json.loads(value)
+            if not entry['submitted'] and entry['assigned_at'] >= since:
+                items.append(entry['items'])
+        return items
+    
+    def close(self):
+        pass
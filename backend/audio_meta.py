@@ -0,0 +1,62 @@
+import struct
+
+PROBE_BYTES = 256 * 1024
+
+def skip_id3(header):
+    if len(header) >= 10 and header[:3] == b'ID3':
+        size = 0
+        for byte in header[6:10]:
+            size = (size << 7) | (byte & 0x7f)
+        return 10 + size
+    return 0
+
+def probe_wav(header, total_size):
+    if len(header) < 12 or header[:4] not in (b'RIFF', b'RF64') or header[8:12] != b'WAVE':
+        return {}
+    position = 12
+    fmt = None
+    while position + 8 <= len(header):
+        chunk_id = header[position:position + 4]
+        chunk_size = struct.unpack('<I', header[position + 4:position + 8])[0]
+        body = position + 8
+        if chunk_id == b'fmt ' and body + 16 <= len(header):
+            audio_format, channels, sample_rate, byte_rate, block_align, bits = struct.unpack(
+                '<HHIIHH', header[body:body + 16]
+            )
+            fmt = {'channels': channels, 'sample_rate': sample_rate, 'byte_rate': byte_rate}
+        elif chunk_id == b'data':
+            if fmt is None or not fmt['byte_rate']:
+                return {}
+            if chunk_size in (0, 0xffffffff) or body + chunk_size > total_size:
+                chunk_size = total_size - body
+            return {
+                'duration': round(chunk_size / fmt['byte_rate'], 3),
+                'sample_rate': fmt['sample_rate'],
+                'channels': fmt['channels']
+            }
+        position = body + chunk_size + (chunk_size & 1)
+    return {}
+
+def probe_flac(header):
+    position = skip_id3(header)
+    if header[position:position + 4] != b'fLaC':
+        return {}
+    block = position + 4
+    if block + 4 + 18 > len(header) or header[block] & 0x7f != 0:
+        return {}
+    info = header[block + 4 + 10:block + 4 + 18]
+    packed = int.from_bytes(info, 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_samples = packed & 0xfffffffff
+    if not sample_rate:
+        return {}
+    result = {'sample_rate': sample_rate, 'channels': channels}
+    if total_samples:
+        result['duration'] = round(total_samples / sample_rate, 3)
+    return result
+
+def probe_audio(header, total_size):
+    if header[:4] in (b'RIFF', b'RF64'):
+        return probe_wav(header, total_size)
+    return probe_flac(header)
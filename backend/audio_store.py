@@ -0,0 +1,504 @@
+import fcntl
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import tarfile
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from audio_meta import PROBE_BYTES, probe_audio
+from werkzeug.http import parse_etags, parse_if_range_header, parse_range_header, quote_etag
+
+AUDIO_EXTENSIONS = ('.wav', '.flac')
+INDEX_VERSION = 4
+READ_CHUNK_SIZE = 256 * 1024
+FINGERPRINT_BYTES = 64 * 1024
+AUDIO_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+LAZY_FLUSH_INTERVAL = 5.0
+BLOB_NAME = re.compile(r'^([0-9a-f]{64})\.[A-Za-z0-9]+$')
+
+class ArchiveHandle:
+    # 保持已建立索引的tar文件处于打开状态：数据文件被替换（mv）后，
+    # 仍在答旧版本题目的学生可以继续从旧文件读取音频。
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.identity = (stat.st_dev, stat.st_ino)
+        self.signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    
+    def is_current(self, fd):
+        stat = os.fstat(fd)
+        return (stat.st_dev, stat.st_ino) == self.identity
+    
+    def reopen(self):
+        return os.fdopen(os.dup(self.file.fileno()), 'rb')
+
+class AudioSource:
+    __slots__ = ('path', 'offset', 'size', 'name', 'digest', 'meta', 'archive')
+    
+    def __init__(self, path, offset, size, name, digest, meta=None, archive=None):
+        self.path = path
+        self.offset = offset
+        self.size = size
+        self.name = name
+        self.digest = digest
+        self.meta = meta or {}
+        self.archive = archive
+    
+    @property
+    def mimetype(self):
+        return mimetypes.guess_type(self.name)[0] or 'application/octet-stream'
+    
+    def open_file(self):
+        handle = open(self.path, 'rb')
+        if self.archive is None or self.archive.is_current(handle.fileno()):
+            return handle, True
+        handle.close()
+        return self.archive.reopen(), False
+    
+    def open_range(self, start=0, length=None):
+        if length is None:
+            length = self.size - start
+        return RangeFile(self, self.offset + start, length)
+
+class RangeFile:
+    # fileno() + 当前偏移 + Content-Length 可以让 gunicorn 之类的服务器直接走 os.sendfile，
+    # 其余服务器按 read() 迭代，读取量被限制在成员数据范围内。
+    # 从已被替换的旧tar读取时共享文件描述符，只能用pread，不提供fileno()。
+    def __init__(self, source, start, length):
+        self._file, self._owned = source.open_file()
+        self._position = start
+        if self._owned:
+            self._file.seek(start)
+        self._remaining = max(length, 0)
+        self._on_close = []
+    
+    def call_on_close(self, callback):
+        self._on_close.append(callback)
+    
+    def fileno(self):
+        if not self._owned:
+            raise io.UnsupportedOperation('fileno')
+        return self._file.fileno()
+    
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        if self._owned:
+            data = self._file.read(size)
+        else:
+            data = os.pread(self._file.fileno(), size, self._position)
+        self._position += len(data)
+        self._remaining -= len(data)
+        return data
+    
+    def __iter__(self):
+        while True:
+            data = self.read(READ_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+    
+    def close(self):
+        self._file.close()
+        callbacks, self._on_close = self._on_close, []
+        for callback in callbacks:
+            callback()
+
+def archive_signature(tar_path):
+    try:
+        stat = os.stat(tar_path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def hash_and_probe(handle, size):
+    digest = hashlib.sha256()
+    header = b''
+    while True:
+        chunk = handle.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(header) < PROBE_BYTES:
+            header += chunk[:PROBE_BYTES - len(header)]
+        digest.update(chunk)
+    return digest.hexdigest(), probe_audio(header, size)
+
+def member_fingerprint(handle, size):
+    digest = hashlib.sha256()
+    digest.update(handle.read(FINGERPRINT_BYTES))
+    if size > FINGERPRINT_BYTES:
+        handle.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+        digest.update(handle.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+def is_plain_tar(tar_path):
+    try:
+        with tarfile.open(tar_path, 'r:'):
+            return True
+    except tarfile.ReadError:
+        return False
+
+def parse_tag_document(raw):
+    try:
+        content = json.loads(raw.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if isinstance(content, dict):
+        return content
+    if isinstance(content, list):
+        return {'sample_pool': content}
+    return None
+
+def build_tar_index(archive, previous=None):
+    # 与上一版索引中名称、大小、修改时间以及首尾各64KB内容都相同的成员直接沿用其哈希和元数据，
+    # 只完整读取新增或变化的音频
+    known = {}
+    if previous and previous.get('version') == INDEX_VERSION:
+        for member in previous.get('members', []):
+            known[(member['name'], member['size'], member['mtime'])] = member
+    
+    members = []
+    documents = {}
+    archive.file.seek(0)
+    with tarfile.open(fileobj=archive.file, mode='r:') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            file_ext = os.path.splitext(member.name)[1].lower()
+            if file_ext in AUDIO_EXTENSIONS:
+                handle = tar.extractfile(member)
+                fingerprint = member_fingerprint(handle, member.size)
+                cached = known.get((member.name, member.size, member.mtime))
+                if cached is not None and cached['fingerprint'] == fingerprint:
+                    digest, meta = cached['sha256'], cached['meta']
+                else:
+                    handle.seek(0)
+                    digest, meta = hash_and_probe(handle, member.size)
+                members.append({
+                    'name': member.name,
+                    'offset': member.offset_data,
+                    'size': member.size,
+                    'mtime': member.mtime,
+                    'fingerprint': fingerprint,
+                    'sha256': digest,
+                    'meta': meta
+                })
+            elif file_ext == '.json':
+                handle = tar.extractfile(member)
+                if handle is None:
+                    continue
+                base_name = os.path.splitext(os.path.basename(member.name))[0]
+                document = parse_tag_document(handle.read())
+                if document is not None:
+                    documents[base_name] = document
+    return {
+        'version': INDEX_VERSION,
+        'archive': archive.signature,
+        'members': members,
+        'documents': documents
+    }
+
+class FileIndexStore:
+    # 索引保存为本机目录下的JSON文件，用文件锁保证同一台机器上的多个worker只建一次索引
+    def __init__(self, folder):
+        self.folder = folder
+    
+    def path(self, name):
+        return os.path.join(self.folder, f'{name}.json')
+    
+    def read(self, name):
+        try:
+            with open(self.path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def write(self, name, index):
+        os.makedirs(self.folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.folder)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(temp_path, self.path(name))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    @contextmanager
+    def lock(self, name):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.path(name) + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+class RedisIndexStore:
+    # 索引保存在Redis（或兼容Redis协议的服务）中，多台机器共享，用Redis锁保证只建一次
+    def __init__(self, client, prefix='survey', lock_timeout=600):
+        self.client = client
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+    
+    def read(self, name):
+        try:
+            raw = self.client.get(f'{self.prefix}:index:{name}')
+            return json.loads(raw) if raw else None
+        except ValueError:
+            return None
+    
+    def write(self, name, index):
+        self.client.set(f'{self.prefix}:index:{name}', json.dumps(index, ensure_ascii=False))
+    
+    @contextmanager
+    def lock(self, name):
+        # 只用SET NX实现，不依赖Lua脚本，兼容只实现了基本命令的Redis替代品
+        key = f'{self.prefix}:lock:{name}'
+        token = os.urandom(16).hex()
+        deadline = time.monotonic() + self.lock_timeout
+        while not self.client.set(key, token, nx=True, ex=self.lock_timeout):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'等待索引锁超时: {name}')
+            time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if self.client.get(key) == token:
+                self.client.delete(key)
+
+def is_current_index(index, signature):
+    return bool(index) and index.get('version') == INDEX_VERSION and index.get('archive') == signature
+
+def load_index(store, name, signature, build):
+    index = store.read(name)
+    if is_current_index(index, signature):
+        return index
+    with store.lock(name):
+        # 等锁期间其他进程可能已经建好了索引
+        previous = store.read(name)
+        if is_current_index(previous, signature):
+            return previous
+        index = build(previous or index)
+        try:
+            store.write(name, index)
+        except OSError:
+            pass
+    return index
+
+def load_tar_index(archive, store, name):
+    return load_index(store, name, archive.signature, lambda previous: build_tar_index(archive, previous))
+
+def index_tar_file(tar_path, store, name):
+    archive = ArchiveHandle(tar_path)
+    index = load_tar_index(archive, store, name)
+    audio_files = []
+    for member in index['members']:
+        audio_name = os.path.basename(member['name'])
+        audio_files.append({
+            'name': audio_name,
+            'source': AudioSource(
+                tar_path, member['offset'], member['size'], audio_name, member['sha256'], member['meta'], archive
+            )
+        })
+    return audio_files, dict(index['documents'])
+
+def scan_tar_members(archive):
+    # 只读取成员头和标签JSON，不读取音频内容
+    members = []
+    documents = {}
+    archive.file.seek(0)
+    with tarfile.open(fileobj=archive.file, mode='r:') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            file_ext = os.path.splitext(member.name)[1].lower()
+            if file_ext in AUDIO_EXTENSIONS:
+                members.append({
+                    'name': member.name,
+                    'offset': member.offset_data,
+                    'size': member.size,
+                    'mtime': member.mtime
+                })
+            elif file_ext == '.json':
+                handle = tar.extractfile(member)
+                if handle is None:
+                    continue
+                base_name = os.path.splitext(os.path.basename(member.name))[0]
+                document = parse_tag_document(handle.read())
+                if document is not None:
+                    documents[base_name] = document
+    return {
+        'version': INDEX_VERSION,
+        'archive': archive.signature,
+        'members': members,
+        'documents': documents
+    }
+
+class LazyTarIndex:
+    # 大题库用：建立索引时只读取成员头，每段音频的哈希和元数据在第一次用到时才计算，并定期写回索引
+    def __init__(self, tar_path, store, name, flush_interval=LAZY_FLUSH_INTERVAL):
+        self.archive = ArchiveHandle(tar_path)
+        self.store = store
+        self.name = name
+        self.flush_interval = flush_interval
+        index = load_index(store, name, self.archive.signature, lambda previous: scan_tar_members(self.archive))
+        self.index = index
+        self.members = index['members']
+        self.documents = index['documents']
+        self.sources = [
+            AudioSource(
+                tar_path, member['offset'], member['size'], os.path.basename(member['name']),
+                member.get('sha256'), dict(member.get('meta') or {}), self.archive
+            )
+            for member in self.members
+        ]
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flushed = time.monotonic()
+    
+    def resolve(self, positions):
+        with self._lock:
+            for position in positions:
+                source = self.sources[position]
+                if source.digest is not None:
+                    continue
+                handle = source.open_range(0, source.size)
+                try:
+                    digest, meta = hash_and_probe(handle, source.size)
+                finally:
+                    handle.close()
+                source.digest = digest
+                source.meta = dict(meta)
+                self.members[position].update(sha256=digest, meta=meta)
+                self._dirty = True
+            if self._dirty and time.monotonic() - self._flushed >= self.flush_interval:
+                self._flush()
+        return [self.sources[position] for position in positions]
+    
+    def _flush(self):
+        try:
+            self.store.write(self.name, self.index)
+        except OSError:
+            return
+        self._dirty = False
+        self._flushed = time.monotonic()
+    
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._flush()
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+class BlobStore:
+    def __init__(self, blob_dir):
+        self.blob_dir = blob_dir
+        self._sources = {}
+        self._lock = threading.Lock()
+    
+    def blob_path(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(self.blob_dir, digest[:2], f'{digest}{extension}')
+    
+    def add(self, source):
+        with self._lock:
+            existing = self._sources.get(source.digest)
+            # 同一个tar重新建立索引后，新的偏移取代旧的
+            if existing is None or (existing.archive is not None and existing.path == source.path):
+                self._sources[source.digest] = source
+                return source
+            return existing
+    
+    def add_file(self, path, name):
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            digest, meta = hash_and_probe(f, size)
+        existing = self.get(digest)
+        if existing is not None:
+            return existing
+        blob_path = self.blob_path(digest, name)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        if not os.path.exists(blob_path):
+            os.replace(path, blob_path)
+        return self.add(AudioSource(blob_path, 0, size, name, digest, meta))
+    
+    def restore(self, members):
+        # 按解压索引找回已存入的音频，有任何一个不在本机时返回None
+        sources = []
+        for member in members:
+            source = self.get(member['sha256'])
+            if source is None:
+                blob_path = self.blob_path(member['sha256'], member['name'])
+                if not os.path.exists(blob_path):
+                    return None
+                source = self.add(AudioSource(blob_path, 0, member['size'], member['name'], member['sha256'], member['meta']))
+            sources.append(source)
+        return sources
+    
+    def get(self, digest):
+        return self._sources.get(digest)
+    
+    def find(self, filename):
+        match = BLOB_NAME.match(filename)
+        return self.get(match.group(1)) if match else None
+
+def blob_filename(source):
+    return f'{source.digest}{os.path.splitext(source.name)[1].lower()}'
+
+CLIP_META_FIELDS = ('duration', 'sample_rate', 'channels', 'loudness', 'peaks')
+
+def clip_fields(source):
+    fields = {'size': source.size}
+    for name in CLIP_META_FIELDS:
+        if name in source.meta:
+            fields[name] = source.meta[name]
+    return fields
+
+def range_bounds(byte_range, size):
+    start, end = byte_range.ranges[0]
+    if byte_range.units == 'bytes' and end is None and start < 0 and size > 0:
+        # werkzeug把比文件还长的后缀范围（bytes=-N）当作无法满足，按RFC 9110应返回整个文件
+        return max(start + size, 0), size
+    return byte_range.range_for_length(size)
+
+def plan_audio_response(source, headers):
+    response_headers = {
+        'ETag': quote_etag(source.digest),
+        'Cache-Control': AUDIO_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes'
+    }
+    if parse_etags(headers.get('If-None-Match')).contains_weak(source.digest):
+        return 304, response_headers, 0, None
+    
+    response_headers['Content-Type'] = source.mimetype
+    size = source.size
+    byte_range = parse_range_header(headers.get('Range'))
+    if byte_range is not None and headers.get('If-Range'):
+        if_range = parse_if_range_header(headers.get('If-Range'))
+        if if_range.etag != source.digest:
+            byte_range = None
+    if byte_range is None or len(byte_range.ranges) != 1:
+        return 200, response_headers, 0, size
+    
+    bounds = range_bounds(byte_range, size)
+    if bounds is None:
+        response_headers['Content-Range'] = f'bytes */{size}'
+        return 416, response_headers, 0, None
+    start, stop = bounds
+    response_headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    return 206, response_headers, start, stop - start
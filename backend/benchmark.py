@@ -0,0 +1,335 @@
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import wave
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_RATE = 16000
+TAG_POOL = ['Speech', 'Music', 'Dog', 'Car', 'Rain', 'Bird', 'Siren', 'Applause']
+
+def wav_clip(seconds, seed):
+    rng = random.Random(seed)
+    frames = int(seconds * SAMPLE_RATE)
+    noise = rng.randbytes(frames * 2)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(noise)
+    return buffer.getvalue()
+
+def flac_clip(seconds, seed):
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise SystemExit('生成FLAC测试音频需要ffmpeg')
+    result = subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-f', 'wav', '-i', 'pipe:0', '-f', 'flac', 'pipe:1'],
+        input=wav_clip(seconds, seed), stdout=subprocess.PIPE, check=True
+    )
+    return result.stdout
+
+def add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+def generate_dataset(data_dir, args):
+    make_clip = flac_clip if args.format == 'flac' else wav_clip
+    extension = args.format
+    seed = 0
+    
+    def clip():
+        nonlocal seed
+        seed += 1
+        return make_clip(args.duration, seed)
+    
+    for survey in (1, 2):
+        stage_dir = os.path.join(data_dir, f'data{survey}')
+        os.makedirs(stage_dir, exist_ok=True)
+        for stage_file, count in (('guide5.tar', args.guide_clips), ('test20.tar', args.clips)):
+            prefix = os.path.splitext(stage_file)[0]
+            answers = []
+            with tarfile.open(os.path.join(stage_dir, stage_file), 'w') as tar:
+                for index in range(count):
+                    name = f'{prefix}_{index:04d}.{extension}'
+                    add_member(tar, f'{prefix}/{name}', clip())
+                    tags = random.Random(seed).sample(TAG_POOL, 4)
+                    if survey == 2:
+                        document = {'sample_pool': tags, 'sample_selected': tags[0]}
+                        add_member(tar, f'{prefix}/{os.path.splitext(name)[0]}.json', json.dumps(document).encode('utf-8'))
+                    answers.append({'audio': name, 'answer': index % 2 == 0})
+                if survey == 1 and prefix == 'guide5':
+                    add_member(tar, f'{prefix}/answer.json', json.dumps(answers).encode('utf-8'))
+    
+    stage_dir = os.path.join(data_dir, 'data3')
+    os.makedirs(stage_dir, exist_ok=True)
+    with tarfile.open(os.path.join(stage_dir, 'test25.tar'), 'w') as tar:
+        for index in range(args.pairs):
+            add_member(tar, f'raw_sample_{index}.{extension}', clip())
+            add_member(tar, f'superres_sample_{index}.{extension}', clip())
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def server_command(args, port):
+    if args.server == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+                '--port', str(port), '--workers', str(args.workers), '--log-level', 'warning']
+    if args.server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-k', 'gthread',
+                '--threads', str(args.threads), '-b', f'127.0.0.1:{port}', 'app:app']
+    return [sys.executable, 'app.py', '--host', '127.0.0.1', '--port', str(port)]
+
+def wait_for_server(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('后端进程启动失败')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit('等待后端启动超时')
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.bytes = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+    
+    def record(self, route, seconds, size, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append(seconds)
+            self.bytes[route] = self.bytes.get(route, 0) + size
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+class Client:
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+        self.connection = None
+        self.cookie = None
+    
+    def request(self, route, method, path, body=None):
+        headers = {'Accept-Encoding': 'gzip'}
+        if self.cookie:
+            # 与浏览器一样带上后端下发的客户端cookie，准入控制按它区分每个学生
+            headers['Cookie'] = self.cookie
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        status, data = 0, b''
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+                self.connection.request(method, path, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                status, data = response.status, response.read()
+                cookie = response.getheader('Set-Cookie')
+                if cookie:
+                    self.cookie = cookie.split(';', 1)[0]
+                break
+            except (OSError, http.client.HTTPException):
+                if self.connection is not None:
+                    self.connection.close()
+                self.connection = None
+        self.recorder.record(route, time.perf_counter() - started, len(data), 200 <= status < 300)
+        if response_is_json(data, status):
+            return json.loads(decode_body(data))
+        return None
+    
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+def decode_body(data):
+    if data[:2] == b'\x1f\x8b':
+        import gzip
+        return gzip.decompress(data)
+    return data
+
+def response_is_json(data, status):
+    return 200 <= status < 300 and data and not data.startswith(b'RIFF') and not data.startswith(b'fLaC')
+
+def think(args):
+    if args.think_time:
+        time.sleep(random.uniform(0, args.think_time * 2))
+
+def stream_items(client, args, clips):
+    for audio in clips:
+        client.request('serve_audio', 'GET', audio)
+        think(args)
+
+def rater_session(port, student_index, args, recorder):
+    client = Client(port, recorder)
+    student_id = f'bench{student_index:05d}'
+    identity = {'name': f'Rater {student_index}', 'email': f'{student_id}@example.com', 'student_id': student_id}
+    try:
+        client.request('get_survey_completions', 'GET', f'/api/surveys/completions?student_id={student_id}')
+        for survey in args.surveys:
+            if survey == 3:
+                data = client.request('get_survey_items', 'GET', f'/api/surveys/3/items?student_id={student_id}') or {}
+                items = data.get('items', [])
+                stream_items(client, args, [option['audio'] for item in items for option in item['options']])
+                answers = [{
+                    'index': item['index'],
+                    'answer': random.choice([option['id'] for option in item['options']])
+                } for item in items]
+                client.request('submit_survey', 'POST', '/api/surveys/3/submit', dict(identity, answers=answers))
+                continue
+            for stage in ('guide', 'test'):
+                data = client.request('get_survey_items', 'GET', f'/api/surveys/{survey}/items?stage={stage}') or {}
+                items = data.get('items', [])
+                stream_items(client, args, [item['audio'] for item in items])
+                answers = [{
+                    'index': item['index'],
+                    'answer': random.choice(item['tags']) if survey == 2 and item.get('tags') else random.choice([True, False])
+                } for item in items]
+                client.request('submit_survey', 'POST', f'/api/surveys/{survey}/submit', dict(identity, stage=stage, answers=answers))
+    finally:
+        client.close()
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def measure_cold_start(port, args, recorder):
+    client = Client(port, recorder)
+    timings = {}
+    try:
+        for survey in args.surveys:
+            stages = [None] if survey == 3 else ['guide', 'test']
+            for stage in stages:
+                path = f'/api/surveys/{survey}/items' + (f'?stage={stage}' if stage else '')
+                started = time.perf_counter()
+                client.request('cold_start', 'GET', path)
+                timings[f'survey{survey}' + (f'_{stage}' if stage else '')] = time.perf_counter() - started
+    finally:
+        client.close()
+    return timings
+
+def report(recorder, cold_start, elapsed, args):
+    rows = []
+    total_requests = 0
+    total_bytes = 0
+    for route in sorted(recorder.samples):
+        if route == 'cold_start':
+            continue
+        samples = recorder.samples[route]
+        total_requests += len(samples)
+        total_bytes += recorder.bytes.get(route, 0)
+        rows.append({
+            'route': route,
+            'requests': len(samples),
+            'errors': recorder.errors.get(route, 0),
+            'p50_ms': round(percentile(samples, 0.5) * 1000, 2),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+            'bytes': recorder.bytes.get(route, 0)
+        })
+    summary = {
+        'students': args.students,
+        'server': args.server,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(total_requests / elapsed, 2) if elapsed else 0,
+        'bytes_served': total_bytes,
+        'mb_per_s': round(total_bytes / elapsed / 1024 / 1024, 2) if elapsed else 0,
+        'cold_start_ms': {stage: round(seconds * 1000, 2) for stage, seconds in cold_start.items()},
+        'routes': rows
+    }
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+    print(f"服务器: {args.server}  学生数: {args.students}  总耗时: {summary['elapsed_s']}s")
+    print(f"吞吐: {summary['requests_per_s']} req/s, {summary['mb_per_s']} MB/s, 共 {total_bytes} 字节")
+    print('冷启动（首次加载各阶段）:')
+    for stage, millis in summary['cold_start_ms'].items():
+        print(f'  {stage:<16} {millis:>10.2f} ms')
+    print(f"{'路由':<26}{'请求数':>8}{'错误':>8}{'p50(ms)':>12}{'p99(ms)':>12}{'字节':>14}")
+    for row in rows:
+        print(f"{row['route']:<26}{row['requests']:>8}{row['errors']:>8}{row['p50_ms']:>12}{row['p99_ms']:>12}{row['bytes']:>14}")
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟整班学生答题的端到端压测')
+    parser.add_argument('--students', type=int, default=30, help='并发答题的学生数')
+    parser.add_argument('--surveys', default='1,2,3', help='每个学生依次完成的问卷')
+    parser.add_argument('--clips', type=int, default=20, help='问卷1/2正式阶段的音频数')
+    parser.add_argument('--guide-clips', type=int, default=5, help='问卷1/2引导阶段的音频数')
+    parser.add_argument('--pairs', type=int, default=25, help='问卷3的音频对数')
+    parser.add_argument('--duration', type=float, default=10.0, help='每段音频的秒数')
+    parser.add_argument('--format', choices=['wav', 'flac'], default='wav')
+    parser.add_argument('--server', choices=['flask', 'gunicorn', 'asgi'], default='flask')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=16, help='gunicorn每个进程的线程数')
+    parser.add_argument('--think-time', type=float, default=0.0, help='每题平均停顿秒数')
+    parser.add_argument('--verbose', action='store_true', help='显示后端访问日志')
+    parser.add_argument('--keep', action='store_true', help='保留生成的数据目录')
+    parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+    args = parser.parse_args()
+    args.surveys = [int(value) for value in args.surveys.split(',') if value.strip()]
+    
+    work_dir = tempfile.mkdtemp(prefix='survey_bench_')
+    process = None
+    try:
+        data_dir = os.path.join(work_dir, 'data')
+        generate_dataset(data_dir, args)
+        port = free_port()
+        env = dict(os.environ)
+        env.update({
+            'SURVEY_DATA_FOLDER': data_dir,
+            'SURVEY_OUTPUT_FOLDER': os.path.join(work_dir, 'output_data'),
+            'SURVEY_UPLOAD_FOLDER': os.path.join(work_dir, 'uploads')
+        })
+        output = None if args.verbose else subprocess.DEVNULL
+        process = subprocess.Popen(server_command(args, port), cwd=BACKEND_DIR, env=env, stdout=output, stderr=output)
+        wait_for_server(port, process)
+        
+        recorder = Recorder()
+        cold_start = measure_cold_start(port, args, recorder)
+        threads = [
+            threading.Thread(target=rater_session, args=(port, index, args, recorder))
+            for index in range(args.students)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(recorder, cold_start, time.perf_counter() - started, args)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if args.keep:
+            print(f'数据目录: {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
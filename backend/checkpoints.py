@@ -0,0 +1,130 @@
+import json
+import os
+import time
+
+from group_commit import GroupCommit, ThreadConnections
+
+CHECKPOINT_FLUSH_INTERVAL = 1.0
+
+def is_update(change):
+    return 'position' in change or bool(change.get('answers'))
+
+def merge_checkpoint(base, change):
+    if change.get('clear'):
+        base = None
+    if not is_update(change):
+        return base
+    if base is None or base.get('dataset_version') != change.get('dataset_version'):
+        base = {'dataset_version': change.get('dataset_version'), 'position': 0, 'answers': {}}
+    merged = {
+        'dataset_version': base['dataset_version'],
+        'position': change.get('position', base['position']),
+        'answers': dict(base['answers'], **change.get('answers', {})),
+        'updated_at': change.get('updated_at', base.get('updated_at'))
+    }
+    return merged
+
+def combine_changes(first, second):
+    # 合并两次尚未写入的修改，结果等价于依次应用first和second
+    if second.get('clear'):
+        return second
+    if not is_update(second):
+        return first
+    if not is_update(first) and not first.get('clear'):
+        return second
+    if not is_update(first) or first.get('dataset_version') != second.get('dataset_version'):
+        return dict(second, clear=True)
+    combined = dict(first, **{name: value for name, value in second.items() if name != 'answers'})
+    combined['answers'] = dict(first.get('answers', {}), **second.get('answers', {}))
+    return combined
+
+class CheckpointStore:
+    # 答题进度是可丢失的软状态：每次作答只在内存中合并，后台线程定期批量写入SQLite
+    def __init__(self, db_path, flush_interval=CHECKPOINT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect = ThreadConnections(db_path, synchronous='NORMAL')
+        connection = self._connect()
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                student_id TEXT NOT NULL,
+                survey_type INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                dataset_version TEXT,
+                position INTEGER NOT NULL,
+                answers TEXT NOT NULL,
+                updated_at TEXT,
+                PRIMARY KEY (student_id, survey_type, stage)
+            );
+        ''')
+        connection.commit()
+        self._writer = GroupCommit(
+            self._connect, self._write, 'checkpoint-flusher', interval=flush_interval, combine=combine_changes
+        )
+    
+    def update(self, student_id, survey_type, stage, dataset_version, position=None, answers=None):
+        change = {
+            'dataset_version': dataset_version,
+            'answers': {str(index): answer for index, answer in (answers or {}).items()},
+            'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        if position is not None:
+            change['position'] = position
+        self._writer.add(change, key=(student_id, survey_type, stage))
+    
+    def clear(self, student_id, survey_type, stage):
+        self._writer.add({'clear': True}, key=(student_id, survey_type, stage))
+    
+    def _read(self, connection, key):
+        row = connection.execute(
+            'SELECT dataset_version, position, answers, updated_at FROM checkpoints '
+            'WHERE student_id = ? AND survey_type = ? AND stage = ?',
+            key
+        ).fetchone()
+        if row is None:
+            return None
+        return {'dataset_version': row[0], 'position': row[1], 'answers': json.loads(row[2]), 'updated_at': row[3]}
+    
+    def get(self, student_id, survey_type):
+        rows = self._connect().execute(
+            'SELECT stage, dataset_version, position, answers, updated_at FROM checkpoints '
+            'WHERE student_id = ? AND survey_type = ?',
+            (student_id, survey_type)
+        ).fetchall()
+        checkpoints = {
+            stage: {'dataset_version': version, 'position': position, 'answers': json.loads(answers), 'updated_at': updated_at}
+            for stage, version, position, answers, updated_at in rows
+        }
+        pending = {key[2]: change for key, change in self._writer.pending() if key[:2] == (student_id, survey_type)}
+        for stage, change in pending.items():
+            merged = merge_checkpoint(checkpoints.get(stage), change)
+            if merged is None:
+                checkpoints.pop(stage, None)
+            else:
+                checkpoints[stage] = merged
+        return checkpoints
+    
+    def _write(self, connection, batch):
+        for key, change in batch:
+            merged = merge_checkpoint(self._read(connection, key), change)
+            if merged is None:
+                connection.execute(
+                    'DELETE FROM checkpoints WHERE student_id = ? AND survey_type = ? AND stage = ?', key
+                )
+                continue
+            connection.execute(
+                'INSERT OR REPLACE INTO checkpoints '
+                '(student_id, survey_type, stage, dataset_version, position, answers, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                key + (
+                    merged['dataset_version'], merged['position'],
+                    json.dumps(merged['answers'], ensure_ascii=False), merged['updated_at']
+                )
+            )
+    
+    def flush(self):
+        self._writer.flush()
+    
+    def close(self):
+        self._writer.close()
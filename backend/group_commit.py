@@ -0,0 +1,140 @@
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+
+# 立即提交模式下写入失败后等待多久再重试，避免放回队列的条目反复失败时空转
+RETRY_DELAY = 1.0
+
+logger = logging.getLogger(__name__)
+
+class ThreadConnections:
+    # 每个线程一个SQLite连接，WAL模式下读写互不阻塞
+    def __init__(self, db_path, synchronous='FULL'):
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self._local = threading.local()
+    
+    def __call__(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._local.connection = connection
+        return connection
+
+class GroupCommit:
+    # 多个线程的写入由一个后台线程合并成一个SQLite事务：write(connection, entries)写入一批(key, entry)，提交由这里完成。
+    # interval为None时有写入就立即提交，调用方可以等待落盘（提交记录）；否则每interval秒提交一次（可以丢失的软状态）。
+    # 给了combine时同一个key尚未写入的条目先在内存中合并；写入失败时不等待结果的条目放回队列，下次重试
+    def __init__(self, connect, write, name, interval=None, combine=None, max_batch=None):
+        self.connect = connect
+        self.write = write
+        self.interval = interval
+        self.combine = combine
+        self.max_batch = max_batch
+        self._pending = {}
+        self._waiters = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    
+    def _queue(self, key, entry):
+        if key is None:
+            key = next(self._sequence)
+        pending = self._pending.get(key)
+        self._pending[key] = entry if pending is None or self.combine is None else self.combine(pending, entry)
+        return key
+    
+    def add(self, entry, key=None, wait=False):
+        waiter = {'done': threading.Event(), 'error': None} if wait else None
+        with self._lock:
+            key = self._queue(None if wait else key, entry)
+            if waiter is not None:
+                self._waiters[key] = waiter
+            if self.interval is None:
+                self._changed.notify()
+        if waiter is not None:
+            waiter['done'].wait()
+            if waiter['error'] is not None:
+                raise waiter['error']
+    
+    def add_all(self, entries):
+        with self._lock:
+            for entry in entries:
+                self._queue(None, entry)
+            if self.interval is None:
+                self._changed.notify()
+    
+    def pending(self):
+        with self._lock:
+            return list(self._pending.items())
+    
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                keys = list(itertools.islice(self._pending, self.max_batch))
+                batch = [(key, self._pending.pop(key)) for key in keys]
+                waiters = {key: self._waiters.pop(key) for key in keys if key in self._waiters}
+            if not batch:
+                return
+            # 任何异常都要通知等待的调用方，否则提交请求会一直阻塞
+            error = RuntimeError('写入被中断')
+            try:
+                connection = self.connect()
+                try:
+                    self.write(connection, batch)
+                    connection.commit()
+                except BaseException:
+                    connection.rollback()
+                    raise
+                error = None
+            except Exception as e:
+                error = e
+                with self._lock:
+                    for key, entry in batch:
+                        if key in waiters:
+                            continue
+                        newer = self._pending.pop(key, None)
+                        self._pending[key] = entry if newer is None or self.combine is None else self.combine(entry, newer)
+            finally:
+                for waiter in waiters.values():
+                    waiter['error'] = error
+                    waiter['done'].set()
+            if error is not None:
+                raise error
+    
+    def _run(self):
+        while True:
+            with self._lock:
+                if self.interval is None:
+                    while not self._pending and not self._stopped:
+                        self._changed.wait()
+                elif not self._stopped:
+                    self._changed.wait(self.interval)
+                stopped = self._stopped
+            if stopped:
+                return
+            try:
+                self.flush()
+            except Exception:
+                # 写入线程不能退出，失败的条目下次重试
+                logger.exception('%s写入失败', self._thread.name)
+                if self.interval is None:
+                    time.sleep(RETRY_DELAY)
+    
+    def close(self):
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._changed.notify()
+        self._thread.join()
+        while self.pending():
+            self.flush()
@@ -0,0 +1,41 @@
+import gzip
+import hashlib
+import json
+
+from werkzeug.http import parse_etags, quote_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PAYLOAD_CACHE_CONTROL = 'no-cache'
+
+class PreparedPayload:
+    __slots__ = ('etag', 'encodings')
+    
+    def __init__(self, data):
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.encodings = {'identity': body, 'gzip': gzip.compress(body, 9)}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(body)
+    
+    def negotiate(self, accept_encodings):
+        preferred = [name for name in ('br', 'gzip') if name in self.encodings]
+        encoding = accept_encodings.best_match(preferred, default='identity')
+        return encoding, self.encodings[encoding]
+
+def plan_payload_response(payload, headers, accept_encodings):
+    response_headers = {
+        'ETag': quote_etag(payload.etag),
+        'Cache-Control': PAYLOAD_CACHE_CONTROL,
+        'Vary': 'Accept-Encoding'
+    }
+    if parse_etags(headers.get('If-None-Match')).contains_weak(payload.etag):
+        return 304, response_headers, b''
+    encoding, body = payload.negotiate(accept_encodings)
+    response_headers['Content-Type'] = 'application/json; charset=utf-8'
+    if encoding != 'identity':
+        response_headers['Content-Encoding'] = encoding
+    return 200, response_headers, body
@@ -0,0 +1,331 @@
+import os
+import threading
+
+import numpy as np
+
+from surveys import iter_stages, normalize_boolean, normalize_option
+
+INITIAL_ROWS = 64
+INITIAL_COLUMNS = 32
+CONFIDENCE_Z = 1.96
+MIN_AGREEMENT = float(os.environ.get('SCORING_MIN_AGREEMENT', '0.5'))
+MIN_OVERLAP = int(os.environ.get('SCORING_MIN_OVERLAP', '5'))
+MAX_POSITION_BIAS = float(os.environ.get('SCORING_MAX_POSITION_BIAS', '0.35'))
+# 数据版本已不在内存中、无法得知题目数时题号的上限，避免异常题号撑大作答矩阵
+MAX_ITEMS = int(os.environ.get('SCORING_MAX_ITEMS', '20000'))
+
+def round_value(value, digits=4):
+    if value is None or not np.isfinite(value):
+        return None
+    return round(float(value), digits)
+
+def wilson_interval(successes, totals, z=CONFIDENCE_Z):
+    successes = np.asarray(successes, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = successes / totals
+        denominator = 1 + z * z / totals
+        center = (rate + z * z / (2 * totals)) / denominator
+        half = z * np.sqrt(rate * (1 - rate) / totals + z * z / (4 * totals * totals)) / denominator
+    return rate, center - half, center + half
+
+def item_counts(codes, answered, columns, categories):
+    # 题目 × 类别的计数矩阵
+    counts = np.zeros((columns, categories), dtype=np.int64)
+    item_index = np.broadcast_to(np.arange(codes.shape[1]), codes.shape)
+    np.add.at(counts, (item_index[answered], codes[answered]), 1)
+    return counts
+
+def fleiss_kappa(counts):
+    # counts: 题目 × 类别的作答人数；每题作答人数可以不同，至少两人作答的题目才参与计算
+    raters = counts.sum(axis=1)
+    rated = raters >= 2
+    if not rated.any():
+        return None
+    counts = counts[rated]
+    raters = raters[rated]
+    agreement = ((counts * counts).sum(axis=1) - raters) / (raters * (raters - 1))
+    proportions = counts.sum(axis=0) / raters.sum()
+    expected = float((proportions * proportions).sum())
+    if expected >= 1:
+        return None
+    return (float(agreement.mean()) - expected) / (1 - expected)
+
+class RatingMatrix:
+    # 一个阶段一个数据版本的作答矩阵：行是学生，列是题目，值是类别编号（-1表示未作答）
+    def __init__(self, stage, categories=()):
+        self.stage = stage
+        self.answer_type = stage['answer_type']
+        self.categories = {}
+        self.raters = {}
+        self.rater_ids = []
+        self.submitted_at = []
+        self.recorded_accuracy = []
+        self.columns = 0
+        self.codes = np.full((INITIAL_ROWS, INITIAL_COLUMNS), -1, dtype=np.int16)
+        self.positions = np.full((INITIAL_ROWS, INITIAL_COLUMNS), -1, dtype=np.int8)
+        self._stats = None
+        for category in categories:
+            self.category(category)
+    
+    def category(self, label):
+        code = self.categories.get(label)
+        if code is None:
+            code = self.categories[label] = len(self.categories)
+        return code
+    
+    def _reserve(self, rows, columns):
+        capacity_rows, capacity_columns = self.codes.shape
+        if rows <= capacity_rows and columns <= capacity_columns:
+            return
+        shape = (max(rows, capacity_rows * 2 if rows > capacity_rows else capacity_rows),
+                 max(columns, capacity_columns * 2 if columns > capacity_columns else capacity_columns))
+        codes = np.full(shape, -1, dtype=np.int16)
+        positions = np.full(shape, -1, dtype=np.int8)
+        codes[:capacity_rows, :capacity_columns] = self.codes
+        positions[:capacity_rows, :capacity_columns] = self.positions
+        self.codes, self.positions = codes, positions
+    
+    def set_answers(self, rater, submitted_at, answers, accuracy=None):
+        row = self.raters.get(rater)
+        if row is not None and submitted_at < self.submitted_at[row]:
+            # 重复提交只保留最新一次，旧记录晚到时忽略
+            return False
+        columns = max([self.columns] + [item + 1 for item, _, _ in answers])
+        if row is None:
+            row = len(self.rater_ids)
+            self._reserve(row + 1, columns)
+            self.raters[rater] = row
+            self.rater_ids.append(rater)
+            self.submitted_at.append(submitted_at)
+            self.recorded_accuracy.append(accuracy)
+        else:
+            self._reserve(row + 1, columns)
+            self.submitted_at[row] = submitted_at
+            self.recorded_accuracy[row] = accuracy
+        self.columns = columns
+        self.codes[row] = -1
+        self.positions[row] = -1
+        for item, code, position in answers:
+            self.codes[row, item] = code
+            if position is not None:
+                self.positions[row, item] = position
+        self._stats = None
+        return True
+    
+    def key_codes(self, answer_map):
+        if not answer_map:
+            return None
+        key = np.full(self.columns, -1, dtype=np.int16)
+        for item, value in answer_map.items():
+            if not isinstance(item, int) or not 0 <= item < self.columns:
+                continue
+            label = normalize_boolean(value) if self.answer_type == 'boolean' else normalize_option(value)
+            if label != '':
+                key[item] = self.category(label)
+        return key
+    
+    def stats(self, answer_map=None):
+        cache_key = answer_map is not None
+        if self._stats is not None and self._stats[0] == cache_key:
+            return self._stats[1]
+        stats = self._compute(self.key_codes(answer_map))
+        self._stats = (cache_key, stats)
+        return stats
+    
+    def item_votes(self, items):
+        # 题库中每题的作答人数，以及最多人选择的类别占比（无人作答为nan）
+        codes = self.codes[:len(self.rater_ids), :min(self.columns, items)]
+        answered = codes >= 0
+        counts = item_counts(codes, answered, items, max(len(self.categories), 1))
+        votes = counts.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            agreement = counts.max(axis=1) / votes
+        return votes, agreement
+    
+    def _compute(self, key):
+        rows = len(self.rater_ids)
+        codes = self.codes[:rows, :self.columns]
+        answered = codes >= 0
+        categories = max(len(self.categories), 1)
+        
+        counts = item_counts(codes, answered, self.columns, categories)
+        item_index = np.broadcast_to(np.arange(self.columns), codes.shape)
+        
+        # 留一法：每个回答与其他学生在同一题上的一致程度
+        clipped = np.where(answered, codes, 0)
+        same = counts[item_index, clipped] - 1
+        others = counts.sum(axis=1)[np.newaxis, :] - 1
+        same = np.where(answered, same, 0)
+        others = np.where(answered, others, 0)
+        overlap = others.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            agreement = same.sum(axis=1) / overlap
+        
+        accuracy = None
+        if key is not None:
+            keyed = answered & (key[np.newaxis, :] >= 0)
+            total = int((key >= 0).sum())
+            if total:
+                accuracy = (keyed & (codes == key[np.newaxis, :])).sum(axis=1) / total
+        
+        result = {
+            'raters': rows,
+            'items': self.columns,
+            'answers': int(answered.sum()),
+            'categories': {str(label): int(counts[:, code].sum()) for label, code in self.categories.items()},
+            'kappa': round_value(fleiss_kappa(counts)) if self.answer_type != 'paired' else None
+        }
+        rater_rows = []
+        grading = self.stage.get('grading')
+        pass_rate = grading.get('pass_rate', 0.6) if grading else None
+        answered_count = answered.sum(axis=1)
+        
+        if self.answer_type == 'boolean':
+            positive = self.categories.get(True)
+            positive_codes = codes == positive if positive is not None else np.zeros_like(answered)
+            overall = positive_codes.sum() / answered.sum() if answered.any() else np.nan
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bias = positive_codes.sum(axis=1) / answered_count - overall
+            result['positive_rate'] = round_value(overall)
+        elif self.answer_type == 'paired':
+            bias, position_bias = self._paired_stats(result, codes, answered, answered_count)
+        else:
+            bias = np.full(rows, np.nan)
+        
+        for row, rater in enumerate(self.rater_ids):
+            rater_accuracy = accuracy[row] if accuracy is not None else self.recorded_accuracy[row]
+            entry = {
+                'student_id': rater,
+                'answered': int(answered_count[row]),
+                'agreement': round_value(agreement[row]),
+                'accuracy': round_value(rater_accuracy),
+                'bias': round_value(bias[row])
+            }
+            flags = []
+            if overlap[row] >= MIN_OVERLAP and agreement[row] < MIN_AGREEMENT:
+                flags.append('low_agreement')
+            if pass_rate is not None and rater_accuracy is not None and rater_accuracy < pass_rate:
+                flags.append('low_accuracy')
+            if self.answer_type == 'paired':
+                entry['position_bias'] = round_value(position_bias[row])
+                if answered_count[row] >= MIN_OVERLAP and abs(position_bias[row]) > MAX_POSITION_BIAS:
+                    flags.append('position_bias')
+            entry['flags'] = flags
+            rater_rows.append(entry)
+        
+        result['rater_scores'] = rater_rows
+        result['flagged'] = [entry['student_id'] for entry in rater_rows if entry['flags']]
+        return result
+    
+    def _paired_stats(self, result, codes, answered, answered_count):
+        preferred = self.categories.get(self.stage['preferred_option'])
+        chosen = codes == preferred if preferred is not None else np.zeros_like(answered)
+        first = (self.positions[:len(self.rater_ids), :self.columns] == 0) & answered
+        
+        chosen_per_item = chosen.sum(axis=0)
+        answered_per_item = answered.sum(axis=0)
+        rate, low, high = wilson_interval(chosen_per_item, answered_per_item)
+        overall, overall_low, overall_high = wilson_interval(chosen.sum(), answered.sum())
+        result['preferred_option'] = self.stage['preferred_option']
+        result['preference'] = {
+            'rate': round_value(overall),
+            'low': round_value(overall_low),
+            'high': round_value(overall_high)
+        }
+        result['item_scores'] = [{
+            'item_index': item,
+            'responses': int(answered_per_item[item]),
+            'rate': round_value(rate[item]),
+            'low': round_value(low[item]),
+            'high': round_value(high[item])
+        } for item in range(self.columns) if answered_per_item[item]]
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bias = chosen.sum(axis=1) / answered_count - overall
+            position_bias = first.sum(axis=1) / answered_count - 0.5
+        return bias, position_bias
+
+class ScoringEngine:
+    def __init__(self, surveys, answer_key=None, item_count=None):
+        self.stages = {(stage['survey'], stage['name']): stage for stage in iter_stages(surveys)}
+        self.answer_key = answer_key
+        self.item_count = item_count
+        self.matrices = {}
+        self._lock = threading.Lock()
+    
+    def load(self, records):
+        for record in records:
+            self.add(record)
+    
+    def item_limit(self, stage_key, version):
+        items = self.item_count(stage_key, version) if self.item_count else None
+        return MAX_ITEMS if items is None else items
+    
+    def code_answers(self, matrix, answers, items=MAX_ITEMS):
+        # 超出题库范围的题号直接丢弃
+        coded = []
+        for answer in answers:
+            if not isinstance(answer, dict):
+                continue
+            item = answer.get('item_index')
+            if not isinstance(item, int) or isinstance(item, bool) or not 0 <= item < items:
+                continue
+            position = None
+            if matrix.answer_type == 'paired':
+                label = normalize_option(answer.get('selected_option'))
+                position = answer.get('selected_position')
+                position = position if position in (0, 1) else None
+            elif matrix.answer_type == 'boolean':
+                label = normalize_boolean(answer.get('answer'))
+            else:
+                label = normalize_option(answer.get('answer'))
+            if label == '':
+                continue
+            coded.append((item, matrix.category(label), position))
+        return coded
+    
+    def add(self, record):
+        if not isinstance(record, dict):
+            return False
+        stage = self.stages.get((record.get('survey_type'), record.get('stage')))
+        student_id = normalize_option(record.get('student_id'))
+        answers = record.get('answers')
+        if stage is None or not student_id or not isinstance(answers, list):
+            return False
+        key = (stage['key'], record.get('dataset_version') or '')
+        items = self.item_limit(*key)
+        with self._lock:
+            matrix = self.matrices.get(key)
+            if matrix is None:
+                initial = (False, True) if stage['answer_type'] == 'boolean' else [option['id'] for option in stage.get('options', [])]
+                matrix = self.matrices[key] = RatingMatrix(stage, initial)
+            return matrix.set_answers(
+                student_id, str(record.get('submitted_at') or ''), self.code_answers(matrix, answers, items), record.get('accuracy')
+            )
+    
+    def item_votes(self, stage_key, version, items):
+        with self._lock:
+            matrix = self.matrices.get((stage_key, version))
+            if matrix is None:
+                return np.zeros(items, dtype=np.int64), np.full(items, np.nan)
+            return matrix.item_votes(items)
+    
+    def report(self, survey_type=None, flagged_only=False):
+        stages = []
+        with self._lock:
+            for (stage_key, version), matrix in sorted(self.matrices.items()):
+                stage = matrix.stage
+                if survey_type is not None and stage['survey'] != survey_type:
+                    continue
+                answer_map = self.answer_key(stage_key, version) if self.answer_key and stage.get('answer_key') else None
+                stats = dict(matrix.stats(answer_map))
+                if flagged_only:
+                    stats['rater_scores'] = [entry for entry in stats['rater_scores'] if entry['flags']]
+                stages.append({
+                    'survey_type': stage['survey'],
+                    'stage': stage['name'],
+                    'dataset_version': version,
+                    **stats
+                })
+        return stages
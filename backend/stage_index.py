@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+# 2: 由pickle改为gzip压缩的JSON，旧格式的文件读不出来，会重新构建
+STAGE_INDEX_VERSION = 2
+
+def stage_fingerprint(stage):
+    # 注册表中阶段的配置变化后（题目类型、答案来源、选项等）旧的阶段索引作废
+    content = json.dumps(stage, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def source_entry(name, source):
+    return {
+        'name': name,
+        'source_name': source.name,
+        'path': source.path,
+        'offset': source.offset,
+        'size': source.size,
+        'digest': source.digest,
+        'meta': source.meta,
+        'tar': source.archive is not None
+    }
+
+def encode_stage_data(stage_data):
+    # JSON对象的键只能是字符串，answer_map按(题号, 答案)列表保存
+    encoded = dict(stage_data)
+    if 'answer_map' in encoded:
+        encoded['answer_map'] = [[index, answer] for index, answer in encoded['answer_map'].items()]
+    return encoded
+
+def decode_stage_data(encoded):
+    stage_data = dict(encoded)
+    if 'answer_map' in stage_data:
+        stage_data['answer_map'] = {index: answer for index, answer in stage_data['answer_map']}
+    return stage_data
+
+def read_stage_index(path, signature, fingerprint):
+    # 阶段索引只是本机的缓存，读不出来或与数据文件、配置不一致时返回None，调用方重新构建
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, EOFError, ValueError):
+        return None
+    if (not isinstance(snapshot, dict) or snapshot.get('version') != STAGE_INDEX_VERSION
+            or snapshot.get('archive') != signature or snapshot.get('stage') != fingerprint):
+        return None
+    try:
+        snapshot['stage_data'] = decode_stage_data(snapshot['stage_data'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return snapshot
+
+def write_stage_index(path, signature, fingerprint, stage_data, sources, problems):
+    snapshot = {
+        'version': STAGE_INDEX_VERSION,
+        'archive': signature,
+        'stage': fingerprint,
+        'stage_data': encode_stage_data(stage_data),
+        'sources': [source_entry(name, source) for name, source in sources],
+        'problems': problems
+    }
+    index_dir = os.path.dirname(path)
+    os.makedirs(index_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=index_dir)
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
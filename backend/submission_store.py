@@ -0,0 +1,300 @@
+import json
+import os
+import threading
+import time
+
+from group_commit import GroupCommit, ThreadConnections
+
+SUBMISSION_BATCH_SIZE = 256
+COMPLETION_MISS_TTL = 5.0
+COMPLETION_MISS_CACHE_SIZE = 10000
+
+class FileSubmissionStore:
+    def __init__(self, output_folder, dir_name):
+        self.output_folder = output_folder
+        self.dir_name = dir_name
+    
+    def student_dir(self, student_id):
+        return os.path.join(self.output_folder, self.dir_name(student_id))
+    
+    def save(self, student_id, filename, record):
+        path = self.student_dir(student_id)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, filename), 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+    
+    def exists(self, student_id, filename):
+        return os.path.exists(os.path.join(self.student_dir(student_id), filename))
+    
+    def latest_records(self):
+        return iter_output_files(self.output_folder)
+    
+    def _files_since(self, cursor):
+        for dir_name, filename, path in iter_output_paths(self.output_folder):
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            # 用>=：与上次游标同一时刻写入的文件会被重新读取，聚合按学生和文件去重
+            if cursor is None or mtime_ns >= cursor:
+                yield mtime_ns, dir_name, filename, path
+    
+    def count_since(self, cursor):
+        return sum(1 for _ in self._files_since(cursor))
+    
+    def records_since(self, cursor):
+        for mtime_ns, dir_name, filename, path in sorted(self._files_since(cursor)):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield mtime_ns, dir_name, filename, f.read()
+            except OSError:
+                continue
+    
+    def submitted_keys(self):
+        if not os.path.isdir(self.output_folder):
+            return
+        for entry in os.scandir(self.output_folder):
+            if not entry.is_dir():
+                continue
+            for filename in os.listdir(entry.path):
+                if filename.endswith('.json'):
+                    yield entry.name, filename
+    
+    def close(self):
+        pass
+
+class SQLiteSubmissionStore:
+    def __init__(self, db_path, legacy_folder=None):
+        self.db_path = db_path
+        self._closed = False
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect = ThreadConnections(db_path, synchronous='FULL')
+        connection = self._connect()
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS submissions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                survey_type INTEGER,
+                stage TEXT,
+                submitted_at TEXT,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS submissions_student
+                ON submissions (student_id, filename, id);
+            CREATE TABLE IF NOT EXISTS store_meta (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+        connection.commit()
+        if legacy_folder:
+            self._import_legacy(connection, legacy_folder)
+        # 每条提交都要等待落盘后才返回，同时到达的提交合并为一个事务
+        self._writer = GroupCommit(self._connect, self._write, 'submission-writer', max_batch=SUBMISSION_BATCH_SIZE)
+    
+    def _import_legacy(self, connection, legacy_folder):
+        # 多个worker同时启动时只有一个能写入导入标记；已有提交的旧数据库在创建时已经导入过，只补写标记
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            marked = connection.execute(
+                "INSERT OR IGNORE INTO store_meta (name, value) VALUES ('legacy_import', ?)", (legacy_folder,)
+            ).rowcount
+            if marked and connection.execute('SELECT 1 FROM submissions LIMIT 1').fetchone() is None:
+                self._insert_rows(connection, [
+                    (student_id, filename, record)
+                    for student_id, filename, record in iter_output_files(legacy_folder)
+                ])
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+    
+    def _write(self, connection, batch):
+        self._insert_rows(connection, [entry for _, entry in batch])
+    
+    def _insert_rows(self, connection, entries):
+        connection.executemany(
+            'INSERT INTO submissions (student_id, filename, survey_type, stage, submitted_at, payload) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(
+                student_id,
+                filename,
+                record.get('survey_type'),
+                record.get('stage'),
+                record.get('submitted_at'),
+                json.dumps(record, ensure_ascii=False)
+            ) for student_id, filename, record in entries]
+        )
+    
+    def save(self, student_id, filename, record):
+        if self._closed:
+            raise RuntimeError('提交存储已关闭')
+        self._writer.add((student_id, filename, record), wait=True)
+    
+    def exists(self, student_id, filename):
+        row = self._connect().execute(
+            'SELECT 1 FROM submissions WHERE student_id = ? AND filename = ? LIMIT 1',
+            (student_id, filename)
+        ).fetchone()
+        return row is not None
+    
+    def submitted_keys(self):
+        rows = self._connect().execute('SELECT DISTINCT student_id, filename FROM submissions')
+        for student_id, filename in rows:
+            yield student_id, filename
+    
+    def count_since(self, cursor):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM submissions WHERE id > ?', (cursor or 0,)
+        ).fetchone()[0]
+    
+    def records_since(self, cursor):
+        rows = self._connect().execute(
+            'SELECT id, student_id, filename, payload FROM submissions WHERE id > ? ORDER BY id',
+            (cursor or 0,)
+        )
+        for row in rows:
+            yield row
+    
+    def latest_records(self):
+        rows = self._connect().execute(
+            'SELECT student_id, filename, payload FROM submissions '
+            'WHERE id IN (SELECT MAX(id) FROM submissions GROUP BY student_id, filename) '
+            'ORDER BY id'
+        )
+        for student_id, filename, payload in rows:
+            yield student_id, filename, json.loads(payload)
+    
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.close()
+
+class RedisSubmissionStore:
+    # 提交保存在Redis（或兼容Redis协议的服务）中，供多台机器上的worker共享：
+    # 列表按提交顺序保存全部记录（位置即游标），哈希表保存每个学生每个文件的最新一份
+    def __init__(self, client, prefix='survey'):
+        self.client = client
+        self.log_key = f'{prefix}:submissions'
+        self.latest_key = f'{prefix}:latest'
+        self.completed_prefix = f'{prefix}:completed:'
+    
+    def save(self, student_id, filename, record):
+        payload = json.dumps(record, ensure_ascii=False)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(self.log_key, json.dumps([student_id, filename, payload], ensure_ascii=False))
+        pipe.hset(self.latest_key, json.dumps([student_id, filename], ensure_ascii=False), payload)
+        pipe.sadd(self.completed_prefix + student_id, filename)
+        pipe.execute()
+    
+    def exists(self, student_id, filename):
+        return bool(self.client.sismember(self.completed_prefix + student_id, filename))
+    
+    def submitted_keys(self):
+        for field in self.client.hscan_iter(self.latest_key, count=1000):
+            student_id, filename = json.loads(field[0])
+            yield student_id, filename
+    
+    def count_since(self, cursor):
+        return max(self.client.llen(self.log_key) - (cursor or 0), 0)
+    
+    def records_since(self, cursor):
+        position = cursor or 0
+        while True:
+            entries = self.client.lrange(self.log_key, position, position + SUBMISSION_BATCH_SIZE - 1)
+            for entry in entries:
+                position += 1
+                student_id, filename, payload = json.loads(entry)
+                yield position, student_id, filename, payload
+            if len(entries) < SUBMISSION_BATCH_SIZE:
+                break
+    
+    def latest_records(self):
+        records = []
+        for field, payload in self.client.hscan_iter(self.latest_key, count=1000):
+            student_id, filename = json.loads(field)
+            records.append((student_id, filename, json.loads(payload)))
+        records.sort(key=lambda entry: str(entry[2].get('submitted_at') or ''))
+        return iter(records)
+    
+    def close(self):
+        pass
+
+class CompletionIndex:
+    # 已完成的问卷不会变回未完成，所以“已完成”一直缓存在内存中；
+    # 给了store时，缓存中没有的每个学生最多每miss_ttl秒向共享存储确认一次，其他worker收到的提交在这段时间内可见
+    def __init__(self, completion_files, key, store=None, miss_ttl=COMPLETION_MISS_TTL):
+        self.completion_files = completion_files
+        self.key = key
+        self.store = store
+        self.miss_ttl = miss_ttl
+        self._completed = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+    
+    def load(self, submitted_keys):
+        completed = {}
+        for student_id, filename in submitted_keys:
+            completed.setdefault(self.key(student_id), set()).add(filename)
+        with self._lock:
+            self._completed = completed
+    
+    def mark(self, student_id, filename):
+        with self._lock:
+            self._completed.setdefault(self.key(student_id), set()).add(filename)
+    
+    def _should_check(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked.get(key, float('-inf')) < self.miss_ttl:
+                return False
+            if len(self._checked) >= COMPLETION_MISS_CACHE_SIZE:
+                self._checked = {
+                    name: checked for name, checked in self._checked.items() if now - checked < self.miss_ttl
+                }
+            self._checked[key] = now
+            return True
+    
+    def status(self, student_id):
+        key = self.key(student_id)
+        filenames = self._completed.get(key, ())
+        missing = [filename for filename in self.completion_files.values() if filename not in filenames]
+        if missing and self.store is not None and self._should_check(key):
+            for filename in missing:
+                if self.store.exists(student_id, filename):
+                    self.mark(student_id, filename)
+            filenames = self._completed.get(key, ())
+        return {survey_key: filename in filenames for survey_key, filename in self.completion_files.items()}
+
+def iter_output_paths(output_folder):
+    if not os.path.isdir(output_folder):
+        return
+    for dir_name in sorted(os.listdir(output_folder)):
+        dir_path = os.path.join(output_folder, dir_name)
+        if not os.path.isdir(dir_path):
+            continue
+        for filename in sorted(os.listdir(dir_path)):
+            if filename.endswith('.json'):
+                yield dir_name, filename, os.path.join(dir_path, filename)
+
+def iter_output_files(output_folder):
+    for dir_name, filename, path in iter_output_paths(output_folder):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not isinstance(record, dict):
+            continue
+        student_id = str(record.get('student_id') or dir_name).strip()
+        yield student_id, filename, record
+
+def export_submissions(store, output_folder, dir_name):
+    exporter = FileSubmissionStore(output_folder, dir_name)
+    count = 0
+    for student_id, filename, record in store.latest_records():
+        exporter.save(student_id, filename, record)
+        count += 1
+    return count
@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+import random
+
+from audio_store import clip_fields
+
+REGISTRY_FILE = os.environ.get('SURVEY_REGISTRY') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'surveys.json')
+# 按学生分配题目：每人per_rater题，优先分给票数不足target_votes或意见分歧（一致程度低于consensus）的题目
+ASSIGNMENT_DEFAULTS = {'per_rater': 20, 'target_votes': 3, 'max_votes': 7, 'consensus': 0.8}
+
+def normalize_option(value):
+    return str(value or '').strip()
+
+def normalize_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        value = value.strip().lower()
+        return value in ['true', '1', 'yes', '是']
+    if isinstance(value, (int, float)):
+        return value != 0
+    return False
+
+def answer_file_lookup(stage, tag_data):
+    raw_answer = tag_data.get(stage['answer_key'].get('member', 'answer'))
+    answer_list = []
+    if isinstance(raw_answer, dict) and 'sample_pool' in raw_answer:
+        answer_list = raw_answer.get('sample_pool', [])
+    elif isinstance(raw_answer, list):
+        answer_list = raw_answer
+    lookup = {}
+    for entry in answer_list:
+        audio_name = entry.get('audio')
+        if not audio_name:
+            continue
+        lookup[audio_name] = bool(entry.get('answer', False))
+    return lambda audio_name: lookup.get(audio_name, False)
+
+def sample_selected_lookup(stage, tag_data):
+    def lookup(audio_name):
+        base_data = tag_data.get(os.path.splitext(audio_name)[0])
+        selected = base_data.get('sample_selected', '') if isinstance(base_data, dict) else ''
+        return selected if isinstance(selected, str) else ''
+    return lookup
+
+ANSWER_SOURCES = {
+    'answer_file': answer_file_lookup,
+    'sample_selected': sample_selected_lookup
+}
+
+def tag_pool(stage, tag_data, audio_name):
+    limit = stage.get('tag_limit', 4)
+    base_data = tag_data.get(os.path.splitext(audio_name)[0])
+    if isinstance(base_data, dict):
+        pool = base_data.get('sample_pool', [])
+        return pool[:limit] if isinstance(pool, list) else []
+    if isinstance(base_data, list):
+        return base_data[:limit]
+    if isinstance(base_data, str):
+        return [base_data]
+    return []
+
+def build_clip_items(stage, audio_files, tag_data, register, with_tags=False):
+    answer_key = stage.get('answer_key')
+    answer_of = ANSWER_SOURCES[answer_key['source']](stage, tag_data) if answer_key else None
+    
+    audio_files.sort(key=lambda x: x['name'])
+    items = []
+    answer_map = {}
+    for idx, audio_info in enumerate(audio_files):
+        audio_name = audio_info['name']
+        item = {'index': idx, 'audio': register(audio_info)}
+        if with_tags:
+            item['tags'] = tag_pool(stage, tag_data, audio_name)
+        item.update(clip_fields(audio_info['source']))
+        items.append(item)
+        if answer_of is not None:
+            answer_map[idx] = answer_of(audio_name)
+    
+    stage_data = {'items': items}
+    if answer_of is not None:
+        stage_data['answer_map'] = answer_map
+    return stage_data
+
+def build_single_clip(stage, audio_files, tag_data, register):
+    return build_clip_items(stage, audio_files, tag_data, register)
+
+def build_tag_pool(stage, audio_files, tag_data, register):
+    return build_clip_items(stage, audio_files, tag_data, register, with_tags=True)
+
+def build_paired_options(stage, audio_files, tag_data, register):
+    option_ids = [option['id'] for option in stage['options']]
+    pairs = {}
+    for audio_info in audio_files:
+        audio_name = audio_info['name']
+        lower_name = audio_name.lower()
+        for option in stage['options']:
+            if lower_name.startswith(option['prefix']):
+                break
+        else:
+            continue
+        
+        pair_key = lower_name.replace(option['prefix'], '').split('.')[0]
+        if not pair_key:
+            continue
+        
+        audio_url = register(audio_info)
+        
+        pair_entry = pairs.setdefault(pair_key, dict.fromkeys(option_ids))
+        pair_entry[option['id']] = {
+            'audio': audio_url,
+            'filename': audio_name,
+            **clip_fields(audio_info['source'])
+        }
+    
+    items = []
+    for pair_key in sorted(pairs.keys(), key=lambda x: int(x) if str(x).isdigit() else x):
+        data = pairs[pair_key]
+        if not all(data.values()):
+            continue
+        items.append({
+            'index': len(items),
+            'pair_key': pair_key,
+            'options': [{'id': option_id, **data[option_id]} for option_id in option_ids]
+        })
+    
+    return {'items': items}
+
+def item_clips(item):
+    # 题目中的每段音频：单段音频的题目是题目本身，成对比较的题目是每个选项
+    return item['options'] if 'options' in item else [item]
+
+def map_item_clips(item, resolve):
+    if 'options' in item:
+        return {**item, 'options': [{**option, **resolve(option)} for option in item['options']]}
+    return {**item, **resolve(item)}
+
+def option_order(stage, student_id, item):
+    order = [option['id'] for option in stage['options']]
+    if stage.get('option_order') == 'per_student':
+        seed = hashlib.sha256(f"{student_id}:{item.get('pair_key')}".encode('utf-8')).digest()
+        random.Random(seed).shuffle(order)
+    return order
+
+def valid_answers(answers, items):
+    # 每个答案的index必须是题目列表范围内的整数
+    if not isinstance(answers, list):
+        return False
+    for answer in answers:
+        if not isinstance(answer, dict):
+            return False
+        index = answer.get('index')
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < items:
+            return False
+    return True
+
+def valid_checkpoint_answers(answers, items):
+    # 进度中的答案以题号字符串为键（JSON对象的键），题号与提交时一样必须在题目列表范围内
+    if not isinstance(answers, dict) or len(answers) > items:
+        return False
+    for key in answers:
+        if not (key.isascii() and key.isdigit()) or str(int(key)) != key or int(key) >= items:
+            return False
+    return True
+
+def record_clip_answers(stage, stage_data, student_id, answers):
+    return [{
+        'item_index': answer.get('index'),
+        'answer': answer.get('answer')
+    } for answer in answers]
+
+def record_paired_answers(stage, stage_data, student_id, answers):
+    item_map = {item['index']: item for item in stage_data['items']}
+    output_answers = []
+    for answer in answers:
+        idx = answer.get('index')
+        selection = normalize_option(answer.get('answer'))
+        item_data = item_map.get(idx)
+        pair_key = item_data.get('pair_key') if item_data else ''
+        selected_audio = ''
+        if item_data:
+            for option in item_data.get('options', []):
+                if normalize_option(option.get('id')) == selection:
+                    selected_audio = option.get('filename') or option.get('audio', '')
+                    break
+        order = option_order(stage, student_id, item_data) if item_data else []
+        output_answers.append({
+            'item_index': idx,
+            'pair_key': pair_key,
+            'selected_option': selection,
+            'selected_audio': selected_audio,
+            'option_order': order,
+            'selected_position': order.index(selection) if selection in order else None
+        })
+    return output_answers
+
+# 题目构建方式：名称 -> (构建题目, 整理提交的答案)
+ITEM_TYPES = {
+    'single_clip': (build_single_clip, record_clip_answers),
+    'tag_pool': (build_tag_pool, record_clip_answers),
+    'paired_options': (build_paired_options, record_paired_answers)
+}
+
+def grade_boolean(answer, expected):
+    return normalize_boolean(answer) == bool(expected)
+
+def grade_option(answer, expected):
+    user_answer = normalize_option(answer)
+    return bool(user_answer) and user_answer == normalize_option(expected)
+
+GRADERS = {
+    'boolean': grade_boolean,
+    'option': grade_option
+}
+ANSWER_TYPES = ('boolean', 'label', 'paired')
+
+def grade_answers(stage, stage_data, answers):
+    grade = GRADERS[stage['grading']['rule']]
+    answer_map = stage_data['answer_map']
+    total = len(answer_map)
+    correct_count = 0
+    
+    for answer in answers:
+        idx = answer.get('index')
+        if idx is None or idx not in answer_map:
+            continue
+        if grade(answer.get('answer'), answer_map[idx]):
+            correct_count += 1
+    
+    accuracy = correct_count / total if total else 0
+    return {
+        'total_items': total,
+        'correct_count': correct_count,
+        'accuracy': accuracy,
+        'passed': accuracy >= stage['grading'].get('pass_rate', 0.6)
+    }
+
+def build_stage_items(stage, audio_files, tag_data, register):
+    return ITEM_TYPES[stage['items']][0](stage, audio_files, tag_data, register)
+
+def record_answers(stage, stage_data, student_id, answers):
+    return ITEM_TYPES[stage['items']][1](stage, stage_data, student_id, answers)
+
+def check_stage(survey_id, stage_name, stage):
+    where = f'问卷{survey_id}的{stage_name}阶段'
+    if not stage.get('archive') or not stage.get('output_file'):
+        raise ValueError(f'{where}缺少archive或output_file')
+    if stage.get('items') not in ITEM_TYPES:
+        raise ValueError(f"{where}的题目类型未知: {stage.get('items')}")
+    answer_key = stage.get('answer_key')
+    if answer_key and answer_key.get('source') not in ANSWER_SOURCES:
+        raise ValueError(f"{where}的答案来源未知: {answer_key.get('source')}")
+    grading = stage.get('grading')
+    if grading and (grading.get('rule') not in GRADERS or not answer_key):
+        raise ValueError(f'{where}的评分规则未知或缺少answer_key')
+    if stage['items'] == 'paired_options' and len(stage.get('options') or []) < 2:
+        raise ValueError(f'{where}至少需要两个options')
+    if stage.get('answer_type', 'label') not in ANSWER_TYPES:
+        raise ValueError(f"{where}的答案类型未知: {stage.get('answer_type')}")
+    assignment = stage.get('assignment')
+    if assignment is not None:
+        if not isinstance(assignment, dict) or any(key not in ASSIGNMENT_DEFAULTS for key in assignment):
+            raise ValueError(f'{where}的assignment配置错误')
+        if grading:
+            raise ValueError(f'{where}按学生分配题目时不能配置grading')
+
+def load_registry(path=REGISTRY_FILE):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    
+    surveys = {}
+    for survey_key, survey in config.items():
+        survey_id = int(survey_key)
+        stages = {}
+        for stage_name, stage in survey.get('stages', {}).items():
+            check_stage(survey_id, stage_name, stage)
+            stages[stage_name] = {
+                **stage,
+                'survey': survey_id,
+                'stage': stage_name,
+                'key': f'survey{survey_id}_{stage_name}',
+                'name': stage.get('name') or os.path.splitext(stage['archive'])[0],
+                'data_dir': stage.get('data_dir', survey.get('data_dir', ''))
+            }
+            if stage.get('assignment') is not None:
+                stages[stage_name]['assignment'] = {**ASSIGNMENT_DEFAULTS, **stage['assignment']}
+            if stage['items'] == 'paired_options':
+                stages[stage_name]['answer_type'] = 'paired'
+                stages[stage_name].setdefault('preferred_option', stage['options'][-1]['id'])
+            else:
+                stages[stage_name].setdefault('answer_type', 'label')
+        if not stages:
+            raise ValueError(f'问卷{survey_id}没有配置任何阶段')
+        default_stage = survey.get('default_stage') or list(stages)[-1]
+        completion_stage = survey.get('completion_stage') or default_stage
+        if default_stage not in stages or completion_stage not in stages:
+            raise ValueError(f'问卷{survey_id}的default_stage或completion_stage不存在')
+        surveys[survey_id] = {
+            **survey,
+            'id': survey_id,
+            'stages': stages,
+            'default_stage': default_stage,
+            'completion_stage': completion_stage
+        }
+    return surveys
+
+def resolve_stage(surveys, survey_type, stage_name=None):
+    survey = surveys.get(survey_type)
+    if survey is None:
+        return None
+    return survey['stages'].get(stage_name) or survey['stages'][survey['default_stage']]
+
+def iter_stages(surveys, survey_type=None):
+    for survey_id, survey in surveys.items():
+        if survey_type is None or survey_id == survey_type:
+            yield from survey['stages'].values()
+
+def completion_files(surveys):
+    return {
+        f'survey{survey_id}': survey['stages'][survey['completion_stage']]['output_file']
+        for survey_id, survey in surveys.items()
+    }
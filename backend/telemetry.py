@@ -0,0 +1,169 @@
+import ipaddress
+import json
+import math
+import os
+import zlib
+from collections import defaultdict
+from urllib.parse import unquote, urlsplit
+
+from group_commit import GroupCommit, ThreadConnections
+
+TELEMETRY_FLUSH_INTERVAL = 2.0
+EVENT_KINDS = ('ready', 'stall', 'error')
+MAX_BEACON_BYTES = 64 * 1024
+MAX_DECODED_BYTES = 1024 * 1024
+MAX_BEACON_EVENTS = 500
+MAX_EVENT_MS = 10 * 60 * 1000
+PERCENTILES = (50, 90, 99)
+GROUPS = ('clip', 'network')
+
+class BeaconError(ValueError):
+    pass
+
+def decode_beacon(body):
+    # sendBeacon只能用CORS安全的text/plain发送，压缩与否按gzip头判断；解压后的大小有上限
+    if len(body) > MAX_BEACON_BYTES:
+        raise BeaconError('too large')
+    if body[:2] == b'\x1f\x8b':
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            body = decompressor.decompress(body, MAX_DECODED_BYTES)
+        except zlib.error:
+            raise BeaconError('bad gzip')
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise BeaconError('bad gzip')
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise BeaconError('bad json')
+    if not isinstance(payload, dict) or not isinstance(payload.get('events'), list):
+        raise BeaconError('bad payload')
+    return payload
+
+def client_network(address):
+    # 同一教室通常共用一个出口网段：IPv4按/24、IPv6按/64归组
+    try:
+        ip = ipaddress.ip_address(address or '')
+    except ValueError:
+        return ''
+    prefix = 24 if ip.version == 4 else 64
+    return str(ipaddress.ip_network(f'{ip}/{prefix}', strict=False))
+
+def clip_name(value):
+    return unquote(urlsplit(str(value or '')).path.rsplit('/', 1)[-1])
+
+def event_rows(payload, stages, network, received_at):
+    # stages: 已知的(问卷, 阶段)；格式不对或不认识的事件直接丢弃
+    student_id = str(payload.get('student_id') or '').strip()[:64]
+    rows = []
+    for event in payload['events'][:MAX_BEACON_EVENTS]:
+        if not isinstance(event, dict) or event.get('kind') not in EVENT_KINDS:
+            continue
+        survey_type = event.get('survey')
+        stage = event.get('stage')
+        clip = clip_name(event.get('clip'))
+        if (survey_type, stage) not in stages or not clip:
+            continue
+        ms = event.get('ms')
+        if event['kind'] != 'error':
+            if not isinstance(ms, (int, float)) or isinstance(ms, bool) or not 0 <= ms <= MAX_EVENT_MS:
+                continue
+            ms = float(ms)
+        else:
+            ms = None
+        code = event.get('code')
+        rows.append((
+            received_at, survey_type, stage, str(event.get('version') or '')[:64], clip[:255],
+            network, student_id, event['kind'], ms,
+            code if isinstance(code, int) and not isinstance(code, bool) else None,
+            1 if event.get('prefetched') else 0
+        ))
+    return rows
+
+def percentile(values, q):
+    # values已排序；最近秩法
+    if not values:
+        return None
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+def summarize_values(values):
+    values = sorted(values)
+    return {f'p{q}': percentile(values, q) for q in PERCENTILES}
+
+class TelemetryStore:
+    # 播放事件只用于统计，可以丢失：接收时只追加到内存，后台线程定期批量写入SQLite
+    def __init__(self, db_path, flush_interval=TELEMETRY_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect = ThreadConnections(db_path, synchronous='NORMAL')
+        connection = self._connect()
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS playback_events (
+                received_at REAL NOT NULL,
+                survey_type INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                dataset_version TEXT NOT NULL,
+                clip TEXT NOT NULL,
+                network TEXT NOT NULL,
+                student_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                ms REAL,
+                code INTEGER,
+                prefetched INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS playback_events_received
+                ON playback_events (received_at);
+        ''')
+        connection.commit()
+        self._writer = GroupCommit(self._connect, self._write, 'telemetry-flusher', interval=flush_interval)
+    
+    def _write(self, connection, batch):
+        connection.executemany('INSERT INTO playback_events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [row for _, row in batch])
+    
+    def append(self, rows):
+        self._writer.add_all(rows)
+    
+    def flush(self):
+        self._writer.flush()
+    
+    def summary(self, group='clip', survey_type=None, since=0, limit=50):
+        # 按(问卷, 阶段, 音频或网段)汇总：音频可播放耗时和卡顿时长的分位数、卡顿次数、加载失败率，
+        # 按可播放耗时p90从慢到快排列
+        self.flush()
+        if group not in GROUPS:
+            raise ValueError(group)
+        query = f'SELECT survey_type, stage, {group}, kind, ms, prefetched FROM playback_events WHERE received_at >= ?'
+        params = [since]
+        if survey_type is not None:
+            query += ' AND survey_type = ?'
+            params.append(survey_type)
+        groups = defaultdict(lambda: {'ready': [], 'stall': [], 'errors': 0, 'prefetched': 0})
+        for survey, stage, key, kind, ms, prefetched in self._connect().execute(query, params):
+            entry = groups[(survey, stage, key)]
+            if kind == 'error':
+                entry['errors'] += 1
+                continue
+            entry[kind].append(ms)
+            if kind == 'ready' and prefetched:
+                entry['prefetched'] += 1
+        rows = []
+        for (survey, stage, key), entry in groups.items():
+            loads = len(entry['ready'])
+            rows.append({
+                'survey_type': survey,
+                'stage': stage,
+                group: key,
+                'loads': loads,
+                'prefetched': entry['prefetched'],
+                'ready_ms': summarize_values(entry['ready']),
+                'stalls': len(entry['stall']),
+                'stall_ms': summarize_values(entry['stall']),
+                'errors': entry['errors'],
+                'error_rate': round(entry['errors'] / max(loads + entry['errors'], 1), 4)
+            })
+        rows.sort(key=lambda row: (row['ready_ms']['p90'] is None, -(row['ready_ms']['p90'] or 0), -row['errors']))
+        return rows[:limit]
+    
+    def close(self):
+        self._writer.close()
@@ -0,0 +1,69 @@
+import io
+import json
+import os
+import struct
+import sys
+import tarfile
+import wave
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+def wav_bytes(frames=800, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b''.join(struct.pack('<h', (i * 37) % 2000 - 1000) for i in range(frames)))
+    return buffer.getvalue()
+
+def add_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 1700000000
+    archive.addfile(info, io.BytesIO(data))
+
+def write_survey1(data_folder):
+    # 问卷1：5道引导题（带答案）和3道正式题
+    folder = os.path.join(data_folder, 'data1')
+    os.makedirs(folder)
+    with tarfile.open(os.path.join(folder, 'guide5.tar'), 'w') as archive:
+        answers = []
+        for i in range(5):
+            add_member(archive, f'guide5/g{i}.wav', wav_bytes(800 + i))
+            answers.append({'audio': f'g{i}.wav', 'answer': i % 2 == 0})
+        add_member(archive, 'guide5/answer.json', json.dumps(answers).encode())
+    with tarfile.open(os.path.join(folder, 'test20.tar'), 'w') as archive:
+        for i in range(3):
+            add_member(archive, f'test20/t{i}.wav', wav_bytes(900 + i))
+
+def write_survey3(data_folder):
+    # 问卷3：2对原始/超分辨率音频
+    folder = os.path.join(data_folder, 'data3')
+    os.makedirs(folder)
+    with tarfile.open(os.path.join(folder, 'test25.tar'), 'w') as archive:
+        for i in range(2):
+            add_member(archive, f'raw_sample_{i}.wav', wav_bytes(1000 + i))
+            add_member(archive, f'superres_sample_{i}.wav', wav_bytes(1100 + i))
+
+@pytest.fixture(scope='session')
+def survey_app(tmp_path_factory):
+    root = tmp_path_factory.mktemp('survey')
+    write_survey1(str(root / 'data'))
+    write_survey3(str(root / 'data'))
+    os.environ.update({
+        'SURVEY_DATA_FOLDER': str(root / 'data'),
+        'SURVEY_OUTPUT_FOLDER': str(root / 'output'),
+        'SURVEY_UPLOAD_FOLDER': str(root / 'uploads'),
+        'ADMISSION_TOTAL': '0'
+    })
+    import app
+    yield app
+    app.close_stores()
+
+@pytest.fixture
+def client(survey_app):
+    return survey_app.app.test_client()
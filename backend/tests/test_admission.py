@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+def lane(priority=0, limit=2, queue=2, wait=5, per_client=2):
+    return {'priority': priority, 'limit': limit, 'queue': queue, 'wait': wait, 'per_client': per_client}
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+def assert_idle(controller):
+    assert controller.active == 0
+    assert controller._waiters == []
+    for state in controller.lanes.values():
+        assert (state.active, state.waiting, state.clients, state.queued_clients) == (0, 0, {}, {})
+
+def test_grants_until_lane_limit_then_queues():
+    controller = AdmissionController(4, {'items': lane(limit=2, queue=0)})
+    first = controller.acquire('items', 'a')
+    second = controller.acquire('items', 'b')
+    assert controller.active == 2
+    assert controller.lanes['items'].clients == {'a': 1, 'b': 1}
+    with pytest.raises(Overloaded) as error:
+        controller.acquire('items', 'c')
+    assert error.value.lane == 'items'
+    assert error.value.retry_after >= 1
+    controller.release(first)
+    controller.release(second)
+    assert_idle(controller)
+
+def test_per_client_limit():
+    controller = AdmissionController(4, {'audio': lane(limit=4, queue=4, per_client=1)})
+    ticket = controller.acquire('audio', 'a')
+    other = controller.acquire('audio', 'b')
+    assert controller.lanes['audio'].clients == {'a': 1, 'b': 1}
+    # 同一客户端已占用名额时只能排队一个请求，第二个直接拒绝
+    queued = threading.Thread(target=lambda: controller.release(controller.acquire('audio', 'a')))
+    queued.start()
+    wait_until(lambda: controller.lanes['audio'].waiting)
+    with pytest.raises(Overloaded):
+        controller.acquire('audio', 'a')
+    controller.release(ticket)
+    queued.join()
+    controller.release(other)
+    assert_idle(controller)
+
+def test_release_is_idempotent():
+    controller = AdmissionController(1, {'submit': lane()})
+    ticket = controller.acquire('submit', 'a')
+    controller.release(ticket)
+    controller.release(ticket)
+    assert_idle(controller)
+    assert controller.acquire('submit', 'a').granted
+
+def test_wait_timeout_withdraws_from_queue():
+    controller = AdmissionController(1, {'items': lane(wait=0.05)})
+    ticket = controller.acquire('items', 'a')
+    with pytest.raises(Overloaded):
+        controller.acquire('items', 'b')
+    assert controller.lanes['items'].waiting == 0
+    assert controller.lanes['items'].queued_clients == {}
+    controller.release(ticket)
+    assert_idle(controller)
+
+def test_freed_slot_goes_to_higher_priority_lane():
+    controller = AdmissionController(1, {'submit': lane(priority=0), 'audio': lane(priority=2)})
+    holder = controller.acquire('audio', 'x')
+    order = []
+    
+    def wait_for(name, client):
+        ticket = controller.acquire(name, client)
+        order.append(name)
+        controller.release(ticket)
+    
+    audio = threading.Thread(target=wait_for, args=('audio', 'a'))
+    audio.start()
+    wait_until(lambda: controller.lanes['audio'].waiting)
+    submit = threading.Thread(target=wait_for, args=('submit', 'b'))
+    submit.start()
+    wait_until(lambda: controller.lanes['submit'].waiting)
+    controller.release(holder)
+    audio.join()
+    submit.join()
+    assert order == ['submit', 'audio']
+    assert_idle(controller)
+
+def test_cancelled_async_waiter_leaves_queue():
+    controller = AdmissionController(1, {'audio': lane()})
+    
+    async def scenario():
+        holder = await controller.acquire_async('audio', 'a')
+        waiter = asyncio.ensure_future(controller.acquire_async('audio', 'b'))
+        await asyncio.sleep(0)
+        assert controller.lanes['audio'].waiting == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.lanes['audio'].waiting == 0
+        controller.release(holder)
+    
+    asyncio.run(scenario())
+    assert_idle(controller)
+
+def test_cancelled_async_waiter_returns_granted_slot():
+    controller = AdmissionController(1, {'audio': lane()})
+    
+    async def scenario():
+        holder = await controller.acquire_async('audio', 'a')
+        waiter = asyncio.ensure_future(controller.acquire_async('audio', 'b'))
+        await asyncio.sleep(0)
+        # 客户端断开的同时名额空出来分给了它：取消时要把名额还回去
+        waiter.cancel()
+        controller.release(holder)
+        assert controller.lanes['audio'].clients == {'b': 1}
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+    
+    asyncio.run(scenario())
+    assert_idle(controller)
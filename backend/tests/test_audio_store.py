@@ -0,0 +1,98 @@
+from audio_store import AudioSource, plan_audio_response
+
+SIZE = 1000
+DIGEST = 'a' * 64
+
+def make_source(tmp_path=None, data=None, offset=0):
+    path = ''
+    if tmp_path is not None:
+        path = str(tmp_path / 'archive.bin')
+        with open(path, 'wb') as f:
+            f.write(b'x' * offset + data)
+    return AudioSource(path, offset, SIZE if data is None else len(data), 'clip.wav', DIGEST)
+
+def test_full_response():
+    status, headers, start, length = plan_audio_response(make_source(), {})
+    assert (status, start, length) == (200, 0, SIZE)
+    assert headers['ETag'] == f'"{DIGEST}"'
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert headers['Content-Type'] == 'audio/x-wav'
+
+def test_not_modified():
+    status, headers, start, length = plan_audio_response(make_source(), {'If-None-Match': f'W/"{DIGEST}"'})
+    assert status == 304
+    assert length is None
+    assert 'Content-Type' not in headers
+
+def test_other_etag_is_full_response():
+    status, _, _, length = plan_audio_response(make_source(), {'If-None-Match': '"other"'})
+    assert (status, length) == (200, SIZE)
+
+def test_byte_range():
+    status, headers, start, length = plan_audio_response(make_source(), {'Range': 'bytes=100-199'})
+    assert (status, start, length) == (206, 100, 100)
+    assert headers['Content-Range'] == f'bytes 100-199/{SIZE}'
+
+def test_open_ended_range():
+    status, headers, start, length = plan_audio_response(make_source(), {'Range': 'bytes=900-'})
+    assert (status, start, length) == (206, 900, 100)
+    assert headers['Content-Range'] == f'bytes 900-999/{SIZE}'
+
+def test_range_past_end_is_clamped():
+    status, headers, start, length = plan_audio_response(make_source(), {'Range': 'bytes=990-5000'})
+    assert (status, start, length) == (206, 990, 10)
+    assert headers['Content-Range'] == f'bytes 990-999/{SIZE}'
+
+def test_suffix_range():
+    status, headers, start, length = plan_audio_response(make_source(), {'Range': 'bytes=-100'})
+    assert (status, start, length) == (206, 900, 100)
+    assert headers['Content-Range'] == f'bytes 900-999/{SIZE}'
+
+def test_suffix_range_longer_than_file():
+    status, headers, start, length = plan_audio_response(make_source(), {'Range': 'bytes=-5000'})
+    assert (status, start, length) == (206, 0, SIZE)
+    assert headers['Content-Range'] == f'bytes 0-999/{SIZE}'
+
+def test_unsatisfiable_range():
+    status, headers, start, length = plan_audio_response(make_source(), {'Range': f'bytes={SIZE}-'})
+    assert status == 416
+    assert length is None
+    assert headers['Content-Range'] == f'bytes */{SIZE}'
+
+def test_malformed_range_is_full_response():
+    status, headers, _, length = plan_audio_response(make_source(), {'Range': 'bytes=abc'})
+    assert (status, length) == (200, SIZE)
+    assert 'Content-Range' not in headers
+
+def test_multiple_ranges_are_full_response():
+    status, _, _, length = plan_audio_response(make_source(), {'Range': 'bytes=0-9,20-29'})
+    assert (status, length) == (200, SIZE)
+
+def test_if_range_matching_etag():
+    headers = {'Range': 'bytes=0-9', 'If-Range': f'"{DIGEST}"'}
+    status, _, start, length = plan_audio_response(make_source(), headers)
+    assert (status, start, length) == (206, 0, 10)
+
+def test_if_range_stale_etag_is_full_response():
+    headers = {'Range': 'bytes=0-9', 'If-Range': '"other"'}
+    status, response_headers, start, length = plan_audio_response(make_source(), headers)
+    assert (status, start, length) == (200, 0, SIZE)
+    assert 'Content-Range' not in response_headers
+
+def test_if_range_date_is_full_response():
+    # 音频只按ETag校验，日期形式的If-Range一律返回完整内容
+    headers = {'Range': 'bytes=0-9', 'If-Range': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+    status, _, _, length = plan_audio_response(make_source(), headers)
+    assert (status, length) == (200, SIZE)
+
+def test_open_range_reads_member_bytes(tmp_path):
+    data = bytes(range(256))
+    source = make_source(tmp_path, data, offset=512)
+    status, _, start, length = plan_audio_response(source, {'Range': 'bytes=-16'})
+    assert status == 206
+    handle = source.open_range(start, length)
+    try:
+        assert handle.read() == data[-16:]
+        assert handle.read() == b''
+    finally:
+        handle.close()
@@ -0,0 +1,38 @@
+import pytest
+
+from surveys import valid_checkpoint_answers
+
+def test_valid_checkpoint_answers():
+    assert valid_checkpoint_answers({}, 3)
+    assert valid_checkpoint_answers({'0': '是', '2': '否'}, 3)
+    assert not valid_checkpoint_answers({'3': '是'}, 3)
+    assert not valid_checkpoint_answers({'-1': '是'}, 3)
+    assert not valid_checkpoint_answers({'01': '是'}, 3)
+    assert not valid_checkpoint_answers({'²': '是'}, 3)
+    assert not valid_checkpoint_answers({'a': '是'}, 3)
+    assert not valid_checkpoint_answers({str(index): '是' for index in range(4)}, 3)
+    assert not valid_checkpoint_answers(['是'], 3)
+
+def save(client, answers, survey_type=1, stage='test', position=0):
+    return client.patch(f'/api/surveys/{survey_type}/checkpoint', json={
+        'student_id': 'checkpoint',
+        'stage': stage,
+        'position': position,
+        'answers': answers
+    })
+
+def test_checkpoint_round_trip(client):
+    assert save(client, {'0': '是', '2': '否'}, position=2).status_code == 202
+    checkpoints = client.get('/api/surveys/1/checkpoint', query_string={'student_id': 'checkpoint'}).get_json()['checkpoints']
+    assert checkpoints['test']['answers'] == {'0': '是', '2': '否'}
+    assert checkpoints['test']['position'] == 2
+
+@pytest.mark.parametrize('answers', [{'3': '是'}, {'x': '是'}, {str(index): '是' for index in range(1000)}, ['是']])
+def test_checkpoint_rejects_out_of_range_answers(client, answers):
+    response = save(client, answers)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': '答案格式错误'}
+
+def test_checkpoint_unknown_survey(client):
+    assert save(client, {}, survey_type=9).status_code == 404
+    assert client.get('/api/surveys/9/checkpoint', query_string={'student_id': 'checkpoint'}).status_code == 404
@@ -0,0 +1,41 @@
+import tarfile
+
+import pytest
+
+from conftest import add_member, wav_bytes
+
+def test_extract_keeps_members_inside_folder(survey_app, tmp_path):
+    archive_path = tmp_path / 'clips.tar'
+    with tarfile.open(archive_path, 'w') as archive:
+        add_member(archive, 'clips/a.wav', wav_bytes())
+        add_member(archive, 'clips/a.json', b'["dog", "cat"]')
+    audio_files, tag_data = survey_app.extract_tar_file(str(archive_path), str(tmp_path / 'out'))
+    assert [entry['name'] for entry in audio_files] == ['a.wav']
+    assert tag_data == {'a': {'sample_pool': ['dog', 'cat']}}
+
+def test_extract_rejects_paths_outside_folder(survey_app, tmp_path):
+    archive_path = tmp_path / 'evil.tar'
+    with tarfile.open(archive_path, 'w') as archive:
+        add_member(archive, '../escape.wav', wav_bytes())
+    with pytest.raises(Exception, match='解压tar文件失败'):
+        survey_app.extract_tar_file(str(archive_path), str(tmp_path / 'out'))
+    assert not (tmp_path / 'escape.wav').exists()
+
+def test_extract_absolute_path_stays_inside_folder(survey_app, tmp_path):
+    archive_path = tmp_path / 'absolute.tar'
+    with tarfile.open(archive_path, 'w') as archive:
+        add_member(archive, str(tmp_path / 'escape.wav'), wav_bytes())
+    survey_app.extract_tar_file(str(archive_path), str(tmp_path / 'out'))
+    # 开头的/被去掉，文件解压到目标目录之内
+    assert not (tmp_path / 'escape.wav').exists()
+    assert (tmp_path / 'out' / str(tmp_path / 'escape.wav').lstrip('/')).exists()
+
+def test_extract_rejects_links_outside_folder(survey_app, tmp_path):
+    archive_path = tmp_path / 'link.tar'
+    with tarfile.open(archive_path, 'w') as archive:
+        info = tarfile.TarInfo('clips/passwd.wav')
+        info.type = tarfile.SYMTYPE
+        info.linkname = '/etc/passwd'
+        archive.addfile(info)
+    with pytest.raises(Exception, match='解压tar文件失败'):
+        survey_app.extract_tar_file(str(archive_path), str(tmp_path / 'out'))
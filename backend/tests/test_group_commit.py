@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+
+import pytest
+
+import group_commit
+from group_commit import GroupCommit, ThreadConnections
+
+@pytest.fixture
+def connect(tmp_path):
+    connect = ThreadConnections(str(tmp_path / 'store.db'))
+    connect().execute('CREATE TABLE entries (value)')
+    connect().commit()
+    return connect
+
+def insert(connection, batch):
+    connection.executemany('INSERT INTO entries VALUES (?)', [(entry,) for _, entry in batch])
+
+def stored(connect):
+    return sorted(value for value, in connect().execute('SELECT value FROM entries'))
+
+def test_waiting_writers_share_commits(connect):
+    writer = GroupCommit(connect, insert, 'test-writer', max_batch=8)
+    threads = [threading.Thread(target=writer.add, args=(index,), kwargs={'wait': True}) for index in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    assert stored(connect) == list(range(40))
+
+@pytest.mark.parametrize('error', [sqlite3.OperationalError('locked'), TypeError('bad entry')])
+def test_failed_write_reaches_waiter_and_writer_survives(connect, monkeypatch, error):
+    monkeypatch.setattr(group_commit, 'RETRY_DELAY', 0)
+    failures = [error]
+    
+    def write(connection, batch):
+        if failures:
+            insert(connection, batch)
+            raise failures.pop()
+        insert(connection, batch)
+    
+    writer = GroupCommit(connect, write, 'test-writer')
+    with pytest.raises(type(error)):
+        writer.add('lost', wait=True)
+    writer.add('saved', wait=True)
+    assert writer._thread.is_alive()
+    writer.close()
+    assert stored(connect) == ['saved']
+
+def test_periodic_entries_are_combined_and_requeued(connect):
+    failures = [sqlite3.OperationalError('locked')]
+    
+    def write(connection, batch):
+        if failures:
+            raise failures.pop()
+        insert(connection, batch)
+    
+    writer = GroupCommit(connect, write, 'test-writer', interval=60, combine=lambda first, second: first + second)
+    writer.add('a', key='k')
+    writer.add('b', key='k')
+    with pytest.raises(sqlite3.OperationalError):
+        writer.flush()
+    writer.add('c', key='k')
+    assert writer.pending() == [('k', 'abc')]
+    writer.close()
+    assert stored(connect) == ['abc']
@@ -0,0 +1,32 @@
+import pytest
+
+def test_unknown_dataset_version_uses_current_window(client, survey_app):
+    current = client.get('/api/surveys/1/items', query_string={'stage': 'test'}).get_json()['dataset_version']
+    survey_app.item_window_payload.cache_clear()
+    for index in range(20):
+        response = client.get('/api/surveys/1/items', query_string={'stage': 'test', 'cursor': 0, 'dataset_version': f'unknown-{index}'})
+        assert response.status_code == 200
+        assert response.get_json()['dataset_version'] == current
+    # 不认识的版本字符串都落到当前版本的同一个缓存项上
+    assert survey_app.item_window_payload.cache_info().currsize == 1
+
+def test_unknown_dataset_version_uses_current_bundle(client, survey_app):
+    current = client.get('/api/surveys/1/items', query_string={'stage': 'test'}).get_json()['dataset_version']
+    survey_app.stage_bundle_payload.cache_clear()
+    for index in range(20):
+        response = client.get('/api/surveys/1/bundle', query_string={'stage': 'test', 'dataset_version': f'unknown-{index}'})
+        assert response.status_code == 200
+        assert response.get_json()['dataset_version'] == current
+    assert survey_app.stage_bundle_payload.cache_info().currsize == 1
+
+@pytest.mark.parametrize('query', [{}, {'cursor': 0}])
+def test_per_student_order_requires_student_id(client, query):
+    response = client.get('/api/surveys/3/items', query_string=query)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': '学号不能为空'}
+
+def test_per_student_order_is_stable(client):
+    first = client.get('/api/surveys/3/items', query_string={'student_id': 's1'}).get_json()
+    again = client.get('/api/surveys/3/items', query_string={'student_id': 's1'}).get_json()
+    assert len(first['items']) == 2
+    assert first == again
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from scoring import ScoringEngine, fleiss_kappa, wilson_interval
+from surveys import load_registry
+
+def test_fleiss_kappa_reference_example():
+    # Fleiss (1971)中14位评分者、10个对象、5个类别的例子，kappa约为0.210
+    counts = np.array([
+        [0, 0, 0, 0, 14], [0, 2, 6, 4, 2], [0, 0, 3, 5, 6], [0, 3, 9, 2, 0], [2, 2, 8, 1, 1],
+        [7, 7, 0, 0, 0], [3, 2, 6, 3, 0], [2, 5, 3, 2, 2], [6, 5, 2, 1, 0], [0, 2, 2, 3, 7]
+    ])
+    assert fleiss_kappa(counts) == pytest.approx(0.2099, abs=1e-4)
+
+def test_fleiss_kappa_small_matrices():
+    assert fleiss_kappa(np.array([[3, 0], [0, 3], [3, 0]])) == pytest.approx(1.0)
+    assert fleiss_kappa(np.array([[2, 1], [1, 2], [3, 0], [0, 3]])) == pytest.approx(1 / 3)
+    # 所有人都选同一类、或每题不足两人作答时无法计算
+    assert fleiss_kappa(np.array([[2, 0], [2, 0]])) is None
+    assert fleiss_kappa(np.array([[1, 0], [0, 1]])) is None
+
+def test_wilson_interval():
+    rate, low, high = wilson_interval(8, 10)
+    assert (float(rate), float(low), float(high)) == pytest.approx((0.8, 0.4902, 0.9433), abs=1e-4)
+    rate, low, high = wilson_interval([0, 5], [5, 5])
+    assert rate.tolist() == [0.0, 1.0]
+    assert low[0] == pytest.approx(0, abs=1e-12)
+    assert high[1] == pytest.approx(1, abs=1e-12)
+
+def submission(survey_type, stage, student_id, answers, submitted_at='2024-01-01T10:00:00', accuracy=None):
+    return {
+        'survey_type': survey_type,
+        'stage': stage,
+        'student_id': student_id,
+        'submitted_at': submitted_at,
+        'dataset_version': 'v1',
+        'answers': answers,
+        'accuracy': accuracy
+    }
+
+def boolean_answers(values):
+    return [{'item_index': index, 'answer': value} for index, value in enumerate(values)]
+
+@pytest.fixture
+def engine():
+    return ScoringEngine(load_registry(), item_count=lambda stage_key, version: 3)
+
+def stage_report(engine, survey_type):
+    stages = engine.report(survey_type)
+    assert len(stages) == 1
+    return stages[0]
+
+def test_boolean_stage(engine):
+    engine.load([
+        submission(1, 'test20', 'a', boolean_answers(['是', '是', '否'])),
+        submission(1, 'test20', 'b', boolean_answers(['是', '是', '否'])),
+        submission(1, 'test20', 'c', boolean_answers(['否', '是', '是']))
+    ])
+    stage = stage_report(engine, 1)
+    assert (stage['raters'], stage['items'], stage['answers']) == (3, 3, 9)
+    assert stage['categories'] == {'True': 6, 'False': 3}
+    # 每题一致率(1/3 + 1 + 1/3)/3 = 5/9，期望一致率(2/3)^2 + (1/3)^2 = 5/9
+    assert stage['kappa'] == pytest.approx(0.0, abs=1e-4)
+    assert stage['positive_rate'] == pytest.approx(0.6667)
+    scores = {entry['student_id']: entry for entry in stage['rater_scores']}
+    assert scores['a']['agreement'] == pytest.approx(0.6667)
+    assert scores['c']['agreement'] == pytest.approx(0.3333)
+    assert scores['c']['bias'] == pytest.approx(0.0)
+
+def test_out_of_range_indices_are_dropped(engine):
+    answers = boolean_answers(['是', '否', '是']) + [
+        {'item_index': 3, 'answer': '是'},
+        {'item_index': 100000, 'answer': '是'},
+        {'item_index': -1, 'answer': '是'},
+        {'item_index': True, 'answer': '是'},
+        {'item_index': '1', 'answer': '是'}
+    ]
+    assert engine.add(submission(1, 'test20', 'a', answers))
+    stage = stage_report(engine, 1)
+    assert (stage['items'], stage['answers']) == (3, 3)
+    matrix = next(iter(engine.matrices.values()))
+    assert matrix.codes.shape[1] < 100000
+
+def test_unknown_version_uses_item_limit():
+    engine = ScoringEngine(load_registry())
+    assert engine.item_limit('survey1_test', 'missing') > 0
+    assert not engine.add(submission(1, 'test', 'a', boolean_answers(['是'])))
+    assert not engine.add(['not a record'])
+
+def test_older_resubmission_is_ignored(engine):
+    assert engine.add(submission(1, 'test20', 'a', boolean_answers(['是', '是', '是']), '2024-01-01T10:00:00'))
+    assert not engine.add(submission(1, 'test20', 'a', boolean_answers(['否', '否', '否']), '2024-01-01T09:00:00'))
+    assert engine.add(submission(1, 'test20', 'a', boolean_answers(['否', '是']), '2024-01-01T11:00:00'))
+    stage = stage_report(engine, 1)
+    assert stage['raters'] == 1
+    assert stage['categories'] == {'True': 1, 'False': 1}
+
+def test_paired_preference(engine):
+    def paired(option, position):
+        return {'selected_option': option, 'selected_position': position}
+    
+    choices = {
+        'a': [paired('super', 1), paired('super', 0)],
+        'b': [paired('super', 0), paired('raw', 1)],
+        'c': [paired('raw', 0), paired('super', 1)],
+        'd': [paired('super', 1), paired('super', 0)]
+    }
+    engine.load([
+        submission(3, 'test25', student_id, [dict(answer, item_index=index) for index, answer in enumerate(answers)])
+        for student_id, answers in choices.items()
+    ])
+    stage = stage_report(engine, 3)
+    assert stage['kappa'] is None
+    assert stage['preferred_option'] == 'super'
+    rate, low, high = wilson_interval(6, 8)
+    assert stage['preference'] == {'rate': 0.75, 'low': round(float(low), 4), 'high': round(float(high), 4)}
+    assert [(item['item_index'], item['responses'], item['rate']) for item in stage['item_scores']] == [(0, 4, 0.75), (1, 4, 0.75)]
+    scores = {entry['student_id']: entry for entry in stage['rater_scores']}
+    assert scores['a']['position_bias'] == 0.0
+    assert scores['b']['bias'] == pytest.approx(-0.25)
@@ -0,0 +1,44 @@
+import pytest
+
+from surveys import valid_answers
+
+def test_valid_answers():
+    assert valid_answers([], 3)
+    assert valid_answers([{'index': 0}, {'index': 2, 'answer': '是'}], 3)
+    assert not valid_answers([{'index': 3}], 3)
+    assert not valid_answers([{'index': -1}], 3)
+    assert not valid_answers([{'index': True}], 3)
+    assert not valid_answers([{'index': '1'}], 3)
+    assert not valid_answers([{'index': 1.0}], 3)
+    assert not valid_answers([{'answer': '是'}], 3)
+    assert not valid_answers(['是'], 3)
+    assert not valid_answers({'index': 0}, 3)
+
+def submit(client, student_id, answers, stage='test'):
+    return client.post('/api/surveys/1/submit', json={
+        'student_id': student_id,
+        'name': '测试',
+        'email': 'test@example.com',
+        'stage': stage,
+        'answers': answers
+    })
+
+@pytest.mark.parametrize('index', [3, 100000, -1, True, '0', None])
+def test_out_of_range_index_is_rejected(client, survey_app, index):
+    response = submit(client, f'bad-{index!r}', [{'index': 0, 'answer': '是'}, {'index': index, 'answer': '是'}])
+    assert response.status_code == 400
+    assert response.get_json() == {'error': '答案格式错误'}
+    assert not survey_app.get_submission_store().exists(f'bad-{index!r}', 'survey1_test20.json')
+
+def test_valid_submission_is_saved(client, survey_app):
+    response = submit(client, 'good', [{'index': index, 'answer': '是'} for index in range(3)])
+    assert response.status_code == 200
+    assert response.get_json()['success']
+    assert survey_app.get_submission_store().exists('good', 'survey1_test20.json')
+
+def test_graded_stage_checks_indices_before_grading(client):
+    response = submit(client, 'guide-bad', [{'index': 5, 'answer': '是'}], stage='guide')
+    assert response.status_code == 400
+    response = submit(client, 'guide-good', [{'index': index, 'answer': index % 2 == 0} for index in range(5)], stage='guide')
+    assert response.status_code == 200
+    assert response.get_json()['correct_count'] == 5
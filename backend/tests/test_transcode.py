@@ -0,0 +1,62 @@
+import hashlib
+import os
+import sys
+import time
+
+import transcode
+from audio_store import AudioSource
+from transcode import RenditionCache
+
+# 代替ffmpeg的脚本：把stdin写入命令行最后一个参数（输出文件）；hang为真时先写满stderr再一直等待
+FAKE_FFMPEG = f'''#!{sys.executable}
+import sys, time
+data = sys.stdin.buffer.read()
+if {{hang}}:
+    sys.stderr.write('x' * 200000)
+    sys.stderr.flush()
+    time.sleep(60)
+with open(sys.argv[-1], 'wb') as f:
+    f.write(data)
+'''
+
+def fake_ffmpeg(tmp_path, hang=False):
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG.format(hang=hang))
+    path.chmod(0o755)
+    return str(path)
+
+def audio_source(tmp_path, data):
+    path = tmp_path / 'clip.wav'
+    path.write_bytes(data)
+    return AudioSource(str(path), 0, len(data), 'clip.wav', hashlib.sha256(data).hexdigest())
+
+def wait_idle(cache, timeout=10):
+    deadline = time.monotonic() + timeout
+    while cache._pending:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_transcode_writes_rendition(tmp_path):
+    data = os.urandom(300000)
+    source = audio_source(tmp_path, data)
+    cache = RenditionCache(str(tmp_path / 'renditions'), ['opus'], '64k', ffmpeg=fake_ffmpeg(tmp_path))
+    cache.schedule(source)
+    wait_idle(cache)
+    cache.shutdown()
+    [rendition] = cache.renditions(source)
+    with open(rendition.path, 'rb') as f:
+        assert f.read() == data
+    assert rendition.name == 'clip.ogg'
+
+def test_transcode_timeout_kills_ffmpeg(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcode, 'TRANSCODE_TIMEOUT', 0.5)
+    source = audio_source(tmp_path, os.urandom(1000))
+    cache = RenditionCache(str(tmp_path / 'renditions'), ['opus'], '64k', ffmpeg=fake_ffmpeg(tmp_path, hang=True))
+    started = time.monotonic()
+    cache.schedule(source)
+    wait_idle(cache)
+    cache.shutdown()
+    assert time.monotonic() - started < 10
+    assert cache.renditions(source) == []
+    rendition_dir = os.path.dirname(cache.rendition_path(source.digest, 'opus'))
+    assert os.listdir(rendition_dir) == []
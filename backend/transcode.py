@@ -0,0 +1,123 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_store import AudioSource
+
+logger = logging.getLogger(__name__)
+
+RENDITION_FORMATS = {
+    'aac': {
+        'extension': 'm4a',
+        'args': ['-c:a', 'aac', '-movflags', '+faststart', '-f', 'mp4']
+    },
+    'opus': {
+        'extension': 'ogg',
+        'args': ['-c:a', 'libopus', '-f', 'ogg']
+    }
+}
+TRANSCODE_TIMEOUT = 300
+
+class RenditionCache:
+    def __init__(self, cache_dir, formats, bitrate, max_workers=2, ffmpeg=None):
+        self.cache_dir = cache_dir
+        self.formats = [name for name in formats if name in RENDITION_FORMATS]
+        self.bitrate = bitrate
+        self.ffmpeg = ffmpeg or shutil.which('ffmpeg')
+        self.enabled = bool(self.formats and self.ffmpeg)
+        self._ready = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transcode') if self.enabled else None
+        if self.formats and not self.ffmpeg:
+            logger.warning('未找到ffmpeg，音频转码已禁用')
+    
+    def rendition_path(self, digest, format_name):
+        extension = RENDITION_FORMATS[format_name]['extension']
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.{self.bitrate}.{extension}')
+    
+    def _make_source(self, source, format_name, path):
+        extension = RENDITION_FORMATS[format_name]['extension']
+        name = f'{os.path.splitext(source.name)[0]}.{extension}'
+        digest = f'{source.digest}-{format_name}-{self.bitrate}'
+        return AudioSource(path, 0, os.path.getsize(path), name, digest)
+    
+    def schedule(self, source):
+        if not self.enabled:
+            return
+        for format_name in self.formats:
+            key = (source.digest, format_name)
+            with self._lock:
+                if key in self._ready or key in self._pending:
+                    continue
+                path = self.rendition_path(source.digest, format_name)
+                if os.path.exists(path):
+                    self._ready[key] = self._make_source(source, format_name, path)
+                    continue
+                self._pending.add(key)
+            self._executor.submit(self._transcode, source, format_name, path)
+    
+    def _transcode(self, source, format_name, path):
+        key = (source.digest, format_name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+            os.close(fd)
+            command = [
+                self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+                '-i', 'pipe:0', '-vn', '-b:a', self.bitrate
+            ] + RENDITION_FORMATS[format_name]['args'] + [temp_path]
+            try:
+                reader = source.open_range()
+                try:
+                    data = reader.read()
+                finally:
+                    reader.close()
+                # communicate同时写入stdin、读取stderr，ffmpeg写满stderr管道时也不会互相等待
+                process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+                try:
+                    _, stderr = process.communicate(input=data, timeout=TRANSCODE_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                    logger.warning('转码超时 %s -> %s: 超过%s秒', source.name, format_name, TRANSCODE_TIMEOUT)
+                    return
+                if process.returncode != 0 or os.path.getsize(temp_path) == 0:
+                    logger.warning('转码失败 %s -> %s: %s', source.name, format_name, stderr.decode('utf-8', 'replace').strip())
+                    return
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            with self._lock:
+                self._ready[key] = self._make_source(source, format_name, path)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning('转码失败 %s -> %s: %s', source.name, format_name, e)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+    
+    def renditions(self, source):
+        return [
+            self._ready[(source.digest, format_name)]
+            for format_name in self.formats
+            if (source.digest, format_name) in self._ready
+        ]
+    
+    def negotiate(self, source, accept):
+        candidates = self.renditions(source)
+        if not candidates:
+            return source
+        by_mimetype = {}
+        for candidate in candidates + [source]:
+            by_mimetype.setdefault(candidate.mimetype, candidate)
+        best = accept.best_match(list(by_mimetype))
+        return by_mimetype.get(best, source)
+    
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
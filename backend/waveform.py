@@ -0,0 +1,221 @@
+import io
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+
+WAVEFORM_POINTS = 64
+SIDECAR_VERSION = 1
+SILENCE_DBFS = -60.0
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xfffe
+DECODE_TIMEOUT = 60
+UNANALYZED = '未分析（没有安装soundfile或ffmpeg，无法解码）'
+
+def wav_samples(data):
+    # 只解码WAV（PCM整数或浮点），返回 帧数 × 声道数 的float32数组，无法解码时返回None
+    if len(data) < 12 or data[:4] not in (b'RIFF', b'RF64') or data[8:12] != b'WAVE':
+        return None
+    position = 12
+    fmt = None
+    while position + 8 <= len(data):
+        chunk_id = data[position:position + 4]
+        chunk_size = struct.unpack('<I', data[position + 4:position + 8])[0]
+        body = position + 8
+        if chunk_id == b'fmt ' and body + 16 <= len(data):
+            audio_format, channels, _, _, block_align, bits = struct.unpack('<HHIIHH', data[body:body + 16])
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40 and body + 26 <= len(data):
+                audio_format = struct.unpack('<H', data[body + 24:body + 26])[0]
+            fmt = (audio_format, channels, block_align, bits)
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            if chunk_size in (0, 0xffffffff) or body + chunk_size > len(data):
+                chunk_size = len(data) - body
+            return decode_pcm(data[body:body + chunk_size], *fmt)
+        position = body + chunk_size + (chunk_size & 1)
+    return None
+
+def decode_pcm(raw, audio_format, channels, block_align, bits):
+    if not channels or not block_align:
+        return None
+    width = block_align // channels
+    raw = raw[:len(raw) - len(raw) % block_align]
+    if audio_format == WAVE_FORMAT_FLOAT and width in (4, 8):
+        samples = np.frombuffer(raw, dtype='<f4' if width == 4 else '<f8').astype(np.float32)
+    elif audio_format != WAVE_FORMAT_PCM:
+        return None
+    elif width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768
+    elif width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        samples = (np.where(values >= 1 << 23, values - (1 << 24), values)).astype(np.float32) / (1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        return None
+    return samples.reshape(-1, channels)
+
+def soundfile_samples(data):
+    import soundfile
+    try:
+        samples, _ = soundfile.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    except (RuntimeError, ValueError):
+        return None
+    return samples
+
+def ffmpeg_samples(ffmpeg, data):
+    # 解码为浮点WAV后按WAV处理；输出到管道时data块长度未知，wav_samples会取到结尾
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', '-f', 'wav', '-acodec', 'pcm_f32le', 'pipe:1'],
+            input=data, capture_output=True, timeout=DECODE_TIMEOUT
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return wav_samples(result.stdout) if result.returncode == 0 else None
+
+def find_decoder():
+    # WAV直接用NumPy解码；FLAC等格式优先用soundfile，其次用ffmpeg，都没有时不分析
+    try:
+        import soundfile
+    except (ImportError, OSError):
+        pass
+    else:
+        return soundfile_samples
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        return lambda data: ffmpeg_samples(ffmpeg, data)
+    return None
+
+def analyze_samples(samples, points=WAVEFORM_POINTS):
+    if samples is None or not samples.size:
+        return None
+    magnitude = np.abs(samples).max(axis=1)
+    rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+    frames = len(magnitude)
+    if frames >= points:
+        edges = np.linspace(0, frames, points + 1).astype(np.int64)[:-1]
+        peaks = np.maximum.reduceat(magnitude, edges)
+    else:
+        peaks = np.pad(magnitude, (0, points - frames))
+    return {
+        'loudness': round(float(20 * np.log10(rms)), 1) if rms > 0 else None,
+        'peak': float(magnitude.max()),
+        'peaks': np.clip(np.round(peaks * 255), 0, 255).astype(np.uint8)
+    }
+
+def is_wav(source):
+    return source.name.lower().endswith('.wav')
+
+class WaveformIndex:
+    # 按音频内容摘要缓存响度和波形，保存为一个npz文件，重启或重新加载阶段时只分析新音频
+    def __init__(self, path, points=WAVEFORM_POINTS, decoder=None):
+        self.path = path
+        self.points = points
+        self.decoder = decoder if decoder is not None else find_decoder()
+        self._entries = None
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        entries = {}
+        try:
+            with np.load(self.path, allow_pickle=False) as sidecar:
+                if int(sidecar['version']) == SIDECAR_VERSION and sidecar['peaks'].shape[1:] == (self.points,):
+                    for digest, decoded, loudness, peak, peaks in zip(
+                            sidecar['digests'], sidecar['decoded'], sidecar['loudness'], sidecar['peak'], sidecar['peaks']):
+                        entries[str(digest)] = {
+                            'loudness': None if np.isnan(loudness) else float(loudness),
+                            'peak': None if np.isnan(peak) else float(peak),
+                            'peaks': peaks if decoded else None
+                        }
+        except (OSError, KeyError, ValueError):
+            pass
+        return entries
+    
+    def _save(self):
+        digests = sorted(self._entries)
+        empty = np.zeros(self.points, dtype=np.uint8)
+        arrays = {
+            'version': np.array(SIDECAR_VERSION),
+            'digests': np.array(digests, dtype='U64'),
+            'decoded': np.array([self._entries[d]['peaks'] is not None for d in digests], dtype=bool),
+            'loudness': np.array([np.nan if self._entries[d]['loudness'] is None else self._entries[d]['loudness'] for d in digests], dtype=np.float32),
+            'peak': np.array([np.nan if self._entries[d]['peak'] is None else self._entries[d]['peak'] for d in digests], dtype=np.float32),
+            'peaks': np.stack([self._entries[d]['peaks'] if self._entries[d]['peaks'] is not None else empty for d in digests]) if digests else np.zeros((0, self.points), dtype=np.uint8)
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    def analyze(self, source):
+        f = source.open_range(0, source.size)
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        samples = wav_samples(data) if is_wav(source) else self.decoder(data)
+        result = analyze_samples(samples, self.points)
+        if result is None:
+            return {'loudness': None, 'peak': None, 'peaks': None}
+        return result
+    
+    def annotate(self, sources):
+        # 把响度和波形写入每个音频的meta，返回无法解码或静音的音频
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            missing = [source for source in sources if source.digest not in self._entries]
+            unanalyzed = set()
+            for source in missing:
+                if not is_wav(source) and self.decoder is None:
+                    # 不缓存，装好解码器后重新加载即可分析
+                    unanalyzed.add(source.digest)
+                    continue
+                try:
+                    self._entries[source.digest] = self.analyze(source)
+                except OSError:
+                    continue
+            if any(source.digest in self._entries for source in missing):
+                try:
+                    self._save()
+                except OSError:
+                    pass
+            entries = {source.digest: self._entries.get(source.digest) for source in sources}
+        
+        problems = []
+        for source in sources:
+            entry = entries[source.digest]
+            if 'duration' not in source.meta:
+                problems.append((source.name, '无法解析音频头'))
+                continue
+            if source.digest in unanalyzed:
+                problems.append((source.name, UNANALYZED))
+                continue
+            if entry is None:
+                continue
+            if entry['peaks'] is None:
+                problems.append((source.name, '无法解码'))
+                continue
+            source.meta['loudness'] = entry['loudness']
+            source.meta['peaks'] = entry['peaks'].tolist()
+            if entry['loudness'] is None or entry['loudness'] < SILENCE_DBFS:
+                problems.append((source.name, '静音'))
+        return problems
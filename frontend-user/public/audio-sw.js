@@ -0,0 +1,123 @@
+// 离线音频缓存：按阶段把音频包下载到Cache Storage，播放时优先从缓存返回
+const CACHE_PREFIX = 'survey-audio-'
+const DOWNLOAD_CONCURRENCY = 2
+const DOWNLOAD_RETRIES = 3
+
+self.addEventListener('install', () => {
+  self.skipWaiting()
+})
+
+self.addEventListener('activate', event => {
+  event.waitUntil(self.clients.claim())
+})
+
+const stageCachePrefix = manifest => `${CACHE_PREFIX}${manifest.survey_type}-${manifest.stage}-`
+
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms))
+
+const toHex = buffer => Array.from(new Uint8Array(buffer)).map(byte => byte.toString(16).padStart(2, '0')).join('')
+
+// 服务端返回原始音频时ETag就是内容的sha256，可以校验；返回转码后的音频时不校验
+const verifyClip = async (clip, response, body) => {
+  const etag = (response.headers.get('ETag') || '').replace(/"/g, '')
+  if (!clip.sha256 || etag !== clip.sha256 || !self.crypto?.subtle) {
+    return true
+  }
+  return toHex(await self.crypto.subtle.digest('SHA-256', body)) === clip.sha256
+}
+
+const downloadClip = async (cache, clip) => {
+  if (await cache.match(clip.url, { ignoreVary: true })) {
+    return
+  }
+  for (let attempt = 0; ; attempt++) {
+    const response = await fetch(clip.url, { credentials: 'include' })
+    if (response.status === 503 && attempt < DOWNLOAD_RETRIES) {
+      await sleep((Number(response.headers.get('Retry-After')) || 1) * 1000)
+      continue
+    }
+    if (!response.ok) {
+      throw new Error(`${clip.url}: ${response.status}`)
+    }
+    const body = await response.arrayBuffer()
+    if (!(await verifyClip(clip, response, body))) {
+      throw new Error(`${clip.url}: 内容校验失败`)
+    }
+    await cache.put(clip.url, new Response(body, { status: 200, headers: response.headers }))
+    return
+  }
+}
+
+const cacheBundle = async (manifest, report) => {
+  const prefix = stageCachePrefix(manifest)
+  const name = `${prefix}${manifest.bundle_version}`
+  const names = await caches.keys()
+  await Promise.all(names.filter(key => key.startsWith(prefix) && key !== name).map(key => caches.delete(key)))
+  const cache = await caches.open(name)
+  const clips = manifest.clips || []
+  const progress = { status: 'loading', done: 0, total: clips.length, bytes: 0, totalBytes: manifest.total_bytes || 0 }
+  report({ ...progress })
+  let next = 0
+  const worker = async () => {
+    while (next < clips.length) {
+      const clip = clips[next++]
+      await downloadClip(cache, clip)
+      progress.done += 1
+      progress.bytes += clip.size || 0
+      report({ ...progress })
+    }
+  }
+  await Promise.all(Array.from({ length: DOWNLOAD_CONCURRENCY }, worker))
+  report({ ...progress, status: 'ready' })
+}
+
+self.addEventListener('message', event => {
+  const { type, manifest } = event.data || {}
+  const port = event.ports[0]
+  if (type !== 'cache-bundle' || !manifest || !port) {
+    return
+  }
+  event.waitUntil(
+    cacheBundle(manifest, progress => port.postMessage(progress))
+      .catch(error => port.postMessage({ status: 'error', message: String(error) }))
+  )
+})
+
+// <audio>会发Range请求，从缓存返回时按范围切出206响应
+const rangeResponse = async (cached, range) => {
+  const body = await cached.arrayBuffer()
+  const size = body.byteLength
+  const match = /^bytes=(\d*)-(\d*)$/.exec(range.trim())
+  let start = match && match[1] ? Number(match[1]) : NaN
+  let end = match && match[2] ? Number(match[2]) : size - 1
+  if (match && !match[1] && match[2]) {
+    start = Math.max(size - Number(match[2]), 0)
+    end = size - 1
+  }
+  if (!match || Number.isNaN(start) || start >= size || end < start) {
+    return new Response(null, { status: 416, headers: { 'Content-Range': `bytes */${size}` } })
+  }
+  end = Math.min(end, size - 1)
+  const headers = new Headers(cached.headers)
+  headers.set('Content-Range', `bytes ${start}-${end}/${size}`)
+  headers.set('Content-Length', String(end - start + 1))
+  headers.set('Accept-Ranges', 'bytes')
+  return new Response(body.slice(start, end + 1), { status: 206, headers })
+}
+
+const cachedAudio = async request => {
+  const cached = await caches.match(request.url, { ignoreVary: true })
+  if (!cached) {
+    return fetch(request)
+  }
+  const range = request.headers.get('Range')
+  return range ? rangeResponse(cached, range) : cached
+}
+
+self.addEventListener('fetch', event => {
+  const url = new URL(event.request.url)
+  if (event.request.method !== 'GET' || url.origin !== self.location.origin || !url.pathname.startsWith('/api/audio/')) {
+    return
+  }
+  event.respondWith(cachedAudio(event.request))
+})
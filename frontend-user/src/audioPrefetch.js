@@ -0,0 +1,103 @@
+import { useCallback, useEffect, useRef, useState } from 'react'
+
+const DEFAULT_AHEAD = Number(import.meta.env.VITE_PREFETCH_AHEAD || 3)
+const DEFAULT_BYTE_BUDGET = Number(import.meta.env.VITE_PREFETCH_BYTES || 16 * 1024 * 1024)
+const NO_ITEMS = []
+
+export const itemClips = (item) => {
+  if (!item) {
+    return []
+  }
+  if (Array.isArray(item.options)) {
+    return item.options.filter(option => option.audio)
+  }
+  return item.audio ? [item] : []
+}
+
+const releaseEntry = (entry) => {
+  entry.controller.abort()
+  if (entry.objectUrl) {
+    URL.revokeObjectURL(entry.objectUrl)
+  }
+}
+
+export function useAudioPrefetch(items, currentIndex, options = {}) {
+  items = items || NO_ITEMS
+  const ahead = options.ahead ?? DEFAULT_AHEAD
+  const byteBudget = options.byteBudget ?? DEFAULT_BYTE_BUDGET
+  const entriesRef = useRef(new Map())
+  const pinnedRef = useRef({ key: null, sources: new Map() })
+  const [, setReadyCount] = useState(0)
+
+  useEffect(() => {
+    const entries = entriesRef.current
+    const currentUrls = new Set(itemClips(items[currentIndex]).map(clip => clip.audio))
+    const wanted = new Set(currentUrls)
+    let usedBytes = 0
+    entries.forEach((entry, url) => {
+      if (currentUrls.has(url)) {
+        usedBytes += entry.size
+      }
+    })
+
+    const upcoming = []
+    for (let index = currentIndex + 1; index < items.length && index <= currentIndex + ahead; index++) {
+      upcoming.push(...itemClips(items[index]))
+    }
+    for (const clip of upcoming) {
+      const size = clip.size || 0
+      if (usedBytes + size > byteBudget) {
+        break
+      }
+      usedBytes += size
+      wanted.add(clip.audio)
+    }
+
+    entries.forEach((entry, url) => {
+      if (!wanted.has(url) || (currentUrls.has(url) && !entry.objectUrl)) {
+        releaseEntry(entry)
+        entries.delete(url)
+      }
+    })
+
+    upcoming.forEach(clip => {
+      if (!wanted.has(clip.audio) || entries.has(clip.audio)) {
+        return
+      }
+      const entry = { controller: new AbortController(), objectUrl: null, size: clip.size || 0 }
+      entries.set(clip.audio, entry)
+      fetch(clip.audio, { signal: entry.controller.signal, credentials: 'include' })
+        .then(res => (res.ok ? res.blob() : Promise.reject(new Error(res.statusText))))
+        .then(blob => {
+          if (entries.get(clip.audio) === entry) {
+            entry.objectUrl = URL.createObjectURL(blob)
+            setReadyCount(count => count + 1)
+          }
+        })
+        .catch(() => {
+          if (entries.get(clip.audio) === entry) {
+            entries.delete(clip.audio)
+          }
+        })
+    })
+  }, [items, currentIndex, ahead, byteBudget])
+
+  useEffect(() => () => {
+    entriesRef.current.forEach(releaseEntry)
+    entriesRef.current.clear()
+  }, [])
+
+  // 题目切换时固定当前题目的音频地址，避免预取在播放途中完成导致<audio>重新加载；
+  // 按题号和音频地址判断是否换了题，题目窗口合并产生新的items数组时不会重新选择地址
+  const currentKey = `${currentIndex}:${itemClips(items[currentIndex]).map(clip => clip.audio).join('|')}`
+  return useCallback((url) => {
+    if (pinnedRef.current.key !== currentKey) {
+      pinnedRef.current = { key: currentKey, sources: new Map() }
+    }
+    const sources = pinnedRef.current.sources
+    if (!sources.has(url)) {
+      sources.set(url, entriesRef.current.get(url)?.objectUrl || url)
+    }
+    return sources.get(url)
+  }, [currentKey])
+}
@@ -1,5 +1,19 @@
 import axios from 'axios'
 
+const OVERLOAD_RETRIES = 3
+
 axios.defaults.withCredentials = true
 
+// 服务器繁忙时返回503和Retry-After：按提示的秒数（加一点随机，避免全班同时重试）自动重试
+axios.interceptors.response.use(null, error => {
+  const { config, response } = error
+  if (!config || !response || response.status !== 503 || (config.overloadRetries || 0) >= OVERLOAD_RETRIES) {
+    return Promise.reject(error)
+  }
+  config.overloadRetries = (config.overloadRetries || 0) + 1
+  const seconds = Number(response.headers['retry-after']) || 1
+  return new Promise(resolve => setTimeout(resolve, seconds * 1000 * (1 + Math.random() * 0.5)))
+    .then(() => axios(config))
+})
+
 export default axios
@@ -0,0 +1,34 @@
+import axios from './axiosConfig'
+
+export const fetchCheckpoints = (surveyType, studentId) => (
+  axios.get(`/api/surveys/${surveyType}/checkpoint`, { params: { student_id: studentId } })
+    .then(res => res.data?.checkpoints || {})
+    .catch(() => ({}))
+)
+
+// 每次作答只发送变化的部分，失败时静默忽略，不影响答题
+export const saveCheckpoint = (surveyType, checkpoint) => {
+  const studentId = sessionStorage.getItem('user_student_id')
+  if (!studentId) {
+    return
+  }
+  axios.patch(`/api/surveys/${surveyType}/checkpoint`, {
+    student_id: studentId,
+    ...checkpoint
+  }).catch(() => {})
+}
+
+export const restoreCheckpoint = (checkpoint, items, datasetVersion) => {
+  if (!checkpoint || items.length === 0 || checkpoint.dataset_version !== datasetVersion) {
+    return null
+  }
+  const answers = {}
+  Object.entries(checkpoint.answers || {}).forEach(([index, answer]) => {
+    const position = Number(index)
+    if (Number.isInteger(position) && position >= 0 && position < items.length) {
+      answers[position] = answer
+    }
+  })
+  const position = Math.min(Math.max(Number(checkpoint.position) || 0, 0), items.length - 1)
+  return { answers, position }
+}
@@ -0,0 +1,61 @@
+import { useEffect, useRef } from 'react'
+import axios from './axiosConfig'
+
+export const ITEM_WINDOW_SIZE = Number(import.meta.env.VITE_ITEM_WINDOW || 20)
+const WINDOW_AHEAD = Number(import.meta.env.VITE_ITEM_WINDOW_AHEAD || 10)
+const keepItem = item => item
+
+export const fetchItemWindow = (surveyType, params, cursor = 0) => (
+  axios.get(`/api/surveys/${surveyType}/items`, {
+    params: { ...params, cursor, limit: ITEM_WINDOW_SIZE }
+  }).then(res => res.data)
+)
+
+// 题目列表是长度为total的稀疏数组，尚未取到的位置为undefined
+export const mergeItemWindow = (items, data, transform = keepItem) => {
+  const total = data.total ?? (data.items || []).length
+  const merged = items.length === total ? items.slice() : new Array(total).fill(undefined)
+  ;(data.items || []).forEach((item, offset) => {
+    merged[(data.cursor || 0) + offset] = transform(item)
+  })
+  return merged
+}
+
+// 当前题目和之后WINDOW_AHEAD题中有未取到的，就从第一个缺口开始取下一个窗口
+export function useItemWindows(surveyType, params, items, setItems, datasetVersion, currentIndex, options = {}) {
+  const pendingRef = useRef(new Set())
+  const paramsKey = JSON.stringify(params)
+  const { transform = keepItem, onStale } = options
+
+  useEffect(() => {
+    if (!datasetVersion || items.length === 0) {
+      return
+    }
+    const end = Math.min(items.length, currentIndex + WINDOW_AHEAD + 1)
+    let start = -1
+    for (let index = Math.max(currentIndex, 0); index < end; index++) {
+      if (items[index] === undefined) {
+        start = index
+        break
+      }
+    }
+    const requestKey = `${datasetVersion}:${start}`
+    if (start < 0 || pendingRef.current.has(requestKey)) {
+      return
+    }
+    pendingRef.current.add(requestKey)
+    fetchItemWindow(surveyType, { ...params, dataset_version: datasetVersion }, start)
+      .then(data => {
+        if (data.dataset_version !== datasetVersion) {
+          // 服务端数据已更新且旧版本已不可用，不能把两个版本的题目混在一起
+          onStale?.()
+          return
+        }
+        setItems(prev => mergeItemWindow(prev, data, transform))
+      })
+      .catch(() => {})
+      .finally(() => {
+        pendingRef.current.delete(requestKey)
+      })
+  }, [surveyType, paramsKey, items, datasetVersion, currentIndex])
+}
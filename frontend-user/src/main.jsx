@@ -2,6 +2,13 @@ import React from 'react'
 import ReactDOM from 'react-dom/client'
 import App from './App'
 import './index.css'
+import { startOfflineSync } from './offlineAnswers'
+import { registerAudioWorker } from './offlineBundle'
+import { startPlaybackTelemetry } from './playbackTelemetry'
+
+registerAudioWorker()
+startOfflineSync()
+startPlaybackTelemetry()
 
 ReactDOM.createRoot(document.getElementById('root')).render(
   <React.StrictMode>
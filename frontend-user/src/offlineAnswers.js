@@ -0,0 +1,67 @@
+import axios from './axiosConfig'
+
+const QUEUE_KEY = 'pending_submissions'
+
+const readQueue = () => {
+  try {
+    const stored = localStorage.getItem(QUEUE_KEY)
+    return stored ? JSON.parse(stored) : []
+  } catch {
+    return []
+  }
+}
+
+const writeQueue = (queue) => {
+  try {
+    if (queue.length) {
+      localStorage.setItem(QUEUE_KEY, JSON.stringify(queue))
+    } else {
+      localStorage.removeItem(QUEUE_KEY)
+    }
+  } catch {}
+}
+
+// 提交答案；queueOffline时网络不通（没有收到任何响应）的提交保存在本机，联网后自动补交
+export const submitAnswers = (surveyType, payload, { queueOffline = false } = {}) => (
+  axios.post(`/api/surveys/${surveyType}/submit`, payload)
+    .then(res => res.data)
+    .catch(error => {
+      if (!queueOffline || error.response) {
+        throw error
+      }
+      writeQueue([...readQueue(), { surveyType, payload }])
+      return { queued: true }
+    })
+)
+
+let flushing = false
+
+export const flushQueuedSubmissions = async () => {
+  if (flushing) {
+    return
+  }
+  flushing = true
+  try {
+    let queue = readQueue()
+    while (queue.length) {
+      const [entry] = queue
+      try {
+        await axios.post(`/api/surveys/${entry.surveyType}/submit`, entry.payload)
+      } catch (error) {
+        // 仍然没有网络或服务器繁忙时下次再试；服务器明确拒绝的提交重试也不会成功，丢弃
+        if (!error.response || error.response.status >= 500) {
+          break
+        }
+      }
+      queue = readQueue().slice(1)
+      writeQueue(queue)
+    }
+  } finally {
+    flushing = false
+  }
+}
+
+export const startOfflineSync = () => {
+  window.addEventListener('online', flushQueuedSubmissions)
+  flushQueuedSubmissions()
+}
@@ -0,0 +1,70 @@
+import { useEffect, useState } from 'react'
+import axios from './axiosConfig'
+
+const WORKER_URL = '/audio-sw.js'
+const OFFLINE_ENABLED = import.meta.env.VITE_OFFLINE_AUDIO !== '0'
+const UNSUPPORTED = { status: 'unsupported', done: 0, total: 0 }
+
+const workerSupported = () => OFFLINE_ENABLED && typeof navigator !== 'undefined' && 'serviceWorker' in navigator && 'caches' in window
+
+export const registerAudioWorker = () => {
+  if (!workerSupported()) {
+    return
+  }
+  navigator.serviceWorker.register(WORKER_URL).catch(() => {})
+}
+
+const activeWorker = () => navigator.serviceWorker.ready.then(registration => registration.active)
+
+// 取阶段的离线音频包清单交给service worker下载，返回下载进度
+export function useStageBundle(surveyType, params, enabled) {
+  const [progress, setProgress] = useState(workerSupported() ? { status: 'idle', done: 0, total: 0 } : UNSUPPORTED)
+  const paramsKey = JSON.stringify(params)
+
+  useEffect(() => {
+    if (!enabled || !workerSupported()) {
+      return undefined
+    }
+    let cancelled = false
+    let channel = null
+    setProgress({ status: 'loading', done: 0, total: 0 })
+    Promise.all([
+      axios.get(`/api/surveys/${surveyType}/bundle`, { params }).then(res => res.data),
+      activeWorker()
+    ]).then(([manifest, worker]) => {
+      if (cancelled || !worker) {
+        return
+      }
+      channel = new MessageChannel()
+      channel.port1.onmessage = event => {
+        if (!cancelled) {
+          setProgress(event.data)
+        }
+      }
+      worker.postMessage({ type: 'cache-bundle', manifest }, [channel.port2])
+    }).catch(() => {
+      if (!cancelled) {
+        setProgress({ status: 'error', done: 0, total: 0 })
+      }
+    })
+    return () => {
+      cancelled = true
+      channel?.port1.close()
+    }
+  }, [surveyType, paramsKey, enabled])
+
+  return progress
+}
+
+export const bundleStatusText = (progress) => {
+  if (progress.status === 'loading') {
+    return progress.total ? `正在缓存音频 ${progress.done} / ${progress.total}` : '正在准备离线音频...'
+  }
+  if (progress.status === 'ready') {
+    return '音频已缓存，网络中断时也可以继续答题'
+  }
+  if (progress.status === 'error') {
+    return '音频缓存失败，答题时将在线播放'
+  }
+  return ''
+}
@@ -1,6 +1,12 @@
 import { useState, useEffect, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
 import axios from '../axiosConfig'
+import { useAudioPrefetch } from '../audioPrefetch'
+import { fetchCheckpoints, restoreCheckpoint, saveCheckpoint } from '../checkpoint'
+import { fetchItemWindow, mergeItemWindow, useItemWindows } from '../itemWindows'
+import { submitAnswers } from '../offlineAnswers'
+import { bundleStatusText, useStageBundle } from '../offlineBundle'
+import { usePlaybackTelemetry } from '../playbackTelemetry'
 import './Survey.css'
 
 function Survey1() {
@@ -9,17 +15,35 @@ function Survey1() {
   const [phase, setPhase] = useState('intro')
   const [accessGranted, setAccessGranted] = useState(false)
   const [guideItems, setGuideItems] = useState([])
+  const [guideVersion, setGuideVersion] = useState(null)
   const [guideIndex, setGuideIndex] = useState(0)
   const [guideAnswers, setGuideAnswers] = useState({})
   const [guideLoading, setGuideLoading] = useState(true)
   const [guideSubmitting, setGuideSubmitting] = useState(false)
   const [guideResult, setGuideResult] = useState(null)
   const [testItems, setTestItems] = useState([])
+  const [testVersion, setTestVersion] = useState(null)
   const [testIndex, setTestIndex] = useState(0)
   const [testAnswers, setTestAnswers] = useState({})
   const [testLoading, setTestLoading] = useState(false)
   const [testSubmitting, setTestSubmitting] = useState(false)
   const [errorMessage, setErrorMessage] = useState('')
+  const [submitQueued, setSubmitQueued] = useState(false)
+  const guideBundle = useStageBundle(1, { stage: 'guide' }, accessGranted)
+  const testBundle = useStageBundle(1, { stage: 'test', student_id: sessionStorage.getItem('user_student_id') }, accessGranted)
+  const resolveAudio = useAudioPrefetch(
+    phase === 'guide' ? guideItems : (phase === 'test' ? testItems : null),
+    phase === 'guide' ? guideIndex : testIndex
+  )
+  const trackPlayback = usePlaybackTelemetry(
+    1,
+    phase === 'guide' ? 'guide' : 'test',
+    phase === 'guide' ? guideVersion : testVersion,
+    phase === 'guide' ? guideIndex : testIndex
+  )
+  const handleStaleItems = () => setErrorMessage('题目数据已更新，请返回主页后重新进入。')
+  useItemWindows(1, { stage: 'guide' }, guideItems, setGuideItems, guideVersion, guideIndex, { onStale: handleStaleItems })
+  useItemWindows(1, { stage: 'test', student_id: sessionStorage.getItem('user_student_id') }, testItems, setTestItems, testVersion, testIndex, { onStale: handleStaleItems })
 
   const updateCompletionStorage = (status) => {
     try {
@@ -43,14 +67,20 @@ function Survey1() {
     }
   }
 
-  const fetchGuideItems = () => {
+  const fetchGuideItems = (checkpoint = null) => {
     setGuideLoading(true)
     setErrorMessage('')
-    axios.get('/api/surveys/1/items', { params: { stage: 'guide' } })
-      .then(res => {
-        setGuideItems(res.data.items || [])
-        setGuideIndex(0)
-        setGuideAnswers({})
+    fetchItemWindow(1, { stage: 'guide' })
+      .then(data => {
+        const fetched = mergeItemWindow([], data)
+        setGuideItems(fetched)
+        setGuideVersion(data.dataset_version || null)
+        const restored = restoreCheckpoint(checkpoint, fetched, data.dataset_version || null)
+        setGuideIndex(restored ? restored.position : 0)
+        setGuideAnswers(restored ? restored.answers : {})
+        if (restored) {
+          setPhase('guide')
+        }
       })
       .catch(() => {
         setErrorMessage('引导题目加载失败，请稍后再试。')
@@ -60,14 +90,17 @@ function Survey1() {
       })
   }
 
-  const fetchTestItems = (enterAfterLoad = false) => {
+  const fetchTestItems = (enterAfterLoad = false, checkpoint = null) => {
     setTestLoading(true)
     setErrorMessage('')
-    axios.get('/api/surveys/1/items', { params: { stage: 'test' } })
-      .then(res => {
-        setTestItems(res.data.items || [])
-        setTestIndex(0)
-        setTestAnswers({})
+    fetchItemWindow(1, { stage: 'test', student_id: sessionStorage.getItem('user_student_id') })
+      .then(data => {
+        const fetched = mergeItemWindow([], data)
+        setTestItems(fetched)
+        setTestVersion(data.dataset_version || null)
+        const restored = restoreCheckpoint(checkpoint, fetched, data.dataset_version || null)
+        setTestIndex(restored ? restored.position : 0)
+        setTestAnswers(restored ? restored.answers : {})
         if (enterAfterLoad) {
           setPhase('test')
           resetAudio()
@@ -107,17 +140,30 @@ function Survey1() {
   }, [navigate])
 
   useEffect(() => {
-    if (accessGranted) {
-      fetchGuideItems()
+    if (!accessGranted) {
+      return
     }
+    const studentId = sessionStorage.getItem('user_student_id')
+    // 有未完成的进度时直接回到上次答到的题目
+    fetchCheckpoints(1, studentId).then(checkpoints => {
+      fetchGuideItems(checkpoints.test ? null : checkpoints.guide)
+      if (checkpoints.test) {
+        fetchTestItems(true, checkpoints.test)
+      }
+    })
   }, [accessGranted])
 
   const handleBack = () => {
     navigate('/')
   }
 
+  const checkpointGuide = (position, answers) => {
+    saveCheckpoint(1, { stage: 'guide', dataset_version: guideVersion, position, answers })
+  }
+
   const handleGuideAnswer = (answer) => {
     setGuideAnswers(prev => ({ ...prev, [guideIndex]: answer }))
+    checkpointGuide(guideIndex, { [guideIndex]: answer })
   }
 
   const startGuide = () => {
@@ -136,6 +182,7 @@ function Survey1() {
     }
     if (guideIndex < guideItems.length - 1) {
       setGuideIndex(guideIndex + 1)
+      checkpointGuide(guideIndex + 1)
       resetAudio()
     } else {
       submitGuide()
@@ -147,6 +194,7 @@ function Survey1() {
       return
     }
     setGuideIndex(guideIndex - 1)
+    checkpointGuide(guideIndex - 1)
     resetAudio()
   }
 
@@ -167,7 +215,8 @@ function Survey1() {
       name: name,
       email: email,
       student_id: studentId,
-      stage: 'guide'
+      stage: 'guide',
+      dataset_version: guideVersion
     }).then(res => {
       setGuideSubmitting(false)
       setGuideResult({
@@ -203,8 +252,13 @@ function Survey1() {
     }
   }
 
+  const checkpointTest = (position, answers) => {
+    saveCheckpoint(1, { stage: 'test', dataset_version: testVersion, position, answers })
+  }
+
   const handleTestAnswer = (answer) => {
     setTestAnswers(prev => ({ ...prev, [testIndex]: answer }))
+    checkpointTest(testIndex, { [testIndex]: answer })
   }
 
   const handleTestNext = () => {
@@ -213,6 +267,7 @@ function Survey1() {
     }
     if (testIndex < testItems.length - 1) {
       setTestIndex(testIndex + 1)
+      checkpointTest(testIndex + 1)
       resetAudio()
     } else {
       submitTest()
@@ -224,6 +279,7 @@ function Survey1() {
       return
     }
     setTestIndex(testIndex - 1)
+    checkpointTest(testIndex - 1)
     resetAudio()
   }
 
@@ -239,14 +295,16 @@ function Survey1() {
     const name = sessionStorage.getItem('user_name')
     const email = sessionStorage.getItem('user_email')
     const studentId = sessionStorage.getItem('user_student_id')
-    axios.post('/api/surveys/1/submit', {
+    submitAnswers(1, {
       answers: answerArray,
       name: name,
       email: email,
       student_id: studentId,
-      stage: 'test'
-    }).then(() => {
+      stage: 'test',
+      dataset_version: testVersion
+    }, { queueOffline: true }).then(result => {
       setTestSubmitting(false)
+      setSubmitQueued(!!result?.queued)
       markSurveyCompleted()
       setPhase('completed')
       resetAudio()
@@ -264,6 +322,9 @@ function Survey1() {
       return <div className="loading">暂无题目</div>
     }
     const currentItem = items[currentIndex]
+    if (!currentItem) {
+      return <div className="loading">题目加载中...</div>
+    }
     const isLast = currentIndex === items.length - 1
     const isFirst = currentIndex === 0
     const progressWidth = `${((currentIndex + 1) / items.length) * 100}%`
@@ -280,9 +341,10 @@ function Survey1() {
           <h2>请听音频，判断是否只包含一个音频事件</h2>
           <audio
             ref={audioRef}
-            src={currentItem.audio}
+            src={resolveAudio(currentItem.audio)}
             controls
             className="audio-player"
+            {...trackPlayback(currentItem.audio)}
           />
         </div>
         <div className="answer-section">
@@ -345,6 +407,7 @@ function Survey1() {
           </button>
         </div>
       )}
+      {bundleStatusText(guideBundle) && <div className="bundle-status">{bundleStatusText(guideBundle)}</div>}
     </div>
   )
 
@@ -365,6 +428,7 @@ function Survey1() {
             <button className="next-btn" onClick={handleStartTest} disabled={testLoading}>
               {testLoading ? '加载正式题目...' : '进入正式测试'}
             </button>
+            {bundleStatusText(testBundle) && <div className="bundle-status">{bundleStatusText(testBundle)}</div>}
           </>
         ) : (
           <>
@@ -380,7 +444,7 @@ function Survey1() {
 
   const renderCompleted = () => (
     <div className="completion-message">
-      正式测试已完成，感谢你的参与！页面即将跳转...
+      {submitQueued ? '网络已断开，答案已保存在本机，联网后会自动提交。' : '正式测试已完成，感谢你的参与！页面即将跳转...'}
     </div>
   )
 
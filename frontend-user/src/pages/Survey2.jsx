@@ -1,6 +1,12 @@
 import { useState, useEffect, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
 import axios from '../axiosConfig'
+import { useAudioPrefetch } from '../audioPrefetch'
+import { fetchCheckpoints, restoreCheckpoint, saveCheckpoint } from '../checkpoint'
+import { fetchItemWindow, mergeItemWindow, useItemWindows } from '../itemWindows'
+import { submitAnswers } from '../offlineAnswers'
+import { bundleStatusText, useStageBundle } from '../offlineBundle'
+import { usePlaybackTelemetry } from '../playbackTelemetry'
 import './Survey.css'
 
 function Survey2() {
@@ -9,17 +15,32 @@ function Survey2() {
   const [phase, setPhase] = useState('intro')
   const [accessGranted, setAccessGranted] = useState(false)
   const [guideItems, setGuideItems] = useState([])
+  const [guideVersion, setGuideVersion] = useState(null)
   const [guideIndex, setGuideIndex] = useState(0)
   const [guideAnswers, setGuideAnswers] = useState({})
   const [guideLoading, setGuideLoading] = useState(true)
   const [guideSubmitting, setGuideSubmitting] = useState(false)
   const [guideResult, setGuideResult] = useState(null)
   const [testItems, setTestItems] = useState([])
+  const [testVersion, setTestVersion] = useState(null)
   const [testIndex, setTestIndex] = useState(0)
   const [testAnswers, setTestAnswers] = useState({})
   const [testLoading, setTestLoading] = useState(false)
   const [testSubmitting, setTestSubmitting] = useState(false)
   const [errorMessage, setErrorMessage] = useState('')
+  const [submitQueued, setSubmitQueued] = useState(false)
+  const guideBundle = useStageBundle(2, { stage: 'guide' }, accessGranted)
+  const testBundle = useStageBundle(2, { stage: 'test', student_id: sessionStorage.getItem('user_student_id') }, accessGranted)
+  const resolveAudio = useAudioPrefetch(
+    phase === 'guide' ? guideItems : (phase === 'test' ? testItems : null),
+    phase === 'guide' ? guideIndex : testIndex
+  )
+  const trackPlayback = usePlaybackTelemetry(
+    2,
+    phase === 'guide' ? 'guide' : 'test',
+    phase === 'guide' ? guideVersion : testVersion,
+    phase === 'guide' ? guideIndex : testIndex
+  )
 
   const updateCompletionStorage = (status) => {
     try {
@@ -45,6 +66,20 @@ function Survey2() {
     return shuffled
   }
 
+  const shuffleItemTags = item => ({
+    ...item,
+    tags: shuffleTags(item.tags || [])
+  })
+  const handleStaleItems = () => setErrorMessage('题目数据已更新，请返回主页后重新进入。')
+  useItemWindows(2, { stage: 'guide' }, guideItems, setGuideItems, guideVersion, guideIndex, {
+    transform: shuffleItemTags,
+    onStale: handleStaleItems
+  })
+  useItemWindows(2, { stage: 'test', student_id: sessionStorage.getItem('user_student_id') }, testItems, setTestItems, testVersion, testIndex, {
+    transform: shuffleItemTags,
+    onStale: handleStaleItems
+  })
+
   const resetAudio = () => {
     if (audioRef.current) {
       audioRef.current.pause()
@@ -52,18 +87,20 @@ function Survey2() {
     }
   }
 
-  const fetchGuideItems = () => {
+  const fetchGuideItems = (checkpoint = null) => {
     setGuideLoading(true)
     setErrorMessage('')
-    axios.get('/api/surveys/2/items', { params: { stage: 'guide' } })
-      .then(res => {
-        const fetched = (res.data.items || []).map(item => ({
-          ...item,
-          tags: shuffleTags(item.tags || [])
-        }))
+    fetchItemWindow(2, { stage: 'guide' })
+      .then(data => {
+        const fetched = mergeItemWindow([], data, shuffleItemTags)
         setGuideItems(fetched)
-        setGuideIndex(0)
-        setGuideAnswers({})
+        setGuideVersion(data.dataset_version || null)
+        const restored = restoreCheckpoint(checkpoint, fetched, data.dataset_version || null)
+        setGuideIndex(restored ? restored.position : 0)
+        setGuideAnswers(restored ? restored.answers : {})
+        if (restored) {
+          setPhase('guide')
+        }
       })
       .catch(() => {
         setErrorMessage('引导题目加载失败，请稍后再试。')
@@ -73,18 +110,17 @@ function Survey2() {
       })
   }
 
-  const fetchTestItems = (enterAfterLoad = false) => {
+  const fetchTestItems = (enterAfterLoad = false, checkpoint = null) => {
     setTestLoading(true)
     setErrorMessage('')
-    axios.get('/api/surveys/2/items', { params: { stage: 'test' } })
-      .then(res => {
-        const fetched = (res.data.items || []).map(item => ({
-          ...item,
-          tags: shuffleTags(item.tags || [])
-        }))
+    fetchItemWindow(2, { stage: 'test', student_id: sessionStorage.getItem('user_student_id') })
+      .then(data => {
+        const fetched = mergeItemWindow([], data, shuffleItemTags)
         setTestItems(fetched)
-        setTestIndex(0)
-        setTestAnswers({})
+        setTestVersion(data.dataset_version || null)
+        const restored = restoreCheckpoint(checkpoint, fetched, data.dataset_version || null)
+        setTestIndex(restored ? restored.position : 0)
+        setTestAnswers(restored ? restored.answers : {})
         if (enterAfterLoad) {
           setPhase('test')
           resetAudio()
@@ -124,9 +160,17 @@ function Survey2() {
   }, [navigate])
 
   useEffect(() => {
-    if (accessGranted) {
-      fetchGuideItems()
+    if (!accessGranted) {
+      return
     }
+    const studentId = sessionStorage.getItem('user_student_id')
+    // 有未完成的进度时直接回到上次答到的题目
+    fetchCheckpoints(2, studentId).then(checkpoints => {
+      fetchGuideItems(checkpoints.test ? null : checkpoints.guide)
+      if (checkpoints.test) {
+        fetchTestItems(true, checkpoints.test)
+      }
+    })
   }, [accessGranted])
 
   const handleBack = () => {
@@ -143,8 +187,13 @@ function Survey2() {
     resetAudio()
   }
 
+  const checkpointGuide = (position, answers) => {
+    saveCheckpoint(2, { stage: 'guide', dataset_version: guideVersion, position, answers })
+  }
+
   const handleGuideAnswer = (answer) => {
     setGuideAnswers(prev => ({ ...prev, [guideIndex]: answer }))
+    checkpointGuide(guideIndex, { [guideIndex]: answer })
   }
 
   const handleGuideNext = () => {
@@ -153,6 +202,7 @@ function Survey2() {
     }
     if (guideIndex < guideItems.length - 1) {
       setGuideIndex(guideIndex + 1)
+      checkpointGuide(guideIndex + 1)
       resetAudio()
     } else {
       submitGuide()
@@ -164,6 +214,7 @@ function Survey2() {
       return
     }
     setGuideIndex(guideIndex - 1)
+    checkpointGuide(guideIndex - 1)
     resetAudio()
   }
 
@@ -184,7 +235,8 @@ function Survey2() {
       name: name,
       email: email,
       student_id: studentId,
-      stage: 'guide'
+      stage: 'guide',
+      dataset_version: guideVersion
     }).then(res => {
       setGuideSubmitting(false)
       setGuideResult({
@@ -220,8 +272,13 @@ function Survey2() {
     }
   }
 
+  const checkpointTest = (position, answers) => {
+    saveCheckpoint(2, { stage: 'test', dataset_version: testVersion, position, answers })
+  }
+
   const handleTestAnswer = (answer) => {
     setTestAnswers(prev => ({ ...prev, [testIndex]: answer }))
+    checkpointTest(testIndex, { [testIndex]: answer })
   }
 
   const handleTestNext = () => {
@@ -230,6 +287,7 @@ function Survey2() {
     }
     if (testIndex < testItems.length - 1) {
       setTestIndex(testIndex + 1)
+      checkpointTest(testIndex + 1)
       resetAudio()
     } else {
       submitTest()
@@ -241,6 +299,7 @@ function Survey2() {
       return
     }
     setTestIndex(testIndex - 1)
+    checkpointTest(testIndex - 1)
     resetAudio()
   }
 
@@ -256,14 +315,16 @@ function Survey2() {
     const name = sessionStorage.getItem('user_name')
     const email = sessionStorage.getItem('user_email')
     const studentId = sessionStorage.getItem('user_student_id')
-    axios.post('/api/surveys/2/submit', {
+    submitAnswers(2, {
       answers: answerArray,
       name: name,
       email: email,
       student_id: studentId,
-      stage: 'test'
-    }).then(() => {
+      stage: 'test',
+      dataset_version: testVersion
+    }, { queueOffline: true }).then(result => {
       setTestSubmitting(false)
+      setSubmitQueued(!!result?.queued)
       markSurveyCompleted()
       setPhase('completed')
       resetAudio()
@@ -281,7 +342,10 @@ function Survey2() {
       return <div className="loading">暂无题目</div>
     }
     const currentItem = items[currentIndex]
-    const tags = currentItem?.tags || []
+    if (!currentItem) {
+      return <div className="loading">题目加载中...</div>
+    }
+    const tags = currentItem.tags || []
     const isLast = currentIndex === items.length - 1
     const isFirst = currentIndex === 0
     const progressWidth = `${((currentIndex + 1) / items.length) * 100}%`
@@ -298,9 +362,10 @@ function Survey2() {
           <h2>请听音频，从四个标签中选择对应的音频事件</h2>
           <audio
             ref={audioRef}
-            src={currentItem.audio}
+            src={resolveAudio(currentItem.audio)}
             controls
             className="audio-player"
+            {...trackPlayback(currentItem.audio)}
           />
         </div>
         <div className="tags-section">
@@ -358,6 +423,7 @@ function Survey2() {
           </button>
         </div>
       )}
+      {bundleStatusText(guideBundle) && <div className="bundle-status">{bundleStatusText(guideBundle)}</div>}
     </div>
   )
 
@@ -378,6 +444,7 @@ function Survey2() {
             <button className="next-btn" onClick={handleStartTest} disabled={testLoading}>
               {testLoading ? '加载正式题目...' : '进入正式测试'}
             </button>
+            {bundleStatusText(testBundle) && <div className="bundle-status">{bundleStatusText(testBundle)}</div>}
           </>
         ) : (
           <>
@@ -393,7 +460,7 @@ function Survey2() {
 
   const renderCompleted = () => (
     <div className="completion-message">
-      正式测试已完成，感谢你的参与！页面即将跳转...
+      {submitQueued ? '网络已断开，答案已保存在本机，联网后会自动提交。' : '正式测试已完成，感谢你的参与！页面即将跳转...'}
     </div>
   )
 
@@ -1,6 +1,12 @@
 import { useState, useEffect, useRef } from 'react'
 import { useNavigate } from 'react-router-dom'
 import axios from '../axiosConfig'
+import { useAudioPrefetch } from '../audioPrefetch'
+import { fetchCheckpoints, restoreCheckpoint, saveCheckpoint } from '../checkpoint'
+import { fetchItemWindow, mergeItemWindow, useItemWindows } from '../itemWindows'
+import { submitAnswers } from '../offlineAnswers'
+import { bundleStatusText, useStageBundle } from '../offlineBundle'
+import { usePlaybackTelemetry } from '../playbackTelemetry'
 import './Survey.css'
 
 function Survey3() {
@@ -10,11 +16,19 @@ function Survey3() {
   const [phase, setPhase] = useState('intro')
   const [accessGranted, setAccessGranted] = useState(false)
   const [items, setItems] = useState([])
+  const [datasetVersion, setDatasetVersion] = useState(null)
   const [currentIndex, setCurrentIndex] = useState(0)
   const [answers, setAnswers] = useState({})
   const [loading, setLoading] = useState(true)
   const [submitting, setSubmitting] = useState(false)
   const [errorMessage, setErrorMessage] = useState('')
+  const [submitQueued, setSubmitQueued] = useState(false)
+  const bundle = useStageBundle(3, { student_id: sessionStorage.getItem('user_student_id') }, accessGranted)
+  const resolveAudio = useAudioPrefetch(phase === 'test' ? items : null, currentIndex)
+  const trackPlayback = usePlaybackTelemetry(3, 'test', datasetVersion, currentIndex)
+  useItemWindows(3, { student_id: sessionStorage.getItem('user_student_id') }, items, setItems, datasetVersion, currentIndex, {
+    onStale: () => setErrorMessage('题目数据已更新，请返回主页后重新进入。')
+  })
 
   const updateCompletionStorage = (status) => {
     try {
@@ -77,14 +91,27 @@ function Survey3() {
     if (!accessGranted) {
       return
     }
-    axios.get('/api/surveys/3/items').then(res => {
-      const fetchedItems = res.data.items || []
+    const studentId = sessionStorage.getItem('user_student_id')
+    Promise.all([
+      fetchItemWindow(3, { student_id: studentId }),
+      fetchCheckpoints(3, studentId)
+    ]).then(([data, checkpoints]) => {
+      const fetchedItems = mergeItemWindow([], data)
+      const fetchedVersion = data.dataset_version || null
       setItems(fetchedItems)
+      setDatasetVersion(fetchedVersion)
+      // 服务端进度优先，换了设备或清空缓存也能接着答
+      const restored = restoreCheckpoint(checkpoints.test, fetchedItems, fetchedVersion)
       const savedProgress = localStorage.getItem(STORAGE_KEY)
-      if (savedProgress) {
+      if (restored) {
+        setCurrentIndex(restored.position)
+        setAnswers(restored.answers)
+        setPhase('test')
+      } else if (savedProgress) {
         try {
           const progress = JSON.parse(savedProgress)
-          if (progress.currentIndex !== undefined && progress.answers) {
+          const sameDataset = !progress.datasetVersion || progress.datasetVersion === fetchedVersion
+          if (sameDataset && progress.currentIndex !== undefined && progress.answers) {
             setCurrentIndex(progress.currentIndex)
             setAnswers(progress.answers)
             if (progress.phase === 'test') {
@@ -106,29 +133,37 @@ function Survey3() {
       localStorage.setItem(STORAGE_KEY, JSON.stringify({
         currentIndex,
         answers,
-        phase
+        phase,
+        datasetVersion
       }))
     }
-  }, [currentIndex, answers, items.length, phase])
+  }, [currentIndex, answers, items.length, phase, datasetVersion])
 
   const handleBack = () => {
     localStorage.setItem(STORAGE_KEY, JSON.stringify({
       currentIndex,
       answers,
-      phase
+      phase,
+      datasetVersion
     }))
     navigate('/')
   }
 
+  const checkpointProgress = (position, changedAnswers) => {
+    saveCheckpoint(3, { stage: 'test', dataset_version: datasetVersion, position, answers: changedAnswers })
+  }
+
   const startTest = () => {
     if (items.length === 0) {
       return
     }
     setPhase('test')
+    checkpointProgress(currentIndex)
   }
 
   const handleAnswer = (answer) => {
     setAnswers(prev => ({ ...prev, [currentIndex]: answer }))
+    checkpointProgress(currentIndex, { [currentIndex]: answer })
   }
 
   const handleNext = () => {
@@ -138,6 +173,7 @@ function Survey3() {
     if (currentIndex < items.length - 1) {
       resetAudios()
       setCurrentIndex(currentIndex + 1)
+      checkpointProgress(currentIndex + 1)
     } else {
       submitSurvey(answers)
     }
@@ -149,6 +185,7 @@ function Survey3() {
     }
     resetAudios()
     setCurrentIndex(currentIndex - 1)
+    checkpointProgress(currentIndex - 1)
   }
 
   const submitSurvey = (finalAnswers) => {
@@ -165,12 +202,14 @@ function Survey3() {
     const email = sessionStorage.getItem('user_email')
     const studentId = sessionStorage.getItem('user_student_id')
     
-    axios.post('/api/surveys/3/submit', {
+    submitAnswers(3, {
       answers: answerArray,
       name: name,
       email: email,
-      student_id: studentId
-    }).then(() => {
+      student_id: studentId,
+      dataset_version: datasetVersion
+    }, { queueOffline: true }).then(result => {
+      setSubmitQueued(!!result?.queued)
       localStorage.removeItem(STORAGE_KEY)
       markSurveyCompleted()
       setPhase('completed')
@@ -199,6 +238,7 @@ function Survey3() {
           </button>
         </div>
       )}
+      {bundleStatusText(bundle) && <div className="bundle-status">{bundleStatusText(bundle)}</div>}
     </div>
   )
 
@@ -210,6 +250,9 @@ function Survey3() {
       return <div className="loading">暂无题目</div>
     }
     const currentItem = items[currentIndex]
+    if (!currentItem) {
+      return <div className="loading">题目加载中...</div>
+    }
     const options = currentItem.options || []
     const isLast = currentIndex === items.length - 1
     const isFirst = currentIndex === 0
@@ -234,9 +277,10 @@ function Survey3() {
               <div className="pair-label">音频 {idx + 1}</div>
               <audio
                 ref={(el) => setAudioRef(currentIndex, option.id, el)}
-                src={option.audio}
+                src={resolveAudio(option.audio)}
                 controls
                 className="pair-audio"
+                {...trackPlayback(option.audio)}
               />
               <button
                 className="pair-select-btn"
@@ -269,7 +313,7 @@ function Survey3() {
 
   const renderCompleted = () => (
     <div className="completion-message">
-      感谢参与对比测试，结果已保存，页面即将跳转...
+      {submitQueued ? '网络已断开，答案已保存在本机，联网后会自动提交。' : '感谢参与对比测试，结果已保存，页面即将跳转...'}
     </div>
   )
 
@@ -0,0 +1,130 @@
+import { useCallback, useRef } from 'react'
+
+const ENDPOINT = '/api/telemetry/playback'
+const TELEMETRY_ENABLED = import.meta.env.VITE_PLAYBACK_TELEMETRY !== '0'
+const FLUSH_INTERVAL = 10000
+const MAX_BATCH = 50
+
+let queue = []
+let flushTimer = null
+
+const takeBatch = () => {
+  clearTimeout(flushTimer)
+  flushTimer = null
+  if (!queue.length) {
+    return null
+  }
+  const events = queue
+  queue = []
+  return JSON.stringify({ student_id: sessionStorage.getItem('user_student_id') || '', events })
+}
+
+// sendBeacon只能用CORS安全的text/plain发送，服务端按gzip头判断是否压缩
+const sendBody = (body) => {
+  const blob = new Blob([body], { type: 'text/plain' })
+  if (navigator.sendBeacon) {
+    navigator.sendBeacon(ENDPOINT, blob)
+    return
+  }
+  fetch(ENDPOINT, { method: 'POST', body: blob, keepalive: true, credentials: 'include' }).catch(() => {})
+}
+
+const gzip = (text) => new Response(new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'))).blob()
+
+const flushQueue = () => {
+  const body = takeBatch()
+  if (!body) {
+    return
+  }
+  if (typeof CompressionStream === 'undefined') {
+    sendBody(body)
+    return
+  }
+  gzip(body).then(sendBody).catch(() => sendBody(body))
+}
+
+// 页面关闭或切到后台时来不及异步压缩，直接发送未压缩的数据
+const flushNow = () => {
+  const body = takeBatch()
+  if (body) {
+    sendBody(body)
+  }
+}
+
+const recordEvent = (event) => {
+  if (!TELEMETRY_ENABLED) {
+    return
+  }
+  queue.push(event)
+  if (queue.length >= MAX_BATCH) {
+    flushQueue()
+  } else if (!flushTimer) {
+    flushTimer = setTimeout(flushQueue, FLUSH_INTERVAL)
+  }
+}
+
+export const startPlaybackTelemetry = () => {
+  if (!TELEMETRY_ENABLED) {
+    return
+  }
+  document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+      flushNow()
+    }
+  })
+  window.addEventListener('pagehide', flushNow)
+}
+
+// 记录每段音频从显示题目（点击“下一题”）到可以流畅播放的时间、播放中的卡顿和加载失败；
+// 返回的函数生成<audio>的事件属性，clipUrl为题目中的原始音频地址（src可能是预取的blob地址）
+export function usePlaybackTelemetry(surveyType, stage, version, currentIndex) {
+  const questionRef = useRef({ key: null, shownAt: 0, clips: new Map() })
+
+  return useCallback((clipUrl) => {
+    const key = `${stage}:${version}:${currentIndex}`
+    if (questionRef.current.key !== key) {
+      questionRef.current = { key, shownAt: performance.now(), clips: new Map() }
+    }
+    const question = questionRef.current
+    if (!question.clips.has(clipUrl)) {
+      question.clips.set(clipUrl, { startedAt: question.shownAt, ready: false, stalledAt: null })
+    }
+    const clip = question.clips.get(clipUrl)
+    const record = (kind, fields) => recordEvent({ survey: surveyType, stage, version, clip: clipUrl, kind, ...fields })
+
+    return {
+      onLoadStart: () => {
+        // 出错后重新加载：从重新开始加载算起
+        if (clip.ready) {
+          clip.ready = false
+          clip.startedAt = performance.now()
+        }
+      },
+      onCanPlayThrough: (event) => {
+        if (clip.ready) {
+          return
+        }
+        clip.ready = true
+        record('ready', {
+          ms: Math.round(performance.now() - clip.startedAt),
+          prefetched: event.currentTarget.currentSrc.startsWith('blob:')
+        })
+      },
+      onWaiting: () => {
+        if (clip.ready && clip.stalledAt === null) {
+          clip.stalledAt = performance.now()
+        }
+      },
+      onPlaying: () => {
+        if (clip.stalledAt !== null) {
+          record('stall', { ms: Math.round(performance.now() - clip.stalledAt) })
+          clip.stalledAt = null
+        }
+      },
+      onError: (event) => {
+        clip.ready = true
+        record('error', { code: event.currentTarget.error?.code ?? null })
+      }
+    }
+  }, [surveyType, stage, version, currentIndex])
+}